@@ -0,0 +1,1524 @@
+import xml.etree.ElementTree as ET
+import os
+import bisect
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from utils import parsear_fecha
+
+# Directorio de datos: el motor XML guarda un archivo por colección (recursos.xml, clientes.xml, ...)
+DATA_DIR = 'data'
+
+# Archivo único usado por versiones anteriores; se reparte por colección la primera vez que se encuentra
+ARCHIVO_LEGADO = 'database.xml'
+
+# Ruta a la base SQLite (solo se usa con MOTOR_ALMACENAMIENTO=sqlite)
+SQLITE_PATH = 'data/database.sqlite3'
+
+# Motor a utilizar: 'xml' (por defecto) o 'sqlite'
+MOTOR_ALMACENAMIENTO = os.environ.get('MOTOR_ALMACENAMIENTO', 'xml')
+
+# Con XML_POR_MES=1 los consumos y las facturas se guardan en un archivo por mes
+XML_POR_MES = os.environ.get('XML_POR_MES', '0') == '1'
+
+# La bitácora de consumos del motor XML se compacta al superar este número de registros
+LIMITE_COMPACTACION = 5000
+
+# Hasta esta cantidad de consumos nuevos se insertan uno a uno en el índice temporal;
+# con más se agregan al final y las listas se vuelven a ordenar una sola vez
+LIMITE_INSERCION_INDICE = 100
+
+COLECCIONES = ['recursos', 'categorias', 'configuraciones', 'clientes', 'instancias', 'consumos', 'facturas']
+COLECCIONES_MENSUALES = ['consumos', 'facturas']
+
+# Colecciones con clave primaria: colección -> (etiqueta, campo clave, [(campo, tipo)])
+ESQUEMA = {
+    'recursos': ('recurso', 'id', [
+        ('nombre', 'texto'), ('abreviatura', 'texto'), ('metrica', 'texto'),
+        ('tipo', 'texto'), ('valorXhora', 'decimal')
+    ]),
+    'categorias': ('categoria', 'id', [
+        ('nombre', 'texto'), ('descripcion', 'texto'), ('cargaTrabajo', 'texto')
+    ]),
+    'configuraciones': ('configuracion', 'id', [
+        ('nombre', 'texto'), ('descripcion', 'texto'), ('idCategoria', 'entero')
+    ]),
+    'clientes': ('cliente', 'nit', [
+        ('nombre', 'texto'), ('usuario', 'texto'), ('clave', 'texto'),
+        ('direccion', 'texto'), ('correoElectronico', 'texto')
+    ]),
+    'instancias': ('instancia', 'id', [
+        ('idCliente', 'texto'), ('idConfiguracion', 'entero'), ('nombre', 'texto'),
+        ('fechaInicio', 'fecha'), ('estado', 'texto'), ('fechaFinal', 'fecha')
+    ]),
+    'facturas': ('factura', 'id', [
+        ('nitCliente', 'texto'), ('fechaEmision', 'fecha'), ('montoTotal', 'decimal')
+    ]),
+}
+
+# Campos de cada detalle de factura: (etiqueta XML / columna, llave del diccionario, tipo)
+CAMPOS_DETALLE = [
+    ('idInstancia', 'id_instancia', 'entero'),
+    ('nombreInstancia', 'nombre_instancia', 'texto'),
+    ('idRecurso', 'id_recurso', 'entero'),
+    ('nombreRecurso', 'nombre_recurso', 'texto'),
+    ('cantidad', 'cantidad', 'decimal'),
+    ('tiempoConsumido', 'tiempo_consumido', 'decimal'),
+    ('costoUnitario', 'costo_unitario', 'decimal'),
+    ('costoTotal', 'costo_total', 'decimal'),
+]
+
+FORMATOS_XML = {'fecha': '%d/%m/%Y', 'fecha_hora': '%d/%m/%Y %H:%M'}
+# En SQLite las fechas se guardan en ISO para poder compararlas y ordenarlas como texto
+FORMATOS_SQL = {'fecha': '%Y-%m-%d', 'fecha_hora': '%Y-%m-%d %H:%M'}
+
+def _convertir_clave(coleccion, valor):
+    """Normaliza la clave primaria: el NIT es texto, el resto son enteros"""
+    if ESQUEMA[coleccion][1] == 'nit':
+        return str(valor)
+    return int(valor)
+
+def _a_texto(valor, tipo, formatos=FORMATOS_XML):
+    if valor is None:
+        return None
+    if tipo in formatos:
+        return valor.strftime(formatos[tipo])
+    if tipo == 'texto':
+        return valor
+    return str(valor)
+
+def _de_texto(texto, tipo, formatos=FORMATOS_XML):
+    if texto is None:
+        return None
+    if tipo == 'entero':
+        return int(texto)
+    if tipo == 'decimal':
+        return float(texto)
+    if tipo in formatos:
+        return parsear_fecha(texto, formatos[tipo])
+    return texto
+
+def _clave_consumo(registro):
+    """Identifica un consumo: no se guardan dos con la misma instancia, cliente, tiempo y fechaHora"""
+    return (registro['idInstancia'], registro['nitCliente'], registro['tiempo'], registro['fechaHora'])
+
+def _desde(primera, segunda, inicio):
+    """Elementos de primera + segunda a partir de la posición inicio, sin concatenar las listas completas"""
+    if inicio >= len(primera):
+        return segunda[inicio - len(primera):]
+    return primera[inicio:] + segunda
+
+def _marcas_de_facturas_antiguas(facturas, consumos):
+    """
+    [(consumo, id de factura)] para las facturas emitidas antes de marcar los consumos
+    facturados. Sus detalles solo conservan instancia y tiempo, así que se marcan los consumos
+    del mismo cliente, instancia y tiempo con fecha hasta la emisión de la factura.
+    """
+    por_detalle = {}
+    for factura in facturas:
+        for detalle in factura['detalles']:
+            facturas_detalle = por_detalle.setdefault(
+                (factura['nitCliente'], detalle['id_instancia'], detalle['tiempo_consumido']), [])
+            if not facturas_detalle or facturas_detalle[-1] is not factura:
+                facturas_detalle.append(factura)
+    
+    marcas = []
+    for consumo in consumos:
+        for factura in por_detalle.get((consumo['nitCliente'], consumo['idInstancia'], consumo['tiempo']), []):
+            if consumo['fechaHora'].date() <= factura['fechaEmision'].date():
+                marcas.append((consumo, factura['id']))
+                break
+    return marcas
+
+def _firma_archivo(ruta):
+    """Devuelve la firma (mtime, tamaño, inodo) usada para detectar cambios en el archivo"""
+    st = os.stat(ruta)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+class DocumentoXML:
+    """Un archivo XML de una colección, cacheado en memoria hasta que cambie en disco"""
+    
+    def __init__(self, ruta, coleccion):
+        self.ruta = ruta
+        self.coleccion = coleccion
+        self.root = None
+        self.firma = None
+        # Aumenta cada vez que el árbol en memoria se reemplaza
+        self.version = 0
+    
+    def obtener(self, en_transaccion=False):
+        # Dentro de una transacción el árbol en memoria manda: no se relee el disco
+        if en_transaccion and self.root is not None:
+            return self.root
+        if not os.path.exists(self.ruta):
+            if self.root is None or self.firma is not None:
+                self.vaciar()
+            return self.root
+        firma = _firma_archivo(self.ruta)
+        if self.root is None or self.firma != firma:
+            self.root = ET.parse(self.ruta).getroot()
+            self.firma = firma
+            self.version += 1
+        return self.root
+    
+    def escribir(self):
+        tree = ET.ElementTree(self.obtener(en_transaccion=True))
+        # Intentar usar ET.indent si está disponible (Python 3.9+)
+        try:
+            ET.indent(tree, space="  ", level=0)
+        except AttributeError:
+            pass  # Ignorar si no está disponible
+        # Escribir en un temporal y reemplazar para que nadie lea un archivo a medias
+        os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+        ruta_tmp = self.ruta + '.tmp'
+        tree.write(ruta_tmp, encoding='utf-8', xml_declaration=True)
+        os.replace(ruta_tmp, self.ruta)
+        self.firma = _firma_archivo(self.ruta)
+    
+    def vaciar(self):
+        """Reemplaza el árbol en memoria por una colección vacía (sin escribirla)"""
+        self.root = ET.Element(self.coleccion)
+        self.firma = None
+        self.version += 1
+    
+    def descartar(self):
+        """Olvida el árbol en memoria; la próxima lectura vuelve a cargar el archivo"""
+        self.root = None
+        self.firma = None
+
+class MotorXML:
+    """
+    Almacena cada colección en su propio archivo XML dentro de data/ (recursos.xml,
+    clientes.xml, ...), de modo que leer el catálogo no obliga a parsear el historial de
+    consumos y facturas. Con por_mes=True los consumos y las facturas se reparten además en
+    un archivo por mes (data/consumos/2025-01.xml). Cada archivo se mantiene parseado en
+    memoria con un índice por clave primaria, y los consumos nuevos se anotan en una
+    bitácora (consumos.log) que se compacta a sus archivos periódicamente. Al facturar un
+    consumo también se anota en la bitácora el id de su factura, que pasa al atributo
+    idFactura del consumo al compactar.
+    """
+    
+    def __init__(self, directorio=DATA_DIR, por_mes=XML_POR_MES):
+        self.directorio = directorio
+        self.por_mes = por_mes
+        self.ruta_journal = os.path.join(directorio, 'consumos.log')
+        # Fragmentos ya aplicados de los envíos con Idempotency-Key: una línea por fragmento
+        self.ruta_ingestas = os.path.join(directorio, 'ingestas.log')
+        self._lock = threading.RLock()
+        self._documentos = {}
+        self._indices = {}
+        # Índice temporal de consumos (ordenado por fechaHora) para consultas por rango
+        self._indice_fechas = None
+        # (índice por clave de facturas, su tamaño, ids ordenados, ids ordenados por nit) para
+        # paginar las facturas, también las de un solo cliente
+        self._ids_facturas = None
+        # Contenido de ingestas.log en memoria (se carga la primera vez que se usa)
+        self._ingestas = None
+        self._transaccion = 0
+        self._sucios = set()
+        # Consumos y marcas de facturación ya leídos de la bitácora, hasta qué byte se leyó
+        # y lo pendiente de la transacción
+        self._journal = {'consumos': [], 'facturados': [], 'offset': 0, 'inodo': None,
+                         'pendientes': [], 'pendientes_facturados': []}
+        # Cuántos consumos hay en los archivos XML (None: se cuentan la próxima vez que se necesite);
+        # se lleva al día al compactar para no recorrer los archivos en cada escritura
+        self._total_compactados = None
+        
+        os.makedirs(directorio, exist_ok=True)
+        self._migrar_database_xml()
+        self._migrar_organizacion_mensual()
+    
+    # ---- Archivos por colección ----
+    
+    def _es_mensual(self, coleccion):
+        return self.por_mes and coleccion in COLECCIONES_MENSUALES
+    
+    def _documento(self, coleccion, mes=None):
+        """Devuelve el documento de una colección (o de un mes 'AAAA-MM' si es mensual)"""
+        if mes is None:
+            ruta = os.path.join(self.directorio, f'{coleccion}.xml')
+        else:
+            ruta = os.path.join(self.directorio, coleccion, f'{mes}.xml')
+        documento = self._documentos.get(ruta)
+        if documento is None:
+            documento = DocumentoXML(ruta, coleccion)
+            self._documentos[ruta] = documento
+        return documento
+    
+    def _documento_para(self, coleccion, fecha):
+        """Documento donde debe guardarse un registro con esa fecha"""
+        if self._es_mensual(coleccion):
+            return self._documento(coleccion, fecha.strftime('%Y-%m'))
+        return self._documento(coleccion)
+    
+    def _documentos_de(self, coleccion):
+        """Todos los documentos de una colección, en orden cronológico si es mensual"""
+        if not self._es_mensual(coleccion):
+            return [self._documento(coleccion)]
+        carpeta = os.path.join(self.directorio, coleccion)
+        meses = set()
+        if os.path.isdir(carpeta):
+            meses.update(nombre[:-4] for nombre in os.listdir(carpeta) if nombre.endswith('.xml'))
+        # Incluir meses creados en memoria dentro de una transacción aún sin escribir
+        for documento in self._documentos.values():
+            if documento.coleccion == coleccion and documento.root is not None and os.path.dirname(documento.ruta) == carpeta:
+                meses.add(os.path.basename(documento.ruta)[:-4])
+        return [self._documento(coleccion, mes) for mes in sorted(meses)]
+    
+    def _raiz(self, documento):
+        """Raíz del documento; si se recargó desde disco se descarta el índice de su colección"""
+        with self._lock:
+            anterior = documento.root
+            root = documento.obtener(bool(self._transaccion))
+            if root is not anterior:
+                self._indices.pop(documento.coleccion, None)
+            return root
+    
+    def _marcar_modificado(self, documento):
+        """Escribe el documento, o lo deja pendiente hasta confirmar la transacción"""
+        with self._lock:
+            if self._transaccion:
+                self._sucios.add(documento)
+            else:
+                documento.escribir()
+    
+    def _migrar_database_xml(self):
+        """Reparte un database.xml monolítico en archivos por colección (solo la primera vez)"""
+        ruta_legado = os.path.join(self.directorio, ARCHIVO_LEGADO)
+        if not os.path.exists(ruta_legado):
+            return
+        if any(os.path.exists(os.path.join(self.directorio, f'{c}.xml')) or
+               os.path.isdir(os.path.join(self.directorio, c)) for c in COLECCIONES):
+            return
+        
+        legado = ET.parse(ruta_legado).getroot()
+        # Las facturas del archivo único no marcaban sus consumos: se marcan al repartirlo
+        marcas = {
+            _clave_consumo(consumo): id_factura
+            for consumo, id_factura in _marcas_de_facturas_antiguas(
+                [self._factura_a_registro(elem) for elem in legado.iterfind('facturas/factura')],
+                [self._elemento_a_consumo(elem) for elem in legado.iterfind('consumos/consumo')]
+            )
+        }
+        with self.transaccion():
+            for coleccion in COLECCIONES:
+                padre = legado.find(coleccion)
+                if padre is None:
+                    continue
+                for elem in list(padre):
+                    if coleccion == 'consumos':
+                        clave = _clave_consumo(self._elemento_a_consumo(elem))
+                        if clave in marcas:
+                            elem.set('idFactura', str(marcas[clave]))
+                    if self._es_mensual(coleccion):
+                        documento = self._documento_para(coleccion, self._fecha_de_elemento(coleccion, elem))
+                    else:
+                        documento = self._documento(coleccion)
+                    self._raiz(documento).append(elem)
+                    self._sucios.add(documento)
+                for documento in self._documentos_de(coleccion):
+                    self._raiz(documento)
+                    self._sucios.add(documento)
+    
+    def _migrar_organizacion_mensual(self):
+        """
+        Si XML_POR_MES cambió desde la última ejecución, pasa los consumos y las facturas del otro
+        formato (archivo único o carpeta por mes) al actual para que no queden ocultos. Los
+        registros que ya estén en el formato actual no se repiten, así que una migración
+        interrumpida puede volver a ejecutarse.
+        """
+        for coleccion in COLECCIONES_MENSUALES:
+            carpeta = os.path.join(self.directorio, coleccion)
+            if self.por_mes:
+                ruta_unica = os.path.join(self.directorio, f'{coleccion}.xml')
+                origenes = [ruta_unica] if os.path.exists(ruta_unica) else []
+            elif os.path.isdir(carpeta):
+                origenes = [os.path.join(carpeta, nombre) for nombre in sorted(os.listdir(carpeta)) if nombre.endswith('.xml')]
+            else:
+                origenes = []
+            if not origenes:
+                continue
+            
+            print(f"🔀 Pasando {coleccion} al formato {'mensual' if self.por_mes else 'de archivo único'}")
+            tag = ESQUEMA[coleccion][0] if coleccion in ESQUEMA else 'consumo'
+            existentes = {
+                self._clave_de_elemento(coleccion, elem)
+                for documento in self._documentos_de(coleccion)
+                for elem in self._raiz(documento).findall(tag)
+            }
+            with self.transaccion():
+                for ruta in origenes:
+                    for elem in ET.parse(ruta).getroot().findall(tag):
+                        clave = self._clave_de_elemento(coleccion, elem)
+                        if clave in existentes:
+                            continue
+                        existentes.add(clave)
+                        documento = self._documento_para(coleccion, self._fecha_de_elemento(coleccion, elem))
+                        self._raiz(documento).append(elem)
+                        self._sucios.add(documento)
+            # Se borran solo después de escribir el formato nuevo
+            for ruta in origenes:
+                os.remove(ruta)
+                self._documentos.pop(ruta, None)
+            if not self.por_mes and not os.listdir(carpeta):
+                os.rmdir(carpeta)
+    
+    def _clave_de_elemento(self, coleccion, elem):
+        if coleccion == 'consumos':
+            return _clave_consumo(self._elemento_a_consumo(elem))
+        return _convertir_clave(coleccion, elem.get(ESQUEMA[coleccion][1]))
+    
+    @staticmethod
+    def _fecha_de_elemento(coleccion, elem):
+        """Fecha que decide el archivo mensual de un consumo o una factura"""
+        if coleccion == 'consumos':
+            return _de_texto(elem.find('fechaHora').text, 'fecha_hora')
+        return _de_texto(elem.find('fechaEmision').text, 'fecha')
+    
+    @contextmanager
+    def transaccion(self):
+        """
+        Agrupa varios guardados en una sola escritura a disco.
+        Los cambios se aplican a los árboles en memoria y al salir del bloque se escribe una vez
+        cada archivo modificado; si ocurre una excepción se descartan y se vuelven a leer.
+        
+        Cada archivo se reemplaza de forma atómica, pero no todos a la vez: primero se escribe la
+        bitácora y después los XML en orden de ruta. Por eso una marca de facturación solo cuenta
+        si su factura existe (ver obtener_consumos_por_rango): si el proceso se interrumpe entre
+        ambos pasos, esos consumos vuelven a quedar pendientes en lugar de quedar cobrados sin
+        factura.
+        """
+        with self._lock:
+            self._transaccion += 1
+            try:
+                yield
+            except BaseException:
+                self._transaccion -= 1
+                if self._transaccion == 0:
+                    for documento in self._sucios:
+                        documento.descartar()
+                    self._sucios = set()
+                    self._indices = {}
+                    self._total_compactados = None
+                    if self._journal['pendientes'] or self._journal['pendientes_facturados']:
+                        # El índice temporal pudo incluir lo pendiente: se reconstruye
+                        self._indice_fechas = None
+                    self._journal['pendientes'] = []
+                    self._journal['pendientes_facturados'] = []
+                raise
+            self._transaccion -= 1
+            if self._transaccion == 0:
+                sucios = self._sucios
+                self._sucios = set()
+                if self._journal['pendientes'] or self._journal['pendientes_facturados']:
+                    pendientes = self._journal['pendientes']
+                    pendientes_facturados = self._journal['pendientes_facturados']
+                    self._journal['pendientes'] = []
+                    self._journal['pendientes_facturados'] = []
+                    self._escribir_journal(pendientes, pendientes_facturados)
+                for documento in sorted(sucios, key=lambda documento: documento.ruta):
+                    documento.escribir()
+    
+    def reiniciar(self):
+        with self._lock:
+            for coleccion in COLECCIONES:
+                if self._es_mensual(coleccion):
+                    for documento in self._documentos_de(coleccion):
+                        if os.path.exists(documento.ruta):
+                            os.remove(documento.ruta)
+                        documento.descartar()
+                        self._sucios.discard(documento)
+                else:
+                    documento = self._documento(coleccion)
+                    documento.vaciar()
+                    self._marcar_modificado(documento)
+            self._indices = {}
+            self._indice_fechas = None
+            self._total_compactados = None
+            self._journal['pendientes'] = []
+            self._journal['pendientes_facturados'] = []
+            if os.path.exists(self.ruta_journal):
+                open(self.ruta_journal, 'w').close()
+            self._journal.update(consumos=[], facturados=[], offset=0)
+            if os.path.exists(self.ruta_ingestas):
+                open(self.ruta_ingestas, 'w').close()
+            self._ingestas = None
+    
+    # ---- Índices por clave primaria ----
+    
+    def _indice(self, coleccion):
+        """Devuelve el índice {clave: elemento} de una colección, construyéndolo si hace falta"""
+        with self._lock:
+            raices = [self._raiz(documento) for documento in self._documentos_de(coleccion)]
+            indice = self._indices.get(coleccion)
+            if indice is None:
+                tag, clave, _ = ESQUEMA[coleccion]
+                indice = {}
+                for root in raices:
+                    for elem in root.findall(tag):
+                        if elem.get(clave):
+                            # Igual que la búsqueda lineal: gana el primer elemento con esa clave
+                            indice.setdefault(_convertir_clave(coleccion, elem.get(clave)), elem)
+                self._indices[coleccion] = indice
+            return indice
+    
+    def _buscar(self, coleccion, clave):
+        """Búsqueda O(1) de un elemento por su clave primaria"""
+        try:
+            clave = _convertir_clave(coleccion, clave)
+        except (TypeError, ValueError):
+            return None
+        return self._indice(coleccion).get(clave)
+    
+    def _registrar(self, coleccion, clave, elem):
+        """Agrega un elemento recién creado al índice de su colección"""
+        self._indice(coleccion)[_convertir_clave(coleccion, clave)] = elem
+    
+    # ---- Colecciones con clave primaria ----
+    
+    def _elemento_a_registro(self, coleccion, elem):
+        _, clave, campos = ESQUEMA[coleccion]
+        registro = {clave: _convertir_clave(coleccion, elem.get(clave))}
+        for campo, tipo in campos:
+            hijo = elem.find(campo)
+            registro[campo] = _de_texto(hijo.text if hijo is not None else None, tipo)
+        return registro
+    
+    def guardar(self, coleccion, registro):
+        """Inserta o actualiza un registro por su clave primaria"""
+        with self._lock:
+            documento = self._documento(coleccion)
+            root = self._raiz(documento)
+            tag, clave, campos = ESQUEMA[coleccion]
+            elem = self._buscar(coleccion, registro[clave])
+            if elem is None:
+                elem = ET.SubElement(root, tag)
+                elem.set(clave, str(registro[clave]))
+                self._registrar(coleccion, registro[clave], elem)
+            
+            for campo, tipo in campos:
+                texto = _a_texto(registro.get(campo), tipo)
+                hijo = elem.find(campo)
+                if texto is None and tipo == 'fecha':
+                    # Las fechas opcionales (fechaFinal) se omiten cuando no aplican
+                    if hijo is not None:
+                        elem.remove(hijo)
+                    continue
+                if hijo is None:
+                    hijo = ET.SubElement(elem, campo)
+                hijo.text = texto
+            
+            self._marcar_modificado(documento)
+    
+    def obtener(self, coleccion, clave):
+        with self._lock:
+            elem = self._buscar(coleccion, clave)
+            if elem is None:
+                return None
+            return self._elemento_a_registro(coleccion, elem)
+    
+    def obtener_todos(self, coleccion):
+        with self._lock:
+            tag = ESQUEMA[coleccion][0]
+            return [
+                self._elemento_a_registro(coleccion, elem)
+                for documento in self._documentos_de(coleccion)
+                for elem in self._raiz(documento).findall(tag)
+            ]
+    
+    # ---- Recursos por configuración ----
+    
+    def guardar_recurso_configuracion(self, id_configuracion, id_recurso, cantidad):
+        with self._lock:
+            config_elem = self._buscar('configuraciones', id_configuracion)
+            if config_elem is None:
+                return False
+            
+            recursos_config_elem = config_elem.find('recursosConfiguracion')
+            if recursos_config_elem is None:
+                recursos_config_elem = ET.SubElement(config_elem, 'recursosConfiguracion')
+            
+            recurso_conf_existente = None
+            for r in recursos_config_elem.findall('recurso'):
+                if int(r.get('id')) == id_recurso:
+                    recurso_conf_existente = r
+                    break
+            
+            if recurso_conf_existente is not None:
+                recurso_conf_existente.text = str(cantidad)
+            else:
+                nuevo_recurso = ET.SubElement(recursos_config_elem, 'recurso')
+                nuevo_recurso.set('id', str(id_recurso))
+                nuevo_recurso.text = str(cantidad)
+            
+            self._marcar_modificado(self._documento('configuraciones'))
+            return True
+    
+    def obtener_recursos_configuracion(self, id_configuracion):
+        """Devuelve [(id_recurso, cantidad)] de una configuración"""
+        with self._lock:
+            config_elem = self._buscar('configuraciones', id_configuracion)
+            if config_elem is None:
+                return []
+            recursos_elem = config_elem.find('recursosConfiguracion')
+            if recursos_elem is None:
+                return []
+            return [(int(r.get('id')), float(r.text)) for r in recursos_elem.findall('recurso')]
+    
+    # ---- Consumos (archivos compactados + bitácora) ----
+    
+    def agregar_consumos(self, registros):
+        """
+        Anota consumos en la bitácora: no se reescribe ningún XML por cada registro.
+        Descarta los que ya existen (misma instancia, cliente, fechaHora y tiempo) y
+        devuelve cuántos se agregaron.
+        """
+        with self._lock:
+            claves = self._indice_por_fecha()['claves']
+            tuplas = []
+            vistas = set()
+            for r in registros:
+                clave = _clave_consumo(r)
+                if clave in claves or clave in vistas:
+                    continue
+                vistas.add(clave)
+                tuplas.append(clave)
+            if not tuplas:
+                return 0
+            if self._transaccion:
+                self._journal['pendientes'].extend(tuplas)
+            else:
+                self._escribir_journal(tuplas)
+            return len(tuplas)
+    
+    def marcar_consumos_facturados(self, marcas):
+        """Anota en la bitácora la factura de cada consumo: marcas = [(registro del consumo, id de factura)]"""
+        with self._lock:
+            facturados = [(_clave_consumo(registro), id_factura) for registro, id_factura in marcas]
+            if not facturados:
+                return
+            if self._transaccion:
+                self._journal['pendientes_facturados'].extend(facturados)
+            else:
+                self._escribir_journal([], facturados)
+    
+    def _escribir_journal(self, tuplas, facturados=()):
+        with self._lock:
+            lineas = []
+            for id_instancia, nit_cliente, tiempo, fecha_hora in tuplas:
+                lineas.append(json.dumps({
+                    'idInstancia': id_instancia,
+                    'nitCliente': nit_cliente,
+                    'tiempo': tiempo,
+                    'fechaHora': fecha_hora.strftime('%d/%m/%Y %H:%M')
+                }) + '\n')
+            for (id_instancia, nit_cliente, tiempo, fecha_hora), id_factura in facturados:
+                lineas.append(json.dumps({
+                    'idInstancia': id_instancia,
+                    'nitCliente': nit_cliente,
+                    'tiempo': tiempo,
+                    'fechaHora': fecha_hora.strftime('%d/%m/%Y %H:%M'),
+                    'idFactura': id_factura
+                }) + '\n')
+            with open(self.ruta_journal, 'a', encoding='utf-8') as f:
+                f.write(''.join(lineas))
+                f.flush()
+                os.fsync(f.fileno())
+            # Se compacta al llegar al límite y además al tamaño de lo ya compactado: así cada
+            # reescritura de los XML queda pagada por al menos otros tantos registros nuevos.
+            # Solo se comparan contadores: la escritura no recorre la bitácora ni los archivos
+            if self._tamano_journal() >= max(LIMITE_COMPACTACION, self._contar_compactados()):
+                self.compactar_consumos()
+    
+    def _tamano_journal(self):
+        """Consumos más marcas de la bitácora (incluyendo los pendientes), leyendo solo lo nuevo"""
+        self._leer_journal()
+        return (len(self._journal['consumos']) + len(self._journal['pendientes'])
+                + len(self._journal['facturados']) + len(self._journal['pendientes_facturados']))
+    
+    def _contar_compactados(self):
+        """Consumos en los archivos XML; solo se cuentan recorriendo los archivos la primera vez"""
+        if self._total_compactados is None:
+            self._total_compactados = sum(len(self._raiz(documento)) for documento in self._documentos_de('consumos'))
+        return self._total_compactados
+    
+    def _leer_journal(self):
+        """Lee de la bitácora solo lo escrito desde la última lectura"""
+        if not os.path.exists(self.ruta_journal):
+            self._journal.update(consumos=[], facturados=[], offset=0, inodo=None)
+            return
+        
+        st = os.stat(self.ruta_journal)
+        if st.st_ino != self._journal['inodo'] or st.st_size < self._journal['offset']:
+            # Archivo nuevo o truncado por una compactación: leer desde el inicio
+            self._journal.update(consumos=[], facturados=[], offset=0, inodo=st.st_ino)
+        
+        if st.st_size > self._journal['offset']:
+            with open(self.ruta_journal, 'rb') as f:
+                f.seek(self._journal['offset'])
+                datos = f.read()
+            # Ignorar una posible última línea incompleta
+            fin = datos.rfind(b'\n') + 1
+            for linea in datos[:fin].splitlines():
+                if not linea.strip():
+                    continue
+                registro = json.loads(linea)
+                clave = (
+                    int(registro['idInstancia']),
+                    registro['nitCliente'],
+                    float(registro['tiempo']),
+                    parsear_fecha(registro['fechaHora'], '%d/%m/%Y %H:%M')
+                )
+                if 'idFactura' in registro:
+                    self._journal['facturados'].append((clave, int(registro['idFactura'])))
+                else:
+                    self._journal['consumos'].append(clave)
+            self._journal['offset'] += fin
+    
+    def _consumos_journal(self):
+        """Devuelve los consumos de la bitácora (incluyendo los pendientes), leyendo solo lo nuevo"""
+        with self._lock:
+            self._leer_journal()
+            return self._journal['consumos'] + self._journal['pendientes']
+    
+    def _facturados_journal(self):
+        """Devuelve las marcas [(clave del consumo, id de factura)] de la bitácora, incluyendo las pendientes"""
+        with self._lock:
+            self._leer_journal()
+            return self._journal['facturados'] + self._journal['pendientes_facturados']
+    
+    def compactar_consumos(self):
+        """Pasa los consumos y marcas de la bitácora a sus archivos XML y la vacía. Devuelve cuántos consumos se movieron"""
+        with self._lock:
+            if self._transaccion:
+                return 0
+            tuplas = self._consumos_journal()
+            marcas = dict(self._facturados_journal())
+            if not tuplas and not marcas:
+                return 0
+            # El índice temporal debe incluir toda la bitácora antes de vaciarla
+            if self._indice_fechas is not None:
+                self._indice_por_fecha()
+            
+            modificados = set()
+            for clave in tuplas:
+                id_instancia, nit_cliente, tiempo, fecha_hora = clave
+                documento = self._documento_para('consumos', fecha_hora)
+                nuevo_consumo = ET.SubElement(self._raiz(documento), 'consumo')
+                nuevo_consumo.set('idInstancia', str(id_instancia))
+                nuevo_consumo.set('nitCliente', nit_cliente)
+                if clave in marcas:
+                    nuevo_consumo.set('idFactura', str(marcas.pop(clave)))
+                ET.SubElement(nuevo_consumo, 'tiempo').text = str(tiempo)
+                ET.SubElement(nuevo_consumo, 'fechaHora').text = fecha_hora.strftime('%d/%m/%Y %H:%M')
+                modificados.add(documento)
+            
+            # Marcas de consumos que ya estaban en los XML: se recorre solo el archivo de su mes
+            pendientes_por_documento = {}
+            for clave, id_factura in marcas.items():
+                pendientes_por_documento.setdefault(self._documento_para('consumos', clave[3]), {})[clave] = id_factura
+            for documento, pendientes in pendientes_por_documento.items():
+                for consumo_elem in self._raiz(documento).findall('consumo'):
+                    clave = _clave_consumo(self._elemento_a_consumo(consumo_elem))
+                    if clave in pendientes:
+                        consumo_elem.set('idFactura', str(pendientes[clave]))
+                        modificados.add(documento)
+            
+            for documento in modificados:
+                documento.escribir()
+            
+            open(self.ruta_journal, 'w').close()
+            self._journal.update(consumos=[], facturados=[], offset=0)
+            if self._total_compactados is not None:
+                self._total_compactados += len(tuplas)
+            # Los registros solo cambiaron de archivo: el índice temporal sigue siendo válido
+            if self._indice_fechas is not None:
+                self._indice_fechas['estado'] = self._estado_consumos()
+                self._indice_fechas['total_journal'] = 0
+                self._indice_fechas['total_facturados'] = 0
+            return len(tuplas)
+    
+    @staticmethod
+    def _elemento_a_consumo(consumo_elem):
+        id_factura = consumo_elem.get('idFactura')
+        return {
+            'idInstancia': int(consumo_elem.get('idInstancia')),
+            'nitCliente': consumo_elem.get('nitCliente'),
+            'tiempo': float(consumo_elem.find('tiempo').text),
+            'fechaHora': parsear_fecha(consumo_elem.find('fechaHora').text, '%d/%m/%Y %H:%M'),
+            'idFactura': int(id_factura) if id_factura else None
+        }
+    
+    def obtener_consumos(self, id_instancia=None):
+        with self._lock:
+            consumos = []
+            for documento in self._documentos_de('consumos'):
+                for consumo_elem in self._raiz(documento).findall('consumo'):
+                    if id_instancia is not None and int(consumo_elem.get('idInstancia')) != id_instancia:
+                        continue
+                    consumos.append(self._elemento_a_consumo(consumo_elem))
+            for id_consumo, nit_cliente, tiempo, fecha_hora in self._consumos_journal():
+                if id_instancia is not None and id_consumo != id_instancia:
+                    continue
+                consumos.append({
+                    'idInstancia': id_consumo,
+                    'nitCliente': nit_cliente,
+                    'tiempo': tiempo,
+                    'fechaHora': fecha_hora,
+                    'idFactura': None
+                })
+            # Marcas de facturación que siguen en la bitácora
+            marcas = dict(self._facturados_journal())
+            if marcas:
+                for consumo in consumos:
+                    consumo['idFactura'] = marcas.get(_clave_consumo(consumo), consumo['idFactura'])
+            return consumos
+    
+    def eliminar_consumos_duplicados(self):
+        """
+        Deja un solo consumo por (instancia, cliente, tiempo, fecha), la misma clave con la que
+        se descartan al ingresar. Si una de las copias ya está facturada, la que queda conserva
+        la factura. Devuelve cuántos quedaron.
+        """
+        with self._lock:
+            # Llevar primero a XML los consumos que siguen en la bitácora
+            self.compactar_consumos()
+            
+            consumos_unicos = {}
+            for documento in self._documentos_de('consumos'):
+                consumos = self._raiz(documento)
+                repetidos = []
+                for consumo in consumos.findall('consumo'):
+                    clave = _clave_consumo(self._elemento_a_consumo(consumo))
+                    original = consumos_unicos.get(clave)
+                    if original is None:
+                        consumos_unicos[clave] = consumo
+                        continue
+                    repetidos.append(consumo)
+                    if consumo.get('idFactura') and not original.get('idFactura'):
+                        original.set('idFactura', consumo.get('idFactura'))
+                        self._marcar_modificado(self._documento_para('consumos', clave[3]))
+                
+                if repetidos:
+                    for consumo in repetidos:
+                        consumos.remove(consumo)
+                    self._marcar_modificado(documento)
+            self._indice_fechas = None
+            self._total_compactados = len(consumos_unicos)
+            return len(consumos_unicos)
+    
+    def _estado_consumos(self):
+        """Identifica los árboles de consumos cargados; si cambia, el índice temporal se reconstruye"""
+        versiones = []
+        for documento in self._documentos_de('consumos'):
+            self._raiz(documento)  # recarga el archivo si cambió en disco
+            versiones.append((documento.ruta, documento.version))
+        return (tuple(versiones), self._journal['inodo'])
+    
+    def _indice_por_fecha(self):
+        """
+        Devuelve el índice temporal de consumos: listas paralelas de fechas y registros ordenadas
+        por fechaHora, en total y por instancia, más las claves de todos los consumos (clave ->
+        registro) para detectar duplicados y aplicar las marcas de facturación. Lo nuevo de la
+        bitácora se incorpora sin reconstruirlo.
+        """
+        with self._lock:
+            # Sin concatenar las listas de la bitácora: solo se toma lo que el índice aún no tiene
+            self._leer_journal()
+            journal = (self._journal['consumos'], self._journal['pendientes'])
+            facturados = (self._journal['facturados'], self._journal['pendientes_facturados'])
+            total_journal = len(journal[0]) + len(journal[1])
+            total_facturados = len(facturados[0]) + len(facturados[1])
+            estado = self._estado_consumos()
+            indice = self._indice_fechas
+            if (indice is None or indice['estado'] != estado or total_journal < indice['total_journal']
+                    or total_facturados < indice['total_facturados']):
+                indice = {'estado': estado, 'total_journal': 0, 'total_facturados': 0, 'fechas': [],
+                          'registros': [], 'por_instancia': {}, 'claves': {}}
+                self._indexar_consumos(indice, [
+                    self._elemento_a_consumo(consumo_elem)
+                    for documento in self._documentos_de('consumos')
+                    for consumo_elem in self._raiz(documento).findall('consumo')
+                ])
+                self._indice_fechas = indice
+            
+            self._indexar_consumos(indice, [
+                {
+                    'idInstancia': id_instancia,
+                    'nitCliente': nit_cliente,
+                    'tiempo': tiempo,
+                    'fechaHora': fecha_hora,
+                    'idFactura': None
+                }
+                for id_instancia, nit_cliente, tiempo, fecha_hora in _desde(*journal, indice['total_journal'])
+            ])
+            indice['total_journal'] = total_journal
+            
+            for clave, id_factura in _desde(*facturados, indice['total_facturados']):
+                registro = indice['claves'].get(clave)
+                if registro is not None:
+                    registro['idFactura'] = id_factura
+            indice['total_facturados'] = total_facturados
+            return indice
+    
+    @staticmethod
+    def _indexar_consumos(indice, nuevos):
+        """
+        Agrega consumos al índice temporal. Pocos se insertan en su lugar con búsqueda binaria;
+        muchos (la reconstrucción completa o una bitácora grande) se ordenan una sola vez. En
+        ambos casos los consumos con la misma fecha quedan en el orden en que llegaron.
+        """
+        for registro in nuevos:
+            indice['claves'][_clave_consumo(registro)] = registro
+        
+        if len(nuevos) <= LIMITE_INSERCION_INDICE:
+            for registro in nuevos:
+                fecha_hora = registro['fechaHora']
+                fechas, registros = indice['fechas'], indice['registros']
+                posicion = bisect.bisect_right(fechas, fecha_hora)
+                fechas.insert(posicion, fecha_hora)
+                registros.insert(posicion, registro)
+                
+                fechas, registros = indice['por_instancia'].setdefault(registro['idInstancia'], ([], []))
+                posicion = bisect.bisect_right(fechas, fecha_hora)
+                fechas.insert(posicion, fecha_hora)
+                registros.insert(posicion, registro)
+            return
+        
+        # sorted es estable: mismo resultado que insertar uno a uno con bisect_right
+        registros = sorted(indice['registros'] + nuevos, key=lambda registro: registro['fechaHora'])
+        por_instancia = {}
+        for registro in registros:
+            fechas_instancia, registros_instancia = por_instancia.setdefault(registro['idInstancia'], ([], []))
+            fechas_instancia.append(registro['fechaHora'])
+            registros_instancia.append(registro)
+        indice['registros'] = registros
+        indice['fechas'] = [registro['fechaHora'] for registro in registros]
+        indice['por_instancia'] = por_instancia
+    
+    def obtener_consumos_por_rango(self, inicio, fin, id_instancia=None, pendientes=False):
+        """
+        Consumos con inicio <= fechaHora <= fin, ordenados por fecha (búsqueda binaria).
+        Con pendientes=True solo los que aún no tienen factura; una marca cuya factura no llegó
+        a escribirse no cuenta.
+        """
+        with self._lock:
+            indice = self._indice_por_fecha()
+            if id_instancia is None:
+                fechas, registros = indice['fechas'], indice['registros']
+            else:
+                fechas, registros = indice['por_instancia'].get(id_instancia, ([], []))
+            desde = bisect.bisect_left(fechas, inicio)
+            hasta = bisect.bisect_right(fechas, fin)
+            if not pendientes:
+                return [dict(registro) for registro in registros[desde:hasta]]
+            facturas = self._indice('facturas')
+            return [dict(registro) for registro in registros[desde:hasta]
+                    if registro['idFactura'] is None or registro['idFactura'] not in facturas]
+    
+    # ---- Facturas ----
+    
+    def agregar_factura(self, registro):
+        self.agregar_facturas([registro])
+    
+    def agregar_facturas(self, registros):
+        """Agrega varias facturas escribiendo una sola vez cada archivo afectado"""
+        with self._lock:
+            documentos = []
+            for registro in registros:
+                documento = self._documento_para('facturas', registro['fechaEmision'])
+                nueva_factura = ET.SubElement(self._raiz(documento), 'factura')
+                nueva_factura.set('id', str(registro['id']))
+                for campo, tipo in ESQUEMA['facturas'][2]:
+                    ET.SubElement(nueva_factura, campo).text = _a_texto(registro[campo], tipo)
+                
+                detalles_elem = ET.SubElement(nueva_factura, 'detalles')
+                for detalle in registro['detalles']:
+                    detalle_elem = ET.SubElement(detalles_elem, 'detalle')
+                    for etiqueta, llave, tipo in CAMPOS_DETALLE:
+                        ET.SubElement(detalle_elem, etiqueta).text = _a_texto(detalle[llave], tipo)
+                self._registrar('facturas', registro['id'], nueva_factura)
+                
+                if documento not in documentos:
+                    documentos.append(documento)
+            
+            for documento in documentos:
+                self._marcar_modificado(documento)
+    
+    def _factura_a_registro(self, factura_elem):
+        registro = self._elemento_a_registro('facturas', factura_elem)
+        detalles = []
+        detalles_elem = factura_elem.find('detalles')
+        if detalles_elem is not None:
+            for detalle_elem in detalles_elem.findall('detalle'):
+                detalles.append({
+                    llave: _de_texto(detalle_elem.find(etiqueta).text, tipo)
+                    for etiqueta, llave, tipo in CAMPOS_DETALLE
+                })
+        registro['detalles'] = detalles
+        return registro
+    
+    def obtener_factura(self, id_factura):
+        with self._lock:
+            factura_elem = self._buscar('facturas', id_factura)
+            if factura_elem is None:
+                return None
+            return self._factura_a_registro(factura_elem)
+    
+    def obtener_facturas(self):
+        with self._lock:
+            return [
+                self._factura_a_registro(factura_elem)
+                for documento in self._documentos_de('facturas')
+                for factura_elem in self._raiz(documento).findall('factura')
+            ]
+    
+    def contar_facturas(self):
+        with self._lock:
+            return len(self._indice('facturas'))
+    
+    def _ids_ordenados_facturas(self, nit_cliente=None):
+        """
+        Ids de las facturas en orden, o solo los de un cliente; solo se recalculan cuando cambia
+        el índice por clave
+        """
+        indice = self._indice('facturas')
+        cache = self._ids_facturas
+        if cache is None or cache[0] is not indice or cache[1] != len(indice):
+            ids = sorted(indice)
+            por_nit = {}
+            for id_factura in ids:
+                por_nit.setdefault(indice[id_factura].findtext('nitCliente'), []).append(id_factura)
+            cache = (indice, len(indice), ids, por_nit)
+            self._ids_facturas = cache
+        if nit_cliente is not None:
+            return cache[3].get(nit_cliente, [])
+        return cache[2]
+    
+    def listar_facturas(self, limite=None, antes_de=None, nit_cliente=None, desde=None, hasta=None,
+                        monto_minimo=None, monto_maximo=None, detalles=True):
+        """
+        Facturas de la más reciente (id mayor) a la más antigua que cumplen los filtros, con
+        id < antes_de si se indica. Las de un cliente salen de su propia lista de ids; solo se
+        decodifican las facturas devueltas.
+        """
+        with self._lock:
+            ids = self._ids_ordenados_facturas(nit_cliente)
+            indice = self._indice('facturas')
+            posicion = len(ids) if antes_de is None else bisect.bisect_left(ids, antes_de)
+            registros = []
+            for i in range(posicion - 1, -1, -1):
+                if limite is not None and len(registros) >= limite:
+                    break
+                factura_elem = indice[ids[i]]
+                if desde is not None or hasta is not None:
+                    fecha = _de_texto(factura_elem.findtext('fechaEmision'), 'fecha')
+                    if (desde is not None and fecha < desde) or (hasta is not None and fecha > hasta):
+                        continue
+                if monto_minimo is not None or monto_maximo is not None:
+                    monto = float(factura_elem.findtext('montoTotal'))
+                    if (monto_minimo is not None and monto < monto_minimo) or (monto_maximo is not None and monto > monto_maximo):
+                        continue
+                if detalles:
+                    registros.append(self._factura_a_registro(factura_elem))
+                else:
+                    registros.append(self._elemento_a_registro('facturas', factura_elem))
+            return registros
+    
+    # ---- Fragmentos de envíos idempotentes (bitácora ingestas.log) ----
+    
+    def _cargar_ingestas(self):
+        """
+        Fragmentos registrados {(endpoint, idempotencia, secuencia): registro} en orden de llegada,
+        más un índice por envío (endpoint, idempotencia) y cuántas líneas tiene la bitácora
+        """
+        if self._ingestas is None:
+            registros = {}
+            lineas = 0
+            if os.path.exists(self.ruta_ingestas):
+                with open(self.ruta_ingestas, encoding='utf-8') as f:
+                    for linea in f:
+                        # Ignorar una posible última línea incompleta
+                        if not linea.endswith('\n'):
+                            break
+                        lineas += 1
+                        registro = json.loads(linea)
+                        registro['fecha'] = _de_texto(registro['fecha'], 'fecha_hora')
+                        clave = (registro['endpoint'], registro['idempotencia'], registro['secuencia'])
+                        registros.pop(clave, None)
+                        registros[clave] = registro
+            por_envio = {}
+            for clave, registro in registros.items():
+                por_envio.setdefault(clave[:2], {})[clave[2]] = registro
+            self._ingestas = {'registros': registros, 'por_envio': por_envio, 'lineas': lineas}
+        return self._ingestas
+    
+    def guardar_ingesta(self, registro):
+        """Registra un fragmento aplicado agregando una línea a la bitácora (no espera a ninguna transacción)"""
+        with self._lock:
+            ingestas = self._cargar_ingestas()
+            with open(self.ruta_ingestas, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(dict(registro, fecha=_a_texto(registro['fecha'], 'fecha_hora'))) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            clave = (registro['endpoint'], registro['idempotencia'], registro['secuencia'])
+            registro = dict(registro)
+            # Al final del orden de llegada aunque la clave ya existiera
+            ingestas['registros'].pop(clave, None)
+            ingestas['registros'][clave] = registro
+            ingestas['por_envio'].setdefault(clave[:2], {})[clave[2]] = registro
+            ingestas['lineas'] += 1
+    
+    def obtener_ingesta(self, endpoint, idempotencia, secuencia):
+        with self._lock:
+            registro = self._cargar_ingestas()['registros'].get((endpoint, idempotencia, secuencia))
+            return dict(registro) if registro is not None else None
+    
+    def obtener_ingestas(self, endpoint, idempotencia):
+        """Fragmentos registrados de un envío, ordenados por secuencia"""
+        with self._lock:
+            envio = self._cargar_ingestas()['por_envio'].get((endpoint, idempotencia), {})
+            return [dict(envio[secuencia]) for secuencia in sorted(envio)]
+    
+    def eliminar_ingestas_anteriores(self, limite):
+        """Olvida los fragmentos registrados antes de limite"""
+        with self._lock:
+            ingestas = self._cargar_ingestas()
+            registros = ingestas['registros']
+            # Están en orden de llegada: los vencidos son siempre los primeros
+            while registros:
+                clave, registro = next(iter(registros.items()))
+                if registro['fecha'] >= limite:
+                    break
+                del registros[clave]
+                envio = ingestas['por_envio'][clave[:2]]
+                del envio[clave[2]]
+                if not envio:
+                    del ingestas['por_envio'][clave[:2]]
+            
+            # La bitácora se reescribe solo cuando la mayor parte de sus líneas ya no sirve
+            if ingestas['lineas'] > max(LIMITE_COMPACTACION, 2 * len(registros)):
+                ruta_tmp = self.ruta_ingestas + '.tmp'
+                with open(ruta_tmp, 'w', encoding='utf-8') as f:
+                    for registro in registros.values():
+                        f.write(json.dumps(dict(registro, fecha=_a_texto(registro['fecha'], 'fecha_hora'))) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(ruta_tmp, self.ruta_ingestas)
+                ingestas['lineas'] = len(registros)
+
+class MotorSQLite:
+    """
+    Almacena los datos en SQLite con una tabla por colección e índices para las búsquedas
+    por clave, por instancia y por rango de fechas.
+    """
+    
+    TABLAS = [
+        '''CREATE TABLE IF NOT EXISTS recursos (
+            id INTEGER PRIMARY KEY, nombre TEXT, abreviatura TEXT, metrica TEXT,
+            tipo TEXT, valorXhora REAL)''',
+        '''CREATE TABLE IF NOT EXISTS categorias (
+            id INTEGER PRIMARY KEY, nombre TEXT, descripcion TEXT, cargaTrabajo TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS configuraciones (
+            id INTEGER PRIMARY KEY, nombre TEXT, descripcion TEXT, idCategoria INTEGER)''',
+        'CREATE INDEX IF NOT EXISTS idx_configuraciones_categoria ON configuraciones (idCategoria)',
+        '''CREATE TABLE IF NOT EXISTS recursosConfiguracion (
+            idConfiguracion INTEGER, idRecurso INTEGER, cantidad REAL,
+            PRIMARY KEY (idConfiguracion, idRecurso))''',
+        '''CREATE TABLE IF NOT EXISTS clientes (
+            nit TEXT PRIMARY KEY, nombre TEXT, usuario TEXT, clave TEXT,
+            direccion TEXT, correoElectronico TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS instancias (
+            id INTEGER PRIMARY KEY, idCliente TEXT, idConfiguracion INTEGER, nombre TEXT,
+            fechaInicio TEXT, estado TEXT, fechaFinal TEXT)''',
+        'CREATE INDEX IF NOT EXISTS idx_instancias_cliente ON instancias (idCliente)',
+        '''CREATE TABLE IF NOT EXISTS consumos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, idInstancia INTEGER, nitCliente TEXT,
+            tiempo REAL, fechaHora TEXT, idFactura INTEGER)''',
+        'CREATE INDEX IF NOT EXISTS idx_consumos_instancia ON consumos (idInstancia, fechaHora)',
+        'CREATE INDEX IF NOT EXISTS idx_consumos_fecha ON consumos (fechaHora)',
+        '''CREATE TABLE IF NOT EXISTS facturas (
+            id INTEGER PRIMARY KEY, nitCliente TEXT, fechaEmision TEXT, montoTotal REAL)''',
+        'CREATE INDEX IF NOT EXISTS idx_facturas_cliente ON facturas (nitCliente)',
+        'CREATE INDEX IF NOT EXISTS idx_facturas_fecha ON facturas (fechaEmision)',
+        '''CREATE TABLE IF NOT EXISTS detallesFactura (
+            idFactura INTEGER, linea INTEGER, idInstancia INTEGER, nombreInstancia TEXT,
+            idRecurso INTEGER, nombreRecurso TEXT, cantidad REAL, tiempoConsumido REAL,
+            costoUnitario REAL, costoTotal REAL,
+            PRIMARY KEY (idFactura, linea))''',
+        '''CREATE TABLE IF NOT EXISTS ingestas (
+            endpoint TEXT, idempotencia TEXT, secuencia INTEGER, resultado TEXT, fecha TEXT,
+            PRIMARY KEY (endpoint, idempotencia, secuencia))''',
+        'CREATE INDEX IF NOT EXISTS idx_ingestas_fecha ON ingestas (fecha)',
+    ]
+    
+    def __init__(self, ruta=SQLITE_PATH):
+        self.ruta = ruta
+        # Una conexión por hilo (sqlite3 no permite compartirlas entre hilos)
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        con = self._conexion()
+        nueva = con.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()[0] == 0
+        # Esquema, migraciones e importación en una sola transacción: si algo falla la base
+        # queda como estaba y se reintenta al volver a iniciar
+        with self.transaccion():
+            columnas_ingestas = [columna['name'] for columna in con.execute('PRAGMA table_info(ingestas)')]
+            if columnas_ingestas and 'endpoint' not in columnas_ingestas:
+                # Tabla anterior, sin endpoint: sus fragmentos no se pueden atribuir a /consumo o /configurar
+                con.execute('DROP TABLE ingestas')
+            for sentencia in self.TABLAS:
+                con.execute(sentencia)
+            if con.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_consumos_unico'").fetchone() is None:
+                # Bases creadas antes del índice único: se quitan primero los duplicados que ya tenían
+                con.execute('''DELETE FROM consumos WHERE id NOT IN (
+                    SELECT MIN(id) FROM consumos GROUP BY idInstancia, nitCliente, fechaHora, tiempo)''')
+                con.execute('CREATE UNIQUE INDEX idx_consumos_unico ON consumos (idInstancia, nitCliente, fechaHora, tiempo)')
+            if 'idFactura' not in [columna['name'] for columna in con.execute('PRAGMA table_info(consumos)')]:
+                # Bases creadas antes de marcar los consumos facturados: se marcan los de las facturas existentes
+                con.execute('ALTER TABLE consumos ADD COLUMN idFactura INTEGER')
+                self.marcar_consumos_facturados(_marcas_de_facturas_antiguas(self.obtener_facturas(), self.obtener_consumos()))
+            # Solo los consumos sin factura: la facturación recorre únicamente lo pendiente
+            con.execute('CREATE INDEX IF NOT EXISTS idx_consumos_pendientes ON consumos (idInstancia, fechaHora) WHERE idFactura IS NULL')
+            if nueva:
+                self._importar_xml(os.path.dirname(ruta))
+    
+    def _importar_xml(self, directorio):
+        """
+        Copia a una base recién creada los datos que el motor XML tenga en el mismo directorio
+        (archivos por colección, database.xml o la bitácora), con la factura de cada consumo
+        """
+        if not any(os.path.exists(os.path.join(directorio, nombre))
+                   for nombre in [ARCHIVO_LEGADO, 'consumos.log'] + [f'{c}.xml' for c in COLECCIONES] + COLECCIONES_MENSUALES):
+            return
+        print(f"🔄 Importando a SQLite los datos XML de {directorio}...")
+        xml = MotorXML(directorio)
+        for coleccion in ESQUEMA:
+            if coleccion != 'facturas':
+                for registro in xml.obtener_todos(coleccion):
+                    self.guardar(coleccion, registro)
+        for configuracion in xml.obtener_todos('configuraciones'):
+            for id_recurso, cantidad in xml.obtener_recursos_configuracion(configuracion['id']):
+                self.guardar_recurso_configuracion(configuracion['id'], id_recurso, cantidad)
+        consumos = xml.obtener_consumos()
+        facturas = xml.obtener_facturas()
+        self.agregar_consumos(consumos)
+        self.agregar_facturas(facturas)
+        # Una marca cuya factura no llegó a escribirse no cuenta (ver MotorXML.transaccion)
+        ids_facturas = {factura['id'] for factura in facturas}
+        self.marcar_consumos_facturados([(consumo, consumo['idFactura']) for consumo in consumos
+                                         if consumo['idFactura'] in ids_facturas])
+        print(f"✅ Importados {len(consumos)} consumos y {self.contar_facturas()} facturas")
+    
+    def _conexion(self):
+        con = getattr(self._local, 'conexion', None)
+        if con is None:
+            # isolation_level=None: cada sentencia se confirma sola salvo dentro de transaccion()
+            con = sqlite3.connect(self.ruta, isolation_level=None, timeout=30)
+            con.row_factory = sqlite3.Row
+            con.execute('PRAGMA journal_mode=WAL')
+            self._local.conexion = con
+            self._local.transaccion = 0
+        return con
+    
+    @contextmanager
+    def transaccion(self):
+        """Agrupa varios guardados en una sola transacción SQLite"""
+        con = self._conexion()
+        if self._local.transaccion == 0:
+            con.execute('BEGIN IMMEDIATE')
+        self._local.transaccion += 1
+        try:
+            yield
+        except BaseException:
+            self._local.transaccion -= 1
+            if self._local.transaccion == 0:
+                con.execute('ROLLBACK')
+            raise
+        self._local.transaccion -= 1
+        if self._local.transaccion == 0:
+            con.execute('COMMIT')
+    
+    def reiniciar(self):
+        with self.transaccion():
+            con = self._conexion()
+            for tabla in ['recursos', 'categorias', 'configuraciones', 'recursosConfiguracion', 'clientes',
+                          'instancias', 'consumos', 'facturas', 'detallesFactura', 'ingestas']:
+                con.execute(f'DELETE FROM {tabla}')
+    
+    # ---- Colecciones con clave primaria ----
+    
+    def _fila_a_registro(self, coleccion, fila):
+        _, clave, campos = ESQUEMA[coleccion]
+        registro = {clave: fila[clave]}
+        for campo, tipo in campos:
+            registro[campo] = _de_texto(fila[campo], tipo, FORMATOS_SQL)
+        return registro
+    
+    def guardar(self, coleccion, registro):
+        """Inserta o actualiza un registro por su clave primaria"""
+        _, clave, campos = ESQUEMA[coleccion]
+        columnas = [clave] + [campo for campo, _ in campos]
+        valores = [_convertir_clave(coleccion, registro[clave])]
+        for campo, tipo in campos:
+            valor = registro.get(campo)
+            valores.append(_a_texto(valor, tipo, FORMATOS_SQL) if tipo in FORMATOS_SQL else valor)
+        actualizaciones = ', '.join(f'{campo} = excluded.{campo}' for campo, _ in campos)
+        self._conexion().execute(
+            f'INSERT INTO {coleccion} ({", ".join(columnas)}) VALUES ({", ".join("?" * len(columnas))}) '
+            f'ON CONFLICT ({clave}) DO UPDATE SET {actualizaciones}',
+            valores
+        )
+    
+    def obtener(self, coleccion, clave):
+        try:
+            clave_valor = _convertir_clave(coleccion, clave)
+        except (TypeError, ValueError):
+            return None
+        fila = self._conexion().execute(
+            f'SELECT * FROM {coleccion} WHERE {ESQUEMA[coleccion][1]} = ?', (clave_valor,)
+        ).fetchone()
+        return self._fila_a_registro(coleccion, fila) if fila else None
+    
+    def obtener_todos(self, coleccion):
+        filas = self._conexion().execute(f'SELECT * FROM {coleccion} ORDER BY rowid').fetchall()
+        return [self._fila_a_registro(coleccion, fila) for fila in filas]
+    
+    # ---- Recursos por configuración ----
+    
+    def guardar_recurso_configuracion(self, id_configuracion, id_recurso, cantidad):
+        con = self._conexion()
+        if con.execute('SELECT 1 FROM configuraciones WHERE id = ?', (id_configuracion,)).fetchone() is None:
+            return False
+        con.execute(
+            'INSERT INTO recursosConfiguracion (idConfiguracion, idRecurso, cantidad) VALUES (?, ?, ?) '
+            'ON CONFLICT (idConfiguracion, idRecurso) DO UPDATE SET cantidad = excluded.cantidad',
+            (id_configuracion, id_recurso, cantidad)
+        )
+        return True
+    
+    def obtener_recursos_configuracion(self, id_configuracion):
+        """Devuelve [(id_recurso, cantidad)] de una configuración"""
+        filas = self._conexion().execute(
+            'SELECT idRecurso, cantidad FROM recursosConfiguracion WHERE idConfiguracion = ? ORDER BY rowid',
+            (id_configuracion,)
+        ).fetchall()
+        return [(fila['idRecurso'], fila['cantidad']) for fila in filas]
+    
+    # ---- Consumos ----
+    
+    def agregar_consumos(self, registros):
+        # En una transacción: sin ella cada fila se confirmaría (y sincronizaría) por separado.
+        # El índice único descarta los duplicados; total_changes cuenta solo los insertados
+        con = self._conexion()
+        with self.transaccion():
+            antes = con.total_changes
+            con.executemany(
+                'INSERT OR IGNORE INTO consumos (idInstancia, nitCliente, tiempo, fechaHora) VALUES (?, ?, ?, ?)',
+                [(r['idInstancia'], r['nitCliente'], r['tiempo'], _a_texto(r['fechaHora'], 'fecha_hora', FORMATOS_SQL))
+                 for r in registros]
+            )
+            return con.total_changes - antes
+    
+    def marcar_consumos_facturados(self, marcas):
+        """Guarda la factura de cada consumo: marcas = [(registro del consumo, id de factura)]"""
+        con = self._conexion()
+        with self.transaccion():
+            con.executemany(
+                'UPDATE consumos SET idFactura = ? '
+                'WHERE idInstancia = ? AND nitCliente = ? AND fechaHora = ? AND tiempo = ?',
+                [(id_factura, r['idInstancia'], r['nitCliente'], _a_texto(r['fechaHora'], 'fecha_hora', FORMATOS_SQL), r['tiempo'])
+                 for r, id_factura in marcas]
+            )
+    
+    def compactar_consumos(self):
+        # SQLite no usa bitácora propia: no hay nada que compactar
+        return 0
+    
+    def _fila_a_consumo(self, fila):
+        return {
+            'idInstancia': fila['idInstancia'],
+            'nitCliente': fila['nitCliente'],
+            'tiempo': fila['tiempo'],
+            'fechaHora': _de_texto(fila['fechaHora'], 'fecha_hora', FORMATOS_SQL),
+            'idFactura': fila['idFactura']
+        }
+    
+    def obtener_consumos(self, id_instancia=None):
+        con = self._conexion()
+        if id_instancia is None:
+            filas = con.execute('SELECT * FROM consumos ORDER BY id').fetchall()
+        else:
+            filas = con.execute('SELECT * FROM consumos WHERE idInstancia = ? ORDER BY id', (id_instancia,)).fetchall()
+        return [self._fila_a_consumo(fila) for fila in filas]
+    
+    def obtener_consumos_por_rango(self, inicio, fin, id_instancia=None, pendientes=False):
+        """
+        Consumos con inicio <= fechaHora <= fin, ordenados por fecha (usa los índices por fecha).
+        Con pendientes=True solo los que aún no tienen factura.
+        """
+        parametros = [_a_texto(inicio, 'fecha_hora', FORMATOS_SQL), _a_texto(fin, 'fecha_hora', FORMATOS_SQL)]
+        condicion = 'fechaHora BETWEEN ? AND ?'
+        if id_instancia is not None:
+            condicion = 'idInstancia = ? AND ' + condicion
+            parametros.insert(0, id_instancia)
+        if pendientes:
+            condicion = 'idFactura IS NULL AND ' + condicion
+        filas = self._conexion().execute(
+            f'SELECT * FROM consumos WHERE {condicion} ORDER BY fechaHora, id', parametros
+        ).fetchall()
+        return [self._fila_a_consumo(fila) for fila in filas]
+    
+    def eliminar_consumos_duplicados(self):
+        """
+        Deja un solo consumo por (instancia, cliente, tiempo, fecha), prefiriendo la copia ya
+        facturada. Devuelve cuántos quedaron.
+        """
+        con = self._conexion()
+        with self.transaccion():
+            con.execute(
+                'DELETE FROM consumos WHERE id NOT IN '
+                '(SELECT COALESCE(MIN(CASE WHEN idFactura IS NOT NULL THEN id END), MIN(id)) FROM consumos '
+                'GROUP BY idInstancia, nitCliente, tiempo, fechaHora)'
+            )
+        return con.execute('SELECT COUNT(*) FROM consumos').fetchone()[0]
+    
+    # ---- Facturas ----
+    
+    def agregar_factura(self, registro):
+        self.agregar_facturas([registro])
+    
+    def agregar_facturas(self, registros):
+        """Agrega varias facturas en una sola transacción"""
+        con = self._conexion()
+        with self.transaccion():
+            con.executemany(
+                'INSERT INTO facturas (id, nitCliente, fechaEmision, montoTotal) VALUES (?, ?, ?, ?)',
+                [(registro['id'], registro['nitCliente'],
+                  _a_texto(registro['fechaEmision'], 'fecha', FORMATOS_SQL), registro['montoTotal'])
+                 for registro in registros]
+            )
+            columnas = ['idFactura', 'linea'] + [etiqueta for etiqueta, _, _ in CAMPOS_DETALLE]
+            con.executemany(
+                f'INSERT INTO detallesFactura ({", ".join(columnas)}) VALUES ({", ".join("?" * len(columnas))})',
+                [[registro['id'], linea] + [detalle[llave] for _, llave, _ in CAMPOS_DETALLE]
+                 for registro in registros
+                 for linea, detalle in enumerate(registro['detalles'])]
+            )
+    
+    def _filas_a_facturas(self, filas, detalles):
+        facturas = [self._fila_a_registro('facturas', fila) for fila in filas]
+        por_id = {}
+        for factura in facturas:
+            factura['detalles'] = []
+            por_id[factura['id']] = factura
+        for fila in detalles:
+            factura = por_id.get(fila['idFactura'])
+            if factura is not None:
+                factura['detalles'].append({
+                    llave: _de_texto(fila[etiqueta], tipo, FORMATOS_SQL) for etiqueta, llave, tipo in CAMPOS_DETALLE
+                })
+        return facturas
+    
+    def obtener_factura(self, id_factura):
+        con = self._conexion()
+        filas = con.execute('SELECT * FROM facturas WHERE id = ?', (id_factura,)).fetchall()
+        if not filas:
+            return None
+        detalles = con.execute(
+            'SELECT * FROM detallesFactura WHERE idFactura = ? ORDER BY linea', (id_factura,)
+        ).fetchall()
+        return self._filas_a_facturas(filas, detalles)[0]
+    
+    def obtener_facturas(self):
+        con = self._conexion()
+        filas = con.execute('SELECT * FROM facturas ORDER BY rowid').fetchall()
+        detalles = con.execute('SELECT * FROM detallesFactura ORDER BY idFactura, linea').fetchall()
+        return self._filas_a_facturas(filas, detalles)
+    
+    def contar_facturas(self):
+        return self._conexion().execute('SELECT COUNT(*) FROM facturas').fetchone()[0]
+    
+    def listar_facturas(self, limite=None, antes_de=None, nit_cliente=None, desde=None, hasta=None,
+                        monto_minimo=None, monto_maximo=None, detalles=True):
+        """
+        Facturas de la más reciente (id mayor) a la más antigua que cumplen los filtros, con
+        id < antes_de si se indica. Recorre la clave primaria (o el índice por cliente o por
+        fecha) y solo lee los detalles de las facturas devueltas.
+        """
+        condiciones, parametros = [], []
+        for condicion, valor in [('id < ?', antes_de), ('nitCliente = ?', nit_cliente),
+                                 ('fechaEmision >= ?', _a_texto(desde, 'fecha', FORMATOS_SQL)),
+                                 ('fechaEmision <= ?', _a_texto(hasta, 'fecha', FORMATOS_SQL)),
+                                 ('montoTotal >= ?', monto_minimo), ('montoTotal <= ?', monto_maximo)]:
+            if valor is not None:
+                condiciones.append(condicion)
+                parametros.append(valor)
+        consulta = 'SELECT * FROM facturas'
+        if condiciones:
+            consulta += ' WHERE ' + ' AND '.join(condiciones)
+        consulta += ' ORDER BY id DESC'
+        if limite is not None:
+            consulta += ' LIMIT ?'
+            parametros.append(limite)
+        
+        con = self._conexion()
+        filas = con.execute(consulta, parametros).fetchall()
+        if not detalles:
+            return [self._fila_a_registro('facturas', fila) for fila in filas]
+        
+        ids = [fila['id'] for fila in filas]
+        filas_detalle = []
+        # Por bloques: SQLite limita la cantidad de parámetros por consulta
+        for inicio in range(0, len(ids), 500):
+            bloque = ids[inicio:inicio + 500]
+            filas_detalle.extend(con.execute(
+                f'SELECT * FROM detallesFactura WHERE idFactura IN ({", ".join("?" * len(bloque))}) '
+                'ORDER BY idFactura, linea', bloque
+            ).fetchall())
+        return self._filas_a_facturas(filas, filas_detalle)
+    
+    # ---- Fragmentos de envíos idempotentes ----
+    
+    def guardar_ingesta(self, registro):
+        self._conexion().execute(
+            'INSERT OR REPLACE INTO ingestas (endpoint, idempotencia, secuencia, resultado, fecha) VALUES (?, ?, ?, ?, ?)',
+            (registro['endpoint'], registro['idempotencia'], registro['secuencia'], registro['resultado'],
+             _a_texto(registro['fecha'], 'fecha_hora', FORMATOS_SQL))
+        )
+    
+    @staticmethod
+    def _fila_a_ingesta(fila):
+        return {
+            'endpoint': fila['endpoint'],
+            'idempotencia': fila['idempotencia'],
+            'secuencia': fila['secuencia'],
+            'resultado': fila['resultado'],
+            'fecha': _de_texto(fila['fecha'], 'fecha_hora', FORMATOS_SQL)
+        }
+    
+    def obtener_ingesta(self, endpoint, idempotencia, secuencia):
+        fila = self._conexion().execute(
+            'SELECT * FROM ingestas WHERE endpoint = ? AND idempotencia = ? AND secuencia = ?',
+            (endpoint, idempotencia, secuencia)
+        ).fetchone()
+        return self._fila_a_ingesta(fila) if fila else None
+    
+    def obtener_ingestas(self, endpoint, idempotencia):
+        """Fragmentos registrados de un envío, ordenados por secuencia (usa la clave primaria)"""
+        filas = self._conexion().execute(
+            'SELECT * FROM ingestas WHERE endpoint = ? AND idempotencia = ? ORDER BY secuencia',
+            (endpoint, idempotencia)
+        ).fetchall()
+        return [self._fila_a_ingesta(fila) for fila in filas]
+    
+    def eliminar_ingestas_anteriores(self, limite):
+        self._conexion().execute('DELETE FROM ingestas WHERE fecha < ?', (_a_texto(limite, 'fecha_hora', FORMATOS_SQL),))
+
+def crear_motor(nombre=MOTOR_ALMACENAMIENTO):
+    """Crea el motor de almacenamiento configurado"""
+    if nombre == 'sqlite':
+        return MotorSQLite()
+    if nombre == 'xml':
+        return MotorXML()
+    raise ValueError(f'Motor de almacenamiento desconocido: {nombre}')
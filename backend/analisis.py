@@ -0,0 +1,57 @@
+from models import Factura, Instancia, Configuracion, Categoria
+
+def analizar_ventas(fecha_inicio, fecha_fin):
+    """
+    Ingresos de las facturas emitidas entre fecha_inicio y fecha_fin agrupados por categoría,
+    configuración y recurso, cada grupo como [(nombre, ingreso, porcentaje)] de mayor a menor.
+    """
+    facturas, _ = Factura.listar(desde=fecha_inicio, hasta=fecha_fin)
+    
+    # Cada instancia se busca una sola vez (por clave) aunque aparezca en muchos detalles
+    configuracion_de_instancia = {}
+    configuraciones = {}
+    categorias = {}
+    
+    categorias_ingresos = {}
+    configuraciones_ingresos = {}
+    recursos_ingresos = {}
+    for factura in facturas:
+        for detalle in factura.detalles:
+            costo = detalle['costo_total']
+            id_instancia = detalle['id_instancia']
+            if id_instancia not in configuracion_de_instancia:
+                instancia = Instancia.obtener_por_id(id_instancia)
+                configuracion_de_instancia[id_instancia] = instancia.id_configuracion if instancia else None
+            id_configuracion = configuracion_de_instancia[id_instancia]
+            
+            if id_configuracion is not None:
+                if id_configuracion not in configuraciones:
+                    configuraciones[id_configuracion] = Configuracion.obtener_por_id(id_configuracion)
+                configuracion = configuraciones[id_configuracion]
+                if configuracion:
+                    if configuracion.id_categoria not in categorias:
+                        categorias[configuracion.id_categoria] = Categoria.obtener_por_id(configuracion.id_categoria)
+                    categoria = categorias[configuracion.id_categoria]
+                    if categoria:
+                        categorias_ingresos[categoria.nombre] = categorias_ingresos.get(categoria.nombre, 0) + costo
+                    configuraciones_ingresos[configuracion.nombre] = configuraciones_ingresos.get(configuracion.nombre, 0) + costo
+            
+            recursos_ingresos[detalle['nombre_recurso']] = recursos_ingresos.get(detalle['nombre_recurso'], 0) + costo
+    
+    total_ingresos = sum(factura.monto_total for factura in facturas)
+    return {
+        'fecha_inicio': fecha_inicio.strftime('%d/%m/%Y'),
+        'fecha_fin': fecha_fin.strftime('%d/%m/%Y'),
+        'categorias_ingresos': _con_porcentaje(categorias_ingresos, total_ingresos),
+        'configuraciones_ingresos': _con_porcentaje(configuraciones_ingresos, total_ingresos),
+        'recursos_ingresos': _con_porcentaje(recursos_ingresos, total_ingresos),
+        'total_ingresos': total_ingresos,
+        'total_facturas': len(facturas)
+    }
+
+def _con_porcentaje(ingresos, total):
+    """Ordena por ingreso descendente y agrega el porcentaje sobre el total"""
+    return [
+        (nombre, ingreso, round(ingreso / total * 100, 1) if total > 0 else 0)
+        for nombre, ingreso in sorted(ingresos.items(), key=lambda x: x[1], reverse=True)
+    ]
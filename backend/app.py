@@ -6,15 +6,19 @@ from routes.operaciones_routes import (
     crear_cliente, crear_instancia, cancelar_instancia,
     agregar_recurso_configuracion, limpiar_consumos_duplicados
 )
-from routes.facturacion_routes import generar_factura
+from routes.facturacion_routes import generar_factura, previsualizar_factura
+from routes.trabajos_routes import obtener_trabajo
+from routes.idempotencia_routes import obtener_ingesta
 from routes.consultas_routes import (
     reset_datos, consultar_datos, obtener_facturas,
     obtener_factura, obtener_instancia, obtener_configuracion,
-    obtener_categoria, obtener_recursos_configuracion
+    obtener_categoria, obtener_recursos_configuracion, analisis_ventas
 )
 from pdf_generator import generar_pdf_factura, generar_pdf_analisis_ventas
 from models import Factura
+import trabajos
 import os
+import multiprocessing
 
 
 app = Flask(__name__)
@@ -78,11 +82,29 @@ def limpiar_consumos_duplicados_route():
 def generar_factura_route():
     return generar_factura()
 
+@app.route('/previewFactura', methods=['POST'])
+def previsualizar_factura_route():
+    return previsualizar_factura()
+
+# Trabajos en segundo plano
+@app.route('/jobs/<id_trabajo>', methods=['GET'])
+def obtener_trabajo_route(id_trabajo):
+    return obtener_trabajo(id_trabajo)
+
+# Fragmentos aplicados de un envío con Idempotency-Key
+@app.route('/ingestas/<path:idempotencia>', methods=['GET'])
+def obtener_ingesta_route(idempotencia):
+    return obtener_ingesta(idempotencia)
+
 # Consultas individuales
 @app.route('/facturas', methods=['GET'])
 def obtener_facturas_route():
     return obtener_facturas()
 
+@app.route('/analisisVentas', methods=['GET'])
+def analisis_ventas_route():
+    return analisis_ventas()
+
 @app.route('/factura/<int:id_factura>', methods=['GET'])
 def obtener_factura_route(id_factura):
     return obtener_factura(id_factura)
@@ -110,17 +132,8 @@ def generar_pdf_factura_route(id_factura):
     try:
         print(f"=== SOLICITUD PDF PARA FACTURA {id_factura} ===")
         
-        # Método robusto: Usar obtener_todas() que sabemos que funciona
-        print("🔍 Buscando factura usando obtener_todas()...")
-        facturas_todas = Factura.obtener_todas()
-        print(f"📄 Facturas disponibles: {len(facturas_todas)}")
-        
-        factura_encontrada = None
-        for factura in facturas_todas:
-            print(f"   - Factura ID: {factura.id}")
-            if factura.id == id_factura:
-                factura_encontrada = factura
-                break
+        # Búsqueda por id: solo se decodifica la factura pedida
+        factura_encontrada = Factura.obtener_por_id(id_factura)
         
         if not factura_encontrada:
             return jsonify({'success': False, 'message': f'Factura {id_factura} no encontrada'}), 404
@@ -213,17 +226,10 @@ def debug_factura(id_factura):
     try:
         print(f"🔍 Debug factura ID: {id_factura}")
         
-        # Método 1: Usar obtener_todas
-        facturas_todas = Factura.obtener_todas()
-        factura_encontrada = None
-        
-        for factura in facturas_todas:
-            if factura.id == id_factura:
-                factura_encontrada = factura
-                break
+        factura_encontrada = Factura.obtener_por_id(id_factura)
         
         result = {
-            'total_facturas': len(facturas_todas),
+            'total_facturas': Factura.contar(),
             'factura_encontrada': factura_encontrada is not None,
             'factura_id_buscado': id_factura
         }
@@ -238,8 +244,9 @@ def debug_factura(id_factura):
                 'tiene_to_dict': hasattr(factura_encontrada, 'to_dict')
             }
             
-            # Listar IDs de todas las facturas disponibles
-            result['facturas_disponibles'] = [f.id for f in facturas_todas]
+            # IDs de las facturas más recientes (sin leer sus detalles)
+            recientes, _ = Factura.listar(limite=50, detalles=False)
+            result['facturas_disponibles'] = [f.id for f in recientes]
         
         return jsonify(result)
         
@@ -252,14 +259,8 @@ def debug_pdf_factura(id_factura):
     try:
         print(f"=== PRUEBA PDF PARA FACTURA {id_factura} ===")
         
-        # Buscar factura
-        facturas_todas = Factura.obtener_todas()
-        factura_encontrada = None
-        
-        for factura in facturas_todas:
-            if factura.id == id_factura:
-                factura_encontrada = factura
-                break
+        # Buscar factura por id
+        factura_encontrada = Factura.obtener_por_id(id_factura)
         
         if not factura_encontrada:
             return jsonify({'success': False, 'message': f'Factura {id_factura} no encontrada'}), 404
@@ -297,9 +298,18 @@ def debug_pdf_factura(id_factura):
             'traceback': traceback.format_exc()
         }), 500
 
+# Volver a encolar los mensajes que quedaron en data/cola al detenerse el servidor
+# (con el recargador de Flask, solo en el proceso hijo que atiende las peticiones; nunca en
+# los procesos de facturación, que se inician con spawn y vuelven a importar este módulo)
+if multiprocessing.parent_process() is None and (__name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+    trabajos.reanudar_pendientes()
+
 if __name__ == '__main__':
     print("=== INICIANDO SERVIDOR BACKEND ===")
     print("=== RUTAS DISPONIBLES ===")
+    print("GET  /jobs/<id>               - Progreso y resultado de un trabajo")
+    print("GET  /ingestas/<clave>        - Fragmentos aplicados de un envío idempotente")
+    print("GET  /analisisVentas?desde&hasta - Ingresos por categoría, configuración y recurso")
     print("GET  /debug-facturas          - Lista todas las facturas")
     print("GET  /debug-factura/<id>      - Depura una factura específica")
     print("GET  /debug-pdf-factura/<id>  - Prueba generación de PDF")
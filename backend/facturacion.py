@@ -0,0 +1,164 @@
+import os
+import threading
+from datetime import datetime
+from models import (
+    ModeloBase, Instancia, Consumo, Factura, Configuracion, Recurso, RecursoConfiguracion
+)
+from precios import tiene_precio, calcular_factura, calcular_facturas_en_serie, calcular_facturas_en_paralelo
+
+# Con FACTURACION_VECTORIZADA=1 (y NumPy instalado) los costos se calculan con arreglos
+FACTURACION_VECTORIZADA = os.environ.get('FACTURACION_VECTORIZADA', '0') == '1'
+
+# Con FACTURACION_PROCESOS=N (N > 1) las facturas de los clientes se reparten entre N procesos
+FACTURACION_PROCESOS = int(os.environ.get('FACTURACION_PROCESOS', '0'))
+# Por debajo de esta cantidad de clientes no compensa levantar procesos
+MINIMO_CLIENTES_PARALELO = 50
+
+# Dos corridas simultáneas leerían los mismos consumos pendientes y los cobrarían dos veces
+_lock_facturacion = threading.Lock()
+
+def ejecutar_facturacion(fecha_inicio, fecha_fin, avance=None):
+    """
+    Factura los consumos aún no facturados entre fecha_inicio y fecha_fin y devuelve la
+    lista de facturas generadas. avance(**valores), si se indica, recibe el progreso.
+    """
+    avance = avance or (lambda **valores: None)
+    
+    with _lock_facturacion:
+        instancias, consumos_por_cliente = _consumos_por_facturar(fecha_inicio, fecha_fin, avance)
+        avance(clientes_total=len(consumos_por_cliente), clientes_procesados=0, facturas_escritas=0)
+        
+        # Precios por configuración calculados una sola vez para toda la corrida
+        tabla_precios = construir_tabla_precios()
+        for id_configuracion, precios in tabla_precios.items():
+            print(f"  📋 Configuración {id_configuracion} ({precios['nombre']}): Q{precios['tarifa_hora']:.2f}/hora")
+        
+        resultados = calcular_facturas(consumos_por_cliente, instancias, tabla_precios)
+        
+        facturas = []
+        facturados = []
+        for clientes_procesados, (nit_cliente, (monto_total, detalles_factura)) in enumerate(resultados.items(), 1):
+            print(f"💰 Procesando factura para cliente {nit_cliente} con {len(consumos_por_cliente[nit_cliente])} consumos")
+            
+            if detalles_factura:
+                fecha_emision = datetime.now()
+                factura = Factura(nit_cliente, fecha_emision, monto_total, detalles_factura)
+                facturas.append(factura)
+                print(f"✅ Factura generada para cliente {nit_cliente}: Q{monto_total:.2f}")
+                # Solo quedan facturados los consumos que generaron detalles; los que no tienen
+                # precio siguen pendientes para una próxima corrida
+                facturados.append((factura, [
+                    consumo for consumo in consumos_por_cliente[nit_cliente]
+                    if tiene_precio(consumo, instancias, tabla_precios)
+                ]))
+            avance(clientes_procesados=clientes_procesados)
+        
+        # Las facturas y las marcas de sus consumos se guardan juntas. En SQLite es una sola
+        # transacción; el motor XML escribe primero las marcas y luego las facturas, y una marca
+        # sin su factura no cuenta: si se interrumpe, esos consumos se facturan en la próxima corrida
+        with ModeloBase.transaccion():
+            Factura.guardar_lote(facturas)
+            for factura, consumos in facturados:
+                Consumo.marcar_facturados(consumos, factura.id)
+        avance(facturas_escritas=len(facturas))
+        
+        facturas_generadas = [factura.to_dict() for factura in facturas]
+        print(f"=== FACTURACIÓN COMPLETADA: {len(facturas_generadas)} facturas generadas ===")
+        return facturas_generadas
+
+def _consumos_por_facturar(fecha_inicio, fecha_fin, avance):
+    """Consumos del período que aún no tienen factura, agrupados por cliente"""
+    instancias = {instancia.id: instancia for instancia in Instancia.obtener_todas()}
+    
+    print(f"Instancias encontradas: {len(instancias)}")
+    
+    consumos_revisados = 0
+    consumos_por_cliente = {}
+    for instancia in instancias.values():
+        # ✅ CORREGIDO: Comparar con el valor exacto del XML
+        if instancia.estado != 'VIGENTE':  # ← USAR 'VIGENTE' en mayúsculas
+            print(f"  ❌ Instancia no vigente: {instancia.id} (estado: {instancia.estado})")
+            continue
+        
+        # Solo se leen los consumos sin factura del período, con el índice por fecha
+        for consumo in Consumo.obtener_por_rango(fecha_inicio, fecha_fin, instancia.id, pendientes=True):
+            consumos_revisados += 1
+            if consumo.nit_cliente not in consumos_por_cliente:
+                consumos_por_cliente[consumo.nit_cliente] = []
+            consumos_por_cliente[consumo.nit_cliente].append(consumo)
+        avance(consumos_revisados=consumos_revisados)
+    
+    # Mantener el orden cronológico de los detalles dentro de cada factura
+    for lista_consumos in consumos_por_cliente.values():
+        lista_consumos.sort(key=lambda consumo: consumo.fecha_hora)
+    
+    print(f"Consumos pendientes de facturar: {sum(len(c) for c in consumos_por_cliente.values())}")
+    print(f"Clientes con consumos a facturar: {len(consumos_por_cliente)}")
+    return instancias, consumos_por_cliente
+
+def previsualizar_facturacion(fecha_inicio, fecha_fin):
+    """
+    Calcula lo que facturaría ejecutar_facturacion sin guardar nada: totales por cliente y
+    desglose por recurso. No toma el lock de facturación ni escribe en disco.
+    """
+    print(f"=== PREVISUALIZANDO FACTURAS: {fecha_inicio} a {fecha_fin} ===")
+    
+    instancias, consumos_por_cliente = _consumos_por_facturar(fecha_inicio, fecha_fin, lambda **valores: None)
+    tabla_precios = construir_tabla_precios()
+    resultados = calcular_facturas(consumos_por_cliente, instancias, tabla_precios)
+    
+    clientes = []
+    for nit_cliente, (monto_total, detalles) in resultados.items():
+        if not detalles:
+            continue
+        recursos = {}
+        for detalle in detalles:
+            recurso = recursos.setdefault(detalle['id_recurso'], {
+                'idRecurso': detalle['id_recurso'],
+                'nombreRecurso': detalle['nombre_recurso'],
+                'tiempoConsumido': 0.0,
+                'costoTotal': 0.0
+            })
+            recurso['tiempoConsumido'] += detalle['tiempo_consumido']
+            recurso['costoTotal'] += detalle['costo_total']
+        clientes.append({
+            'nitCliente': nit_cliente,
+            'consumos': len(consumos_por_cliente[nit_cliente]),
+            'montoTotal': monto_total,
+            'recursos': list(recursos.values())
+        })
+    
+    return clientes
+
+def construir_tabla_precios():
+    """Tarifa por hora de cada configuración, calculada una sola vez por corrida de facturación"""
+    recursos = {recurso.id: recurso for recurso in Recurso.obtener_todos()}
+    
+    tabla = {}
+    for configuracion in Configuracion.obtener_todas():
+        desglose = []
+        for recurso_conf in RecursoConfiguracion.obtener_por_configuracion(configuracion.id):
+            recurso = recursos.get(recurso_conf.id_recurso)
+            if recurso:
+                desglose.append({
+                    'id_recurso': recurso.id,
+                    'nombre_recurso': recurso.nombre,
+                    'cantidad': recurso_conf.cantidad,
+                    'costo_unitario': recurso.valor_hora,
+                    'costo_hora': recurso.valor_hora * recurso_conf.cantidad
+                })
+        
+        tabla[configuracion.id] = {
+            'nombre': configuracion.nombre,
+            'recursos': desglose,
+            'tarifa_hora': sum(r['costo_hora'] for r in desglose)
+        }
+    
+    return tabla
+
+def calcular_facturas(consumos_por_cliente, instancias, tabla_precios, vectorizado=FACTURACION_VECTORIZADA,
+                      procesos=FACTURACION_PROCESOS):
+    """Devuelve {nit: (monto_total, detalles)} para todos los clientes de la corrida"""
+    if procesos > 1 and len(consumos_por_cliente) >= MINIMO_CLIENTES_PARALELO:
+        return calcular_facturas_en_paralelo(consumos_por_cliente, instancias, tabla_precios, vectorizado, procesos)
+    return calcular_facturas_en_serie(consumos_por_cliente, instancias, tabla_precios, vectorizado)
@@ -0,0 +1,125 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, jsonify, make_response, g
+from models import Ingesta
+
+# Un envío se identifica con Idempotency-Key y cada fragmento dentro de él con X-Chunk-Sequence
+# (sin este encabezado el envío completo es el fragmento 0)
+ENCABEZADO_CLAVE = 'Idempotency-Key'
+ENCABEZADO_SECUENCIA = 'X-Chunk-Sequence'
+
+# Un fragmento aplicado se recuerda durante este tiempo; después la misma clave cuenta como un envío nuevo
+RETENCION_INGESTAS = timedelta(hours=int(os.environ.get('RETENCION_INGESTAS_HORAS', '24')))
+
+# Fragmentos (endpoint, clave, secuencia) que se están procesando en este momento
+# (en la petición o en un trabajo en segundo plano)
+_en_proceso = set()
+_lock = threading.Lock()
+
+def leer_fragmento(encabezados):
+    """(clave, secuencia) de la petición, o None si no trae Idempotency-Key; ValueError si la secuencia no es válida"""
+    clave = (encabezados.get(ENCABEZADO_CLAVE) or '').strip()
+    if not clave:
+        return None
+    secuencia = encabezados.get(ENCABEZADO_SECUENCIA, '0')
+    try:
+        secuencia = int(secuencia)
+    except ValueError:
+        raise ValueError(f'{ENCABEZADO_SECUENCIA} inválido: {secuencia}')
+    if secuencia < 0:
+        raise ValueError(f'{ENCABEZADO_SECUENCIA} no puede ser negativo')
+    return clave, secuencia
+
+def idempotente(vista):
+    """
+    Decorador para los endpoints de ingesta. Si el fragmento (Idempotency-Key, X-Chunk-Sequence)
+    ya se aplicó en este mismo endpoint responde lo mismo que la primera vez sin volver a leer
+    el cuerpo; si se está procesando responde 409. Un fragmento queda registrado solo cuando
+    termina bien.
+    """
+    @wraps(vista)
+    def envuelta(*args, **kwargs):
+        try:
+            fragmento = leer_fragmento(request.headers)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        if fragmento is None:
+            return vista(*args, **kwargs)
+        # La misma clave en /consumo y en /configurar son envíos distintos
+        fragmento = (request.path,) + fragmento
+        
+        with _lock:
+            if fragmento in _en_proceso:
+                return jsonify({
+                    'success': False,
+                    'message': 'Este fragmento ya se está procesando'
+                }), 409
+            _en_proceso.add(fragmento)
+        
+        encolado = False
+        try:
+            previo = Ingesta.obtener(*fragmento, vigente_desde=vigentes_desde())
+            if previo is not None:
+                print(f"♻️ Fragmento {fragmento[2]} de {fragmento[1]} ya aplicado en {fragmento[0]}, no se reprocesa")
+                return jsonify(dict(previo.resultado, success=True, repetido=True,
+                                    message='Fragmento ya aplicado anteriormente'))
+            
+            g.fragmento = fragmento
+            respuesta = make_response(vista(*args, **kwargs))
+            # 202: el fragmento sigue en proceso en un trabajo, que lo registra y libera al terminar
+            encolado = respuesta.status_code == 202
+            datos = respuesta.get_json(silent=True)
+            if respuesta.status_code == 200 and datos and datos.get('success'):
+                _registrar(fragmento, datos)
+            return respuesta
+        finally:
+            if not encolado:
+                _liberar(fragmento)
+    
+    return envuelta
+
+def al_terminar(funcion, como_respuesta=None, fragmento=None):
+    """
+    Envuelve la función de un trabajo en segundo plano encolado desde una vista idempotente
+    para registrar el fragmento cuando el trabajo termina bien y liberarlo en cualquier caso.
+    como_respuesta da al resultado del trabajo la forma de la respuesta síncrona del endpoint.
+    Fuera de una petición (al reanudar un trabajo de la cola) el fragmento se indica aquí.
+    """
+    if fragmento is None:
+        fragmento = g.get('fragmento')
+    else:
+        fragmento = tuple(fragmento)
+        with _lock:
+            _en_proceso.add(fragmento)
+    if fragmento is None:
+        return funcion
+    
+    def envuelta(*args, avance=None):
+        try:
+            resultado = funcion(*args, avance=avance)
+            _registrar(fragmento, como_respuesta(resultado) if como_respuesta else resultado)
+            return resultado
+        finally:
+            _liberar(fragmento)
+    
+    return envuelta
+
+def fragmento_actual():
+    """Fragmento (endpoint, clave, secuencia) de la petición en curso, o None; se guarda con los trabajos encolados"""
+    return g.get('fragmento')
+
+def vigentes_desde():
+    """Los fragmentos registrados antes de este momento ya vencieron"""
+    return datetime.now() - RETENCION_INGESTAS
+
+def _registrar(fragmento, resultado):
+    endpoint, clave, secuencia = fragmento
+    resultado = {k: v for k, v in resultado.items() if k not in ('success', 'message', 'trabajo')}
+    Ingesta(endpoint, clave, secuencia, resultado, datetime.now()).guardar()
+    Ingesta.eliminar_anteriores(vigentes_desde())
+
+def _liberar(fragmento):
+    with _lock:
+        _en_proceso.discard(fragmento)
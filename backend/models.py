@@ -1,49 +1,38 @@
-import xml.etree.ElementTree as ET
-import os
-from datetime import datetime
+import json
+import threading
+from almacenamiento import crear_motor
 
-# Ruta al archivo XML de base de datos
-DATABASE_PATH = 'data/database.xml'
-
-# Asegurar que el directorio de datos exista
-os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
-
-# Si el archivo no existe, crearlo con estructura básica
-if not os.path.exists(DATABASE_PATH):
-    with open(DATABASE_PATH, 'w', encoding='utf-8') as f:
-        f.write('''<?xml version="1.0" encoding="UTF-8"?>
-<database>
-    <recursos/>
-    <categorias/>
-    <configuraciones/>
-    <clientes/>
-    <instancias/>
-    <consumos/>
-    <facturas/>
-</database>''')
+class _MotorCompartido:
+    """
+    Crea el motor de almacenamiento la primera vez que se usa. Los procesos de facturación
+    vuelven a importar app.py (y con él este módulo) pero nunca tocan el almacenamiento, así
+    que en ellos no se abre ninguna base ni se revisan los archivos XML.
+    """
+    def __init__(self):
+        self._motor = None
+        self._lock = threading.Lock()
+    
+    def __get__(self, instancia, clase):
+        if self._motor is None:
+            with self._lock:
+                if self._motor is None:
+                    self._motor = crear_motor()
+        return self._motor
 
 class ModeloBase:
-    @staticmethod
-    def _obtener_root():
-        tree = ET.parse(DATABASE_PATH)
-        return tree.getroot()
+    # Motor de almacenamiento compartido por todos los modelos (XML por defecto,
+    # SQLite con la variable de entorno MOTOR_ALMACENAMIENTO=sqlite)
+    motor = _MotorCompartido()
     
     @staticmethod
-    def _guardar_xml(root):
-        tree = ET.ElementTree(root)
-        # Intentar usar ET.indent si está disponible (Python 3.9+)
-        try:
-            ET.indent(tree, space="  ", level=0)
-        except AttributeError:
-            pass  # Ignorar si no está disponible
-        tree.write(DATABASE_PATH, encoding='utf-8', xml_declaration=True)
+    def transaccion():
+        """Agrupa varios guardar() en una sola escritura durable al salir del bloque"""
+        return ModeloBase.motor.transaccion()
     
     @staticmethod
-    def _extraer_elemento(root, tag, id_value, id_attr='id'):
-        for elem in root.findall(tag):
-            if elem.get(id_attr) and int(elem.get(id_attr)) == id_value:
-                return elem
-        return None
+    def reiniciar():
+        """Deja la base de datos vacía"""
+        ModeloBase.motor.reiniciar()
 
 class Recurso(ModeloBase):
     def __init__(self, id, nombre, abreviatura, metrica, tipo, valor_hora):
@@ -55,60 +44,30 @@ class Recurso(ModeloBase):
         self.valor_hora = valor_hora
     
     def guardar(self):
-        root = self._obtener_root()
-        recursos = root.find('recursos')
-        
-        recurso_existente = self._extraer_elemento(recursos, 'recurso', self.id)
-        if recurso_existente is not None:
-            recurso_existente.find('nombre').text = self.nombre
-            recurso_existente.find('abreviatura').text = self.abreviatura
-            recurso_existente.find('metrica').text = self.metrica
-            recurso_existente.find('tipo').text = self.tipo
-            recurso_existente.find('valorXhora').text = str(self.valor_hora)
-        else:
-            nuevo_recurso = ET.SubElement(recursos, 'recurso')
-            nuevo_recurso.set('id', str(self.id))
-            ET.SubElement(nuevo_recurso, 'nombre').text = self.nombre
-            ET.SubElement(nuevo_recurso, 'abreviatura').text = self.abreviatura
-            ET.SubElement(nuevo_recurso, 'metrica').text = self.metrica
-            ET.SubElement(nuevo_recurso, 'tipo').text = self.tipo
-            ET.SubElement(nuevo_recurso, 'valorXhora').text = str(self.valor_hora)
-        
-        self._guardar_xml(root)
+        self.motor.guardar('recursos', self.to_dict())
         return True
     
+    @staticmethod
+    def _desde_registro(registro):
+        return Recurso(
+            registro['id'],
+            registro['nombre'],
+            registro['abreviatura'],
+            registro['metrica'],
+            registro['tipo'],
+            registro['valorXhora']
+        )
+    
     @staticmethod
     def obtener_por_id(id_recurso):
-        root = Recurso._obtener_root()
-        recursos = root.find('recursos')
-        recurso_elem = Recurso._extraer_elemento(recursos, 'recurso', id_recurso)
-        if recurso_elem is not None:
-            return Recurso(
-                int(recurso_elem.get('id')),
-                recurso_elem.find('nombre').text,
-                recurso_elem.find('abreviatura').text,
-                recurso_elem.find('metrica').text,
-                recurso_elem.find('tipo').text,
-                float(recurso_elem.find('valorXhora').text)
-            )
+        registro = Recurso.motor.obtener('recursos', id_recurso)
+        if registro is not None:
+            return Recurso._desde_registro(registro)
         return None
     
     @staticmethod
     def obtener_todos():
-        root = Recurso._obtener_root()
-        recursos = []
-        recursos_elem = root.find('recursos')
-        if recursos_elem is not None:
-            for recurso_elem in recursos_elem.findall('recurso'):
-                recursos.append(Recurso(
-                    int(recurso_elem.get('id')),
-                    recurso_elem.find('nombre').text,
-                    recurso_elem.find('abreviatura').text,
-                    recurso_elem.find('metrica').text,
-                    recurso_elem.find('tipo').text,
-                    float(recurso_elem.find('valorXhora').text)
-                ))
-        return recursos
+        return [Recurso._desde_registro(r) for r in Recurso.motor.obtener_todos('recursos')]
     
     def to_dict(self):
         return {
@@ -128,56 +87,28 @@ class Categoria(ModeloBase):
         self.carga_trabajo = carga_trabajo
     
     def guardar(self):
-        root = self._obtener_root()
-        categorias = root.find('categorias')
-        
-        categoria_existente = self._extraer_elemento(categorias, 'categoria', self.id)
-        if categoria_existente is not None:
-            categoria_existente.find('nombre').text = self.nombre
-            categoria_existente.find('descripcion').text = self.descripcion
-            categoria_existente.find('cargaTrabajo').text = self.carga_trabajo
-        else:
-            nueva_categoria = ET.SubElement(categorias, 'categoria')
-            nueva_categoria.set('id', str(self.id))
-            ET.SubElement(nueva_categoria, 'nombre').text = self.nombre
-            ET.SubElement(nueva_categoria, 'descripcion').text = self.descripcion
-            ET.SubElement(nueva_categoria, 'cargaTrabajo').text = self.carga_trabajo
-        
-        self._guardar_xml(root)
+        self.motor.guardar('categorias', self.to_dict())
         return True
     
+    @staticmethod
+    def _desde_registro(registro):
+        return Categoria(
+            registro['id'],
+            registro['nombre'],
+            registro['descripcion'] or "",
+            registro['cargaTrabajo']
+        )
+    
     @staticmethod
     def obtener_por_id(id_categoria):
-        root = Categoria._obtener_root()
-        categorias = root.find('categorias')
-        categoria_elem = Categoria._extraer_elemento(categorias, 'categoria', id_categoria)
-        if categoria_elem is not None:
-            desc_elem = categoria_elem.find('descripcion')
-            desc = desc_elem.text if desc_elem is not None else ""
-            return Categoria(
-                int(categoria_elem.get('id')),
-                categoria_elem.find('nombre').text,
-                desc,
-                categoria_elem.find('cargaTrabajo').text
-            )
+        registro = Categoria.motor.obtener('categorias', id_categoria)
+        if registro is not None:
+            return Categoria._desde_registro(registro)
         return None
     
     @staticmethod
     def obtener_todas():
-        root = Categoria._obtener_root()
-        categorias = []
-        categorias_elem = root.find('categorias')
-        if categorias_elem is not None:
-            for categoria_elem in categorias_elem.findall('categoria'):
-                desc_elem = categoria_elem.find('descripcion')
-                desc = desc_elem.text if desc_elem is not None else ""
-                categorias.append(Categoria(
-                    int(categoria_elem.get('id')),
-                    categoria_elem.find('nombre').text,
-                    desc,
-                    categoria_elem.find('cargaTrabajo').text
-                ))
-        return categorias
+        return [Categoria._desde_registro(r) for r in Categoria.motor.obtener_todos('categorias')]
     
     def to_dict(self):
         return {
@@ -195,56 +126,28 @@ class Configuracion(ModeloBase):
         self.id_categoria = id_categoria
     
     def guardar(self):
-        root = self._obtener_root()
-        configuraciones = root.find('configuraciones')
-        
-        config_existente = self._extraer_elemento(configuraciones, 'configuracion', self.id)
-        if config_existente is not None:
-            config_existente.find('nombre').text = self.nombre
-            config_existente.find('descripcion').text = self.descripcion
-            config_existente.find('idCategoria').text = str(self.id_categoria)
-        else:
-            nueva_config = ET.SubElement(configuraciones, 'configuracion')
-            nueva_config.set('id', str(self.id))
-            ET.SubElement(nueva_config, 'nombre').text = self.nombre
-            ET.SubElement(nueva_config, 'descripcion').text = self.descripcion
-            ET.SubElement(nueva_config, 'idCategoria').text = str(self.id_categoria)
-        
-        self._guardar_xml(root)
+        self.motor.guardar('configuraciones', self.to_dict())
         return True
     
+    @staticmethod
+    def _desde_registro(registro):
+        return Configuracion(
+            registro['id'],
+            registro['nombre'],
+            registro['descripcion'] or "",
+            registro['idCategoria']
+        )
+    
     @staticmethod
     def obtener_por_id(id_configuracion):
-        root = Configuracion._obtener_root()
-        configuraciones = root.find('configuraciones')
-        config_elem = Configuracion._extraer_elemento(configuraciones, 'configuracion', id_configuracion)
-        if config_elem is not None:
-            desc_elem = config_elem.find('descripcion')
-            desc = desc_elem.text if desc_elem is not None else ""
-            return Configuracion(
-                int(config_elem.get('id')),
-                config_elem.find('nombre').text,
-                desc,
-                int(config_elem.find('idCategoria').text)
-            )
+        registro = Configuracion.motor.obtener('configuraciones', id_configuracion)
+        if registro is not None:
+            return Configuracion._desde_registro(registro)
         return None
     
     @staticmethod
     def obtener_todas():
-        root = Configuracion._obtener_root()
-        configs = []
-        configuraciones_elem = root.find('configuraciones')
-        if configuraciones_elem is not None:
-            for config_elem in configuraciones_elem.findall('configuracion'):
-                desc_elem = config_elem.find('descripcion')
-                desc = desc_elem.text if desc_elem is not None else ""
-                configs.append(Configuracion(
-                    int(config_elem.get('id')),
-                    config_elem.find('nombre').text,
-                    desc,
-                    int(config_elem.find('idCategoria').text)
-                ))
-        return configs
+        return [Configuracion._desde_registro(r) for r in Configuracion.motor.obtener_todos('configuraciones')]
     
     def to_dict(self):
         return {
@@ -261,48 +164,14 @@ class RecursoConfiguracion(ModeloBase):
         self.cantidad = cantidad
     
     def guardar(self):
-        root = self._obtener_root()
-        config_elem = self._extraer_elemento(root.find('configuraciones'), 'configuracion', self.id_configuracion)
-        if config_elem is None:
-            return False
-        
-        recursos_config_elem = config_elem.find('recursosConfiguracion')
-        if recursos_config_elem is None:
-            recursos_config_elem = ET.SubElement(config_elem, 'recursosConfiguracion')
-        
-        recurso_conf_existente = None
-        for r in recursos_config_elem.findall('recurso'):
-            if int(r.get('id')) == self.id_recurso:
-                recurso_conf_existente = r
-                break
-        
-        if recurso_conf_existente is not None:
-            recurso_conf_existente.text = str(self.cantidad)
-        else:
-            nuevo_recurso = ET.SubElement(recursos_config_elem, 'recurso')
-            nuevo_recurso.set('id', str(self.id_recurso))
-            nuevo_recurso.text = str(self.cantidad)
-        
-        self._guardar_xml(root)
-        return True
+        return self.motor.guardar_recurso_configuracion(self.id_configuracion, self.id_recurso, self.cantidad)
     
     @staticmethod
     def obtener_por_configuracion(id_configuracion):
-        root = RecursoConfiguracion._obtener_root()
-        config_elem = RecursoConfiguracion._extraer_elemento(root.find('configuraciones'), 'configuracion', id_configuracion)
-        if config_elem is None:
-            return []
-        
-        recursos_config = []
-        recursos_elem = config_elem.find('recursosConfiguracion')
-        if recursos_elem is not None:
-            for r in recursos_elem.findall('recurso'):
-                recursos_config.append(RecursoConfiguracion(
-                    id_configuracion,
-                    int(r.get('id')),
-                    float(r.text)
-                ))
-        return recursos_config
+        return [
+            RecursoConfiguracion(id_configuracion, id_recurso, cantidad)
+            for id_recurso, cantidad in RecursoConfiguracion.motor.obtener_recursos_configuracion(id_configuracion)
+        ]
 
 class Cliente(ModeloBase):
     def __init__(self, nit, nombre, usuario, clave, direccion, correo_electronico):
@@ -314,67 +183,31 @@ class Cliente(ModeloBase):
         self.correo_electronico = correo_electronico
     
     def guardar(self):
-        root = self._obtener_root()
-        clientes = root.find('clientes')
-        
-        # ✅ Buscar por NIT como string
-        cliente_existente = None
-        for cliente_elem in clientes.findall('cliente'):
-            if cliente_elem.get('nit') == self.nit:
-                cliente_existente = cliente_elem
-                break
-        
-        if cliente_existente is not None:
-            cliente_existente.find('nombre').text = self.nombre
-            cliente_existente.find('usuario').text = self.usuario
-            cliente_existente.find('clave').text = self.clave
-            cliente_existente.find('direccion').text = self.direccion
-            cliente_existente.find('correoElectronico').text = self.correo_electronico
-        else:
-            nuevo_cliente = ET.SubElement(clientes, 'cliente')
-            nuevo_cliente.set('nit', self.nit)  # ✅ NIT como string
-            ET.SubElement(nuevo_cliente, 'nombre').text = self.nombre
-            ET.SubElement(nuevo_cliente, 'usuario').text = self.usuario
-            ET.SubElement(nuevo_cliente, 'clave').text = self.clave
-            ET.SubElement(nuevo_cliente, 'direccion').text = self.direccion
-            ET.SubElement(nuevo_cliente, 'correoElectronico').text = self.correo_electronico
-        
-        self._guardar_xml(root)
+        self.motor.guardar('clientes', self.to_dict())
         return True
     
+    @staticmethod
+    def _desde_registro(registro):
+        return Cliente(
+            registro['nit'],
+            registro['nombre'],
+            registro['usuario'],
+            registro['clave'],
+            registro['direccion'],
+            registro['correoElectronico']
+        )
+    
     @staticmethod
     def obtener_por_nit(nit):
-        root = Cliente._obtener_root()
-        clientes = root.find('clientes')
         # ✅ Buscar por NIT como string
-        for cliente_elem in clientes.findall('cliente'):
-            if cliente_elem.get('nit') == nit:
-                return Cliente(
-                    cliente_elem.get('nit'),
-                    cliente_elem.find('nombre').text,
-                    cliente_elem.find('usuario').text,
-                    cliente_elem.find('clave').text,
-                    cliente_elem.find('direccion').text,
-                    cliente_elem.find('correoElectronico').text
-                )
+        registro = Cliente.motor.obtener('clientes', nit)
+        if registro is not None:
+            return Cliente._desde_registro(registro)
         return None
     
     @staticmethod
     def obtener_todos():
-        root = Cliente._obtener_root()
-        clientes = []
-        clientes_elem = root.find('clientes')
-        if clientes_elem is not None:
-            for cliente_elem in clientes_elem.findall('cliente'):
-                clientes.append(Cliente(
-                    cliente_elem.get('nit'),
-                    cliente_elem.find('nombre').text,
-                    cliente_elem.find('usuario').text,
-                    cliente_elem.find('clave').text,
-                    cliente_elem.find('direccion').text,
-                    cliente_elem.find('correoElectronico').text
-                ))
-        return clientes
+        return [Cliente._desde_registro(r) for r in Cliente.motor.obtener_todos('clientes')]
     
     def to_dict(self):
         return {
@@ -397,95 +230,41 @@ class Instancia(ModeloBase):
         self.fecha_final = fecha_final
     
     def guardar(self):
-        root = self._obtener_root()
-        instancias = root.find('instancias')
-        
-        instancia_existente = self._extraer_elemento(instancias, 'instancia', self.id)
-        if instancia_existente is not None:
-            instancia_existente.find('idCliente').text = self.id_cliente
-            instancia_existente.find('idConfiguracion').text = str(self.id_configuracion)
-            instancia_existente.find('nombre').text = self.nombre
-            instancia_existente.find('fechaInicio').text = self.fecha_inicio.strftime('%d/%m/%Y')
-            instancia_existente.find('estado').text = self.estado
-            if self.fecha_final:
-                fecha_final_elem = instancia_existente.find('fechaFinal')
-                if fecha_final_elem is None:
-                    ET.SubElement(instancia_existente, 'fechaFinal').text = self.fecha_final.strftime('%d/%m/%Y')
-                else:
-                    fecha_final_elem.text = self.fecha_final.strftime('%d/%m/%Y')
-            else:
-                # Eliminar <fechaFinal> si existe y no se necesita
-                fecha_final_elem = instancia_existente.find('fechaFinal')
-                if fecha_final_elem is not None:
-                    instancia_existente.remove(fecha_final_elem)
-        else:
-            nueva_instancia = ET.SubElement(instancias, 'instancia')
-            nueva_instancia.set('id', str(self.id))
-            ET.SubElement(nueva_instancia, 'idCliente').text = self.id_cliente
-            ET.SubElement(nueva_instancia, 'idConfiguracion').text = str(self.id_configuracion)
-            ET.SubElement(nueva_instancia, 'nombre').text = self.nombre
-            ET.SubElement(nueva_instancia, 'fechaInicio').text = self.fecha_inicio.strftime('%d/%m/%Y')
-            ET.SubElement(nueva_instancia, 'estado').text = self.estado
-            if self.fecha_final:
-                ET.SubElement(nueva_instancia, 'fechaFinal').text = self.fecha_final.strftime('%d/%m/%Y')
-        
-        self._guardar_xml(root)
+        self.motor.guardar('instancias', {
+            'id': self.id,
+            'idCliente': self.id_cliente,
+            'idConfiguracion': self.id_configuracion,
+            'nombre': self.nombre,
+            'fechaInicio': self.fecha_inicio,
+            'estado': self.estado,
+            'fechaFinal': self.fecha_final
+        })
         return True
     
+    @staticmethod
+    def _desde_registro(registro):
+        # La fecha final solo aplica a instancias canceladas
+        fecha_final = registro['fechaFinal'] if registro['estado'] == 'Cancelada' else None
+        return Instancia(
+            registro['id'],
+            registro['idCliente'],
+            registro['idConfiguracion'],
+            registro['nombre'],
+            registro['fechaInicio'],
+            registro['estado'],
+            fecha_final
+        )
+    
     @staticmethod
     def obtener_por_id(id_instancia):
-        root = Instancia._obtener_root()
-        instancias = root.find('instancias')
-        instancia_elem = Instancia._extraer_elemento(instancias, 'instancia', id_instancia)
-        if instancia_elem is not None:
-            id_cliente = instancia_elem.find('idCliente').text
-            fecha_inicio_str = instancia_elem.find('fechaInicio').text
-            fecha_inicio = datetime.strptime(fecha_inicio_str, '%d/%m/%Y')
-            estado = instancia_elem.find('estado').text
-            fecha_final = None
-            if estado == 'Cancelada':
-                fecha_final_elem = instancia_elem.find('fechaFinal')
-                if fecha_final_elem is not None and fecha_final_elem.text:
-                    fecha_final = datetime.strptime(fecha_final_elem.text, '%d/%m/%Y')
-            
-            return Instancia(
-                int(instancia_elem.get('id')),
-                id_cliente,
-                int(instancia_elem.find('idConfiguracion').text),
-                instancia_elem.find('nombre').text,
-                fecha_inicio,
-                estado,
-                fecha_final
-            )
+        registro = Instancia.motor.obtener('instancias', id_instancia)
+        if registro is not None:
+            return Instancia._desde_registro(registro)
         return None
     
     @staticmethod
     def obtener_todas():
-        root = Instancia._obtener_root()
-        instancias = []
-        instancias_elem = root.find('instancias')
-        if instancias_elem is not None:
-            for instancia_elem in instancias_elem.findall('instancia'):
-                id_cliente = instancia_elem.find('idCliente').text
-                fecha_inicio_str = instancia_elem.find('fechaInicio').text
-                fecha_inicio = datetime.strptime(fecha_inicio_str, '%d/%m/%Y')
-                estado = instancia_elem.find('estado').text
-                fecha_final = None
-                if estado == 'Cancelada':
-                    fecha_final_elem = instancia_elem.find('fechaFinal')
-                    if fecha_final_elem is not None and fecha_final_elem.text:
-                        fecha_final = datetime.strptime(fecha_final_elem.text, '%d/%m/%Y')
-                
-                instancias.append(Instancia(
-                    int(instancia_elem.get('id')),
-                    id_cliente,
-                    int(instancia_elem.find('idConfiguracion').text),
-                    instancia_elem.find('nombre').text,
-                    fecha_inicio,
-                    estado,
-                    fecha_final
-                ))
-        return instancias
+        return [Instancia._desde_registro(r) for r in Instancia.motor.obtener_todos('instancias')]
     
     def to_dict(self):
         return {
@@ -499,61 +278,68 @@ class Instancia(ModeloBase):
         }
 
 class Consumo(ModeloBase):
-    def __init__(self, id_instancia, nit_cliente, tiempo_consumido, fecha_hora):
+    def __init__(self, id_instancia, nit_cliente, tiempo_consumido, fecha_hora, id_factura=None):
         self.id_instancia = id_instancia
         self.nit_cliente = nit_cliente
         self.tiempo_consumido = tiempo_consumido
         self.fecha_hora = fecha_hora
+        # Factura que cobró este consumo (None si aún no se factura)
+        self.id_factura = id_factura
     
     def guardar(self):
-        root = self._obtener_root()
-        consumos = root.find('consumos')
-        
-        nuevo_consumo = ET.SubElement(consumos, 'consumo')
-        nuevo_consumo.set('idInstancia', str(self.id_instancia))
-        nuevo_consumo.set('nitCliente', self.nit_cliente)
-        ET.SubElement(nuevo_consumo, 'tiempo').text = str(self.tiempo_consumido)
-        ET.SubElement(nuevo_consumo, 'fechaHora').text = self.fecha_hora.strftime('%d/%m/%Y %H:%M')
-        
-        self._guardar_xml(root)
-        return True
+        """Devuelve False si el consumo ya estaba registrado"""
+        return self.motor.agregar_consumos([self._a_registro()]) == 1
+    
+    @staticmethod
+    def guardar_lote(consumos):
+        """Guarda varios consumos con una sola escritura; devuelve cuántos eran nuevos"""
+        return Consumo.motor.agregar_consumos([consumo._a_registro() for consumo in consumos])
+    
+    def _a_registro(self):
+        return {
+            'idInstancia': self.id_instancia,
+            'nitCliente': self.nit_cliente,
+            'tiempo': self.tiempo_consumido,
+            'fechaHora': self.fecha_hora
+        }
+    
+    @staticmethod
+    def _desde_registro(registro):
+        return Consumo(registro['idInstancia'], registro['nitCliente'], registro['tiempo'], registro['fechaHora'],
+                       registro.get('idFactura'))
+    
+    @staticmethod
+    def marcar_facturados(consumos, id_factura):
+        """Registra que los consumos quedaron cobrados en la factura id_factura"""
+        Consumo.motor.marcar_consumos_facturados([(consumo._a_registro(), id_factura) for consumo in consumos])
+        for consumo in consumos:
+            consumo.id_factura = id_factura
+    
+    @staticmethod
+    def compactar():
+        """Mueve los consumos de la bitácora al almacenamiento principal"""
+        return Consumo.motor.compactar_consumos()
+    
+    @staticmethod
+    def eliminar_duplicados():
+        """Deja un solo consumo por instancia, cliente, tiempo y fecha. Devuelve cuántos quedaron"""
+        return Consumo.motor.eliminar_consumos_duplicados()
     
     @staticmethod
     def obtener_por_instancia(id_instancia):
-        root = Consumo._obtener_root()
-        consumos = []
-        consumos_elem = root.find('consumos')
-        if consumos_elem is not None:
-            for consumo_elem in consumos_elem.findall('consumo'):
-                if int(consumo_elem.get('idInstancia')) == id_instancia:
-                    tiempo = float(consumo_elem.find('tiempo').text)
-                    fecha_hora_str = consumo_elem.find('fechaHora').text
-                    fecha_hora = datetime.strptime(fecha_hora_str, '%d/%m/%Y %H:%M')
-                    consumos.append(Consumo(
-                        id_instancia,
-                        consumo_elem.get('nitCliente'),
-                        tiempo,
-                        fecha_hora
-                    ))
-        return consumos
+        return [Consumo._desde_registro(r) for r in Consumo.motor.obtener_consumos(id_instancia)]
     
     @staticmethod
     def obtener_todos():
-        root = Consumo._obtener_root()
-        consumos = []
-        consumos_elem = root.find('consumos')
-        if consumos_elem is not None:
-            for consumo_elem in consumos_elem.findall('consumo'):
-                tiempo = float(consumo_elem.find('tiempo').text)
-                fecha_hora_str = consumo_elem.find('fechaHora').text
-                fecha_hora = datetime.strptime(fecha_hora_str, '%d/%m/%Y %H:%M')
-                consumos.append(Consumo(
-                    int(consumo_elem.get('idInstancia')),
-                    consumo_elem.get('nitCliente'),
-                    tiempo,
-                    fecha_hora
-                ))
-        return consumos
+        return [Consumo._desde_registro(r) for r in Consumo.motor.obtener_consumos()]
+    
+    @staticmethod
+    def obtener_por_rango(inicio, fin, id_instancia=None, pendientes=False):
+        """
+        Consumos con inicio <= fecha_hora <= fin (opcionalmente de una instancia), ordenados por
+        fecha. Con pendientes=True solo los que aún no se han facturado.
+        """
+        return [Consumo._desde_registro(r) for r in Consumo.motor.obtener_consumos_por_rango(inicio, fin, id_instancia, pendientes)]
     
     def to_dict(self):
         return {
@@ -564,6 +350,9 @@ class Consumo(ModeloBase):
         }
 
 class Factura(ModeloBase):
+    # Último id entregado: en un lote se crean muchas facturas en el mismo milisegundo
+    _ultimo_id = 0
+    
     def __init__(self, nit_cliente, fecha_emision, monto_total, detalles):
         self.id = self._generar_id_factura()
         self.nit_cliente = nit_cliente
@@ -575,110 +364,120 @@ class Factura(ModeloBase):
         # ✅ CORREGIDO: Usar timestamp más un random para evitar duplicados
         import time
         import random
-        return int(time.time() * 1000) + random.randint(100, 999)  # ✅ También necesita datetime aquí
+        candidato = int(time.time() * 1000) + random.randint(100, 999)  # ✅ También necesita datetime aquí
+        Factura._ultimo_id = max(candidato, Factura._ultimo_id + 1)
+        return Factura._ultimo_id
     
-    def to_dict(self):
+    def guardar(self):
+        self.motor.agregar_factura(self._a_registro())
+        return True
+    
+    @staticmethod
+    def guardar_lote(facturas):
+        """Guarda varias facturas con una sola escritura"""
+        Factura.motor.agregar_facturas([factura._a_registro() for factura in facturas])
+        return True
+    
+    def _a_registro(self):
         return {
             'id': self.id,
             'nitCliente': self.nit_cliente,
-            'fechaEmision': self.fecha_emision.strftime('%d/%m/%Y'),
+            'fechaEmision': self.fecha_emision,
             'montoTotal': self.monto_total,
             'detalles': self.detalles
         }
-
-    def guardar(self):
-        root = self._obtener_root()
-        facturas = root.find('facturas')
-        
-        nueva_factura = ET.SubElement(facturas, 'factura')
-        nueva_factura.set('id', str(self.id))
-        ET.SubElement(nueva_factura, 'nitCliente').text = self.nit_cliente
-        ET.SubElement(nueva_factura, 'fechaEmision').text = self.fecha_emision.strftime('%d/%m/%Y')  # ✅ Formatear correctamente
-        ET.SubElement(nueva_factura, 'montoTotal').text = str(self.monto_total)
-        
-        detalles_elem = ET.SubElement(nueva_factura, 'detalles')
-        for detalle in self.detalles:
-            detalle_elem = ET.SubElement(detalles_elem, 'detalle')
-            ET.SubElement(detalle_elem, 'idInstancia').text = str(detalle['id_instancia'])
-            ET.SubElement(detalle_elem, 'nombreInstancia').text = detalle['nombre_instancia']
-            ET.SubElement(detalle_elem, 'idRecurso').text = str(detalle['id_recurso'])
-            ET.SubElement(detalle_elem, 'nombreRecurso').text = detalle['nombre_recurso']
-            ET.SubElement(detalle_elem, 'cantidad').text = str(detalle['cantidad'])
-            ET.SubElement(detalle_elem, 'tiempoConsumido').text = str(detalle['tiempo_consumido'])
-            ET.SubElement(detalle_elem, 'costoUnitario').text = str(detalle['costo_unitario'])
-            ET.SubElement(detalle_elem, 'costoTotal').text = str(detalle['costo_total'])
-        
-        self._guardar_xml(root)
-        return True
+    
+    @staticmethod
+    def _desde_registro(registro):
+        factura = Factura(registro['nitCliente'], registro['fechaEmision'], registro['montoTotal'], registro['detalles'])
+        factura.id = registro['id']
+        return factura
     
     @staticmethod
     def obtener_por_id(id_factura):
-        root = Factura._obtener_root()
-        facturas = root.find('facturas')
-        factura_elem = Factura._extraer_elemento(facturas, 'factura', id_factura)
-        if factura_elem is not None:
-            nit_cliente = factura_elem.find('nitCliente').text
-            fecha_emision_str = factura_elem.find('fechaEmision').text
-            fecha_emision = datetime.strptime(fecha_emision_str, '%d/%m/%Y')
-            monto_total = float(factura_elem.find('montoTotal').text)
-            
-            detalles = []
-            detalles_elem = factura_elem.find('detalles')
-            if detalles_elem is not None:
-                for detalle_elem in detalles_elem.findall('detalle'):
-                    detalles.append({
-                        'id_instancia': int(detalle_elem.find('idInstancia').text),
-                        'nombre_instancia': detalle_elem.find('nombreInstancia').text,
-                        'id_recurso': int(detalle_elem.find('idRecurso').text),
-                        'nombre_recurso': detalle_elem.find('nombreRecurso').text,
-                        'cantidad': float(detalle_elem.find('cantidad').text),
-                        'tiempo_consumido': float(detalle_elem.find('tiempoConsumido').text),
-                        'costo_unitario': float(detalle_elem.find('costoUnitario').text),
-                        'costo_total': float(detalle_elem.find('costoTotal').text)
-                    })
-            
-            factura = Factura(nit_cliente, fecha_emision, monto_total, detalles)
-            factura.id = int(factura_elem.get('id'))
-            return factura
+        registro = Factura.motor.obtener_factura(id_factura)
+        if registro is not None:
+            return Factura._desde_registro(registro)
         return None
     
     @staticmethod
     def obtener_todas():
-        root = Factura._obtener_root()
-        facturas = []
-        facturas_elem = root.find('facturas')
-        if facturas_elem is not None:
-            for factura_elem in facturas_elem.findall('factura'):
-                nit_cliente = factura_elem.find('nitCliente').text
-                fecha_emision_str = factura_elem.find('fechaEmision').text
-                fecha_emision = datetime.strptime(fecha_emision_str, '%d/%m/%Y')
-                monto_total = float(factura_elem.find('montoTotal').text)
-                
-                detalles = []
-                detalles_elem = factura_elem.find('detalles')
-                if detalles_elem is not None:
-                    for detalle_elem in detalles_elem.findall('detalle'):
-                        detalles.append({
-                            'id_instancia': int(detalle_elem.find('idInstancia').text),
-                            'nombre_instancia': detalle_elem.find('nombreInstancia').text,
-                            'id_recurso': int(detalle_elem.find('idRecurso').text),
-                            'nombre_recurso': detalle_elem.find('nombreRecurso').text,
-                            'cantidad': float(detalle_elem.find('cantidad').text),
-                            'tiempo_consumido': float(detalle_elem.find('tiempoConsumido').text),
-                            'costo_unitario': float(detalle_elem.find('costoUnitario').text),
-                            'costo_total': float(detalle_elem.find('costoTotal').text)
-                        })
-                
-                factura = Factura(nit_cliente, fecha_emision, monto_total, detalles)
-                factura.id = int(factura_elem.get('id'))
-                facturas.append(factura)
-        return facturas
+        return [Factura._desde_registro(r) for r in Factura.motor.obtener_facturas()]
+    
+    @staticmethod
+    def contar():
+        return Factura.motor.contar_facturas()
+    
+    @staticmethod
+    def listar(limite=None, cursor=None, detalles=True, **filtros):
+        """
+        Página de facturas de la más reciente a la más antigua. Filtros: nit_cliente, desde,
+        hasta, monto_minimo, monto_maximo. Devuelve (facturas, cursor de la siguiente página o None).
+        Sin detalles las facturas quedan con detalles=None.
+        """
+        # Se pide una de más para saber si hay otra página
+        registros = Factura.motor.listar_facturas(
+            limite=limite + 1 if limite is not None else None, antes_de=cursor, detalles=detalles, **filtros
+        )
+        siguiente = None
+        if limite is not None and len(registros) > limite:
+            registros = registros[:limite]
+            siguiente = registros[-1]['id']
+        facturas = [Factura._desde_registro(dict(r, detalles=r.get('detalles'))) for r in registros]
+        return facturas, siguiente
     
     def to_dict(self):
-        return {
+        datos = {
             'id': self.id,
             'nitCliente': self.nit_cliente,
             'fechaEmision': self.fecha_emision.strftime('%d/%m/%Y'),
             'montoTotal': self.monto_total,
             'detalles': self.detalles
-        }
\ No newline at end of file
+        }
+        # Proyección resumida (Factura.listar sin detalles)
+        if self.detalles is None:
+            del datos['detalles']
+        return datos
+
+class Ingesta(ModeloBase):
+    """Fragmento de un envío con Idempotency-Key que ya se aplicó en un endpoint, con la respuesta que se dio"""
+    def __init__(self, endpoint, idempotencia, secuencia, resultado, fecha):
+        self.endpoint = endpoint
+        self.idempotencia = idempotencia
+        self.secuencia = secuencia
+        self.resultado = resultado
+        self.fecha = fecha
+    
+    def guardar(self):
+        self.motor.guardar_ingesta({
+            'endpoint': self.endpoint,
+            'idempotencia': self.idempotencia,
+            'secuencia': self.secuencia,
+            'resultado': json.dumps(self.resultado),
+            'fecha': self.fecha
+        })
+        return True
+    
+    @staticmethod
+    def _desde_registro(registro):
+        return Ingesta(registro['endpoint'], registro['idempotencia'], registro['secuencia'],
+                       json.loads(registro['resultado']), registro['fecha'])
+    
+    @staticmethod
+    def obtener(endpoint, idempotencia, secuencia, vigente_desde=None):
+        """Fragmento registrado, o None si no existe o se registró antes de vigente_desde"""
+        registro = Ingesta.motor.obtener_ingesta(endpoint, idempotencia, secuencia)
+        if registro is None or (vigente_desde is not None and registro['fecha'] < vigente_desde):
+            return None
+        return Ingesta._desde_registro(registro)
+    
+    @staticmethod
+    def obtener_por_idempotencia(endpoint, idempotencia, vigente_desde=None):
+        """Fragmentos aplicados de un envío, ordenados por secuencia"""
+        return [Ingesta._desde_registro(r) for r in Ingesta.motor.obtener_ingestas(endpoint, idempotencia)
+                if vigente_desde is None or r['fecha'] >= vigente_desde]
+    
+    @staticmethod
+    def eliminar_anteriores(limite):
+        """Olvida los fragmentos registrados antes de limite"""
+        Ingesta.motor.eliminar_ingestas_anteriores(limite)
@@ -0,0 +1,180 @@
+"""
+Cálculo de montos y detalles de factura a partir de la tabla de precios. Este módulo no usa
+el almacenamiento (no importa models): los procesos de facturación en paralelo solo importan
+esto y reciben instancias y consumos como valores simples.
+"""
+import math
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional: sin él se usa el cálculo en Python puro
+    np = None
+
+# Lo que el cálculo usa de una instancia y de un consumo; es lo que se envía a los procesos
+InstanciaPrecio = namedtuple('InstanciaPrecio', ['id', 'id_configuracion', 'nombre'])
+ConsumoPrecio = namedtuple('ConsumoPrecio', ['id_instancia', 'tiempo_consumido', 'fecha_hora'])
+
+# Copia de solo lectura de instancias y precios que recibe cada proceso al iniciar
+_snapshot = None
+
+def tiene_precio(consumo, instancias, tabla_precios):
+    """Si calcular_factura genera detalles para el consumo"""
+    instancia = instancias.get(consumo.id_instancia)
+    precios = tabla_precios.get(instancia.id_configuracion) if instancia else None
+    return bool(precios and precios['recursos'])
+
+def calcular_factura(consumos, instancias, tabla_precios):
+    """Devuelve (monto_total, detalles) de los consumos de un cliente usando la tabla de precios"""
+    monto_total = 0.0
+    detalles = []
+    
+    for consumo in consumos:
+        instancia = instancias.get(consumo.id_instancia)
+        if not instancia:
+            continue
+        
+        precios = tabla_precios.get(instancia.id_configuracion)
+        if not precios:
+            continue
+        
+        fecha_consumo = consumo.fecha_hora.strftime('%d/%m/%Y %H:%M')
+        for recurso in precios['recursos']:
+            # Calcular costo para este consumo específico
+            costo_recurso = recurso['costo_hora'] * consumo.tiempo_consumido
+            monto_total += costo_recurso
+            
+            detalles.append({
+                'id_instancia': consumo.id_instancia,
+                'nombre_instancia': instancia.nombre,
+                'id_recurso': recurso['id_recurso'],
+                'nombre_recurso': recurso['nombre_recurso'],
+                'cantidad': recurso['cantidad'],
+                'tiempo_consumido': consumo.tiempo_consumido,
+                'costo_unitario': recurso['costo_unitario'],
+                'costo_total': costo_recurso,
+                'fecha_consumo': fecha_consumo
+            })
+    
+    return monto_total, detalles
+
+def calcular_facturas_en_serie(consumos_por_cliente, instancias, tabla_precios, vectorizado=False):
+    """Devuelve {nit: (monto_total, detalles)} en este mismo proceso"""
+    if vectorizado and np is not None:
+        return _calcular_facturas_numpy(consumos_por_cliente, instancias, tabla_precios)
+    return {
+        nit: calcular_factura(consumos, instancias, tabla_precios)
+        for nit, consumos in consumos_por_cliente.items()
+    }
+
+def _calcular_facturas_numpy(consumos_por_cliente, instancias, tabla_precios):
+    """Misma salida que calcular_factura, con columnas, costos y totales calculados sobre arreglos"""
+    # Plantillas de detalle por (instancia, recurso): las de cada instancia con precio quedan contiguas
+    ids_instancia = sorted(
+        id_instancia for id_instancia, instancia in instancias.items()
+        if instancia.id_configuracion in tabla_precios
+    )
+    plantillas = []
+    costo_hora = []
+    inicio_instancia = []
+    recursos_instancia = []
+    for id_instancia in ids_instancia:
+        instancia = instancias[id_instancia]
+        recursos = tabla_precios[instancia.id_configuracion]['recursos']
+        inicio_instancia.append(len(plantillas))
+        recursos_instancia.append(len(recursos))
+        for recurso in recursos:
+            costo_hora.append(recurso['costo_hora'])
+            plantillas.append({
+                'id_instancia': id_instancia,
+                'nombre_instancia': instancia.nombre,
+                'id_recurso': recurso['id_recurso'],
+                'nombre_recurso': recurso['nombre_recurso'],
+                'cantidad': recurso['cantidad'],
+                'tiempo_consumido': None,
+                'costo_unitario': recurso['costo_unitario'],
+                'costo_total': None,
+                'fecha_consumo': None
+            })
+    ids_instancia = np.array(ids_instancia, dtype=np.int64)
+    inicio_instancia = np.array(inicio_instancia, dtype=np.int64)
+    recursos_instancia = np.array(recursos_instancia, dtype=np.int64)
+    costo_hora = np.array(costo_hora, dtype=np.float64)
+    
+    # Columnas por consumo, todos los clientes seguidos
+    nits = list(consumos_por_cliente)
+    consumos = [consumo for nit in nits for consumo in consumos_por_cliente[nit]]
+    cliente = np.repeat(np.arange(len(nits)),
+                        np.fromiter((len(consumos_por_cliente[nit]) for nit in nits), dtype=np.int64, count=len(nits)))
+    instancia = np.fromiter((consumo.id_instancia for consumo in consumos), dtype=np.int64, count=len(consumos))
+    tiempo = np.fromiter((consumo.tiempo_consumido for consumo in consumos), dtype=np.float64, count=len(consumos))
+    
+    # Instancia de cada consumo dentro de las que tienen precio; sin instancia o sin precio no genera filas
+    indice = np.minimum(np.searchsorted(ids_instancia, instancia), max(len(ids_instancia) - 1, 0))
+    con_precio = ids_instancia[indice] == instancia if len(ids_instancia) else np.zeros(len(consumos), dtype=bool)
+    recursos_por_consumo = np.where(con_precio, recursos_instancia[indice] if len(ids_instancia) else 0, 0)
+    
+    # Una fila por (consumo, recurso), en el mismo orden que el cálculo en Python
+    fila = np.repeat(np.arange(len(consumos)), recursos_por_consumo)
+    desplazamiento = np.arange(len(fila)) - np.repeat(np.cumsum(recursos_por_consumo) - recursos_por_consumo, recursos_por_consumo)
+    posicion = inicio_instancia[indice[fila]] + desplazamiento if len(fila) else np.zeros(0, dtype=np.int64)
+    costos = costo_hora[posicion] * tiempo[fila] if len(fila) else np.zeros(0)
+    
+    # Total y cantidad de detalles por cliente como sumas agrupadas
+    montos = np.bincount(cliente[fila], weights=costos, minlength=len(nits))
+    fin_cliente = np.cumsum(np.bincount(cliente[fila], minlength=len(nits))).tolist()
+    
+    # Solo quedan en Python los diccionarios de salida; cada fecha distinta se formatea una vez
+    fechas = {}
+    detalles = []
+    anterior = -1
+    for f, p, costo_recurso in zip(fila.tolist(), posicion.tolist(), costos.tolist()):
+        if f != anterior:
+            # Las filas de un mismo consumo van seguidas
+            anterior = f
+            consumo = consumos[f]
+            fecha_consumo = fechas.get(consumo.fecha_hora)
+            if fecha_consumo is None:
+                fecha_consumo = fechas[consumo.fecha_hora] = consumo.fecha_hora.strftime('%d/%m/%Y %H:%M')
+        detalle = plantillas[p].copy()
+        detalle['tiempo_consumido'] = consumo.tiempo_consumido
+        detalle['costo_total'] = costo_recurso
+        detalle['fecha_consumo'] = fecha_consumo
+        detalles.append(detalle)
+    
+    return {nit: (float(montos[i]), detalles[fin_cliente[i - 1] if i else 0:fin_cliente[i]])
+            for i, nit in enumerate(nits)}
+
+def _iniciar_proceso(instancias, tabla_precios, vectorizado):
+    global _snapshot
+    _snapshot = (instancias, tabla_precios, vectorizado)
+
+def _calcular_lote(lote):
+    instancias, tabla_precios, vectorizado = _snapshot
+    return calcular_facturas_en_serie(dict(lote), instancias, tabla_precios, vectorizado)
+
+def calcular_facturas_en_paralelo(consumos_por_cliente, instancias, tabla_precios, vectorizado, procesos):
+    """Calcula las facturas por lotes de clientes en un pool de procesos y une los resultados en orden"""
+    # Solo valores simples: deshacer el pickle de un modelo importaría models (y crearía un motor) en el proceso
+    instancias = {
+        id_instancia: InstanciaPrecio(instancia.id, instancia.id_configuracion, instancia.nombre)
+        for id_instancia, instancia in instancias.items()
+    }
+    clientes = [
+        (nit, [ConsumoPrecio(c.id_instancia, c.tiempo_consumido, c.fecha_hora) for c in consumos])
+        for nit, consumos in consumos_por_cliente.items()
+    ]
+    # Varios lotes por proceso para repartir bien clientes con distinta cantidad de consumos
+    tamano_lote = max(1, math.ceil(len(clientes) / (procesos * 4)))
+    lotes = [clientes[i:i + tamano_lote] for i in range(0, len(clientes), tamano_lote)]
+    
+    resultados = {}
+    # spawn: un fork copiaría los hilos del servidor (y los locks que tuvieran tomados) al proceso hijo
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_iniciar_proceso,
+                             initargs=(instancias, tabla_precios, vectorizado)) as pool:
+        for parcial in pool.map(_calcular_lote, lotes):
+            resultados.update(parcial)
+    return resultados
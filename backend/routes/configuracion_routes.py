@@ -1,142 +1,65 @@
 from flask import request, jsonify
+import shutil
+import tempfile
 import xml.etree.ElementTree as ET
-from models import Recurso, Categoria, Configuracion, Cliente, Instancia, RecursoConfiguracion
-from utils import extraer_fecha, limpiar_xml 
+from models import ModeloBase, Recurso, Categoria, Configuracion, Cliente, Instancia, RecursoConfiguracion
+from utils import extraer_fecha, FlujoXML, descomprimir_flujo
+import trabajos
+from idempotencia import idempotente, al_terminar, fragmento_actual
+
+# Cuántos rechazos se detallan en la respuesta (el resto solo se cuenta)
+MAXIMO_ERRORES_REPORTADOS = 100
+
+# Hasta este tamaño el mensaje se copia en memoria; los mayores pasan a un archivo temporal
+TAMANO_COPIA_EN_MEMORIA = 8 * 1024 * 1024
+
+@idempotente
 def configurar():
     try:
         print("=== INICIANDO PROCESAMIENTO CONFIGURACIÓN ===")
         
-        xml_data = request.get_data()
-        print(f"Datos recibidos (primeros 200 chars): {xml_data[:200]}")
-        
-        xml_str = limpiar_xml(xml_data)
-        print(f"XML limpio (primeros 200 chars): {xml_str[:200]}")
+        # Se lee el cuerpo por partes (descomprimiéndolo si viene con Content-Encoding):
+        # nunca se guarda el mensaje completo en memoria
+        try:
+            flujo = descomprimir_flujo(request.stream, request.headers.get('Content-Encoding'))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 415
+        flujo = FlujoXML(flujo)
         
-        if not xml_str:
+        if flujo.vacio:
             return jsonify({
                 'success': False,
                 'message': 'El archivo XML está vacío'
             }), 400
         
-        root = ET.fromstring(xml_str)
-        print(f"Elemento raíz encontrado: {root.tag}")
-        
-        resultados = {
-            'clientes_creados': 0,
-            'instancias_creadas': 0,
-            'recursos_creados': 0,
-            'categorias_creadas': 0,
-            'configuraciones_creadas': 0
-        }
-        
-        # ... (el resto del código igual)
-        
-        # Procesar Recursos
-        lista_recursos = root.find('listaRecursos')
-        if lista_recursos is not None:
-            print(f"Procesando {len(lista_recursos)} recursos")
-            for recurso_elem in lista_recursos:
-                id_recurso = int(recurso_elem.get('id'))
-                nombre = recurso_elem.find('nombre').text
-                abreviatura = recurso_elem.find('abreviatura').text
-                metrica = recurso_elem.find('metrica').text
-                tipo = recurso_elem.find('tipo').text
-                valor_hora = float(recurso_elem.find('valorXhora').text)
-                
-                print(f"  - Recurso {id_recurso}: {nombre}")
-                
-                nuevo_recurso = Recurso(id_recurso, nombre, abreviatura, metrica, tipo, valor_hora)
-                if nuevo_recurso.guardar():
-                    resultados['recursos_creados'] += 1
-        
-        # Procesar Categorías
-        lista_categorias = root.find('listaCategorias')
-        if lista_categorias is not None:
-            print(f"Procesando {len(lista_categorias)} categorías")
-            for categoria_elem in lista_categorias:
-                id_categoria = int(categoria_elem.get('id'))
-                nombre = categoria_elem.find('nombre').text
-                descripcion_elem = categoria_elem.find('descripcion')
-                descripcion = descripcion_elem.text if descripcion_elem is not None else ""
-                carga_trabajo = categoria_elem.find('cargaTrabajo').text
-                
-                print(f"  - Categoría {id_categoria}: {nombre}")
-                
-                nueva_categoria = Categoria(id_categoria, nombre, descripcion, carga_trabajo)
-                if nueva_categoria.guardar():
-                    resultados['categorias_creadas'] += 1
-                    
-                    lista_configuraciones = categoria_elem.find('listaConfiguraciones')
-                    if lista_configuraciones is not None:
-                        for config_elem in lista_configuraciones:
-                            id_config = int(config_elem.get('id'))
-                            nombre_conf = config_elem.find('nombre').text
-                            desc_conf_elem = config_elem.find('descripcion')
-                            desc_conf = desc_conf_elem.text if desc_conf_elem is not None else ""
-                            
-                            print(f"    - Configuración {id_config}: {nombre_conf}")
-                            
-                            nueva_config = Configuracion(id_config, nombre_conf, desc_conf, id_categoria)
-                            if nueva_config.guardar():
-                                resultados['configuraciones_creadas'] += 1
-                                
-                                recursos_config = config_elem.find('recursosConfiguracion')
-                                if recursos_config is not None:
-                                    for recurso_conf in recursos_config:
-                                        id_recurso_conf = int(recurso_conf.get('id'))
-                                        cantidad = float(recurso_conf.text)
-                                        print(f"      - Recurso config {id_recurso_conf}: {cantidad}")
-                                        
-                                        nueva_asoc = RecursoConfiguracion(id_config, id_recurso_conf, cantidad)
-                                        nueva_asoc.guardar()
-        
-        # Procesar Clientes
-        lista_clientes = root.find('listaClientes')
-        if lista_clientes is not None:
-            print(f"Procesando {len(lista_clientes)} clientes")
-            for cliente_elem in lista_clientes:
-                nit = cliente_elem.get('nit')
-                nombre = cliente_elem.find('nombre').text
-                usuario = cliente_elem.find('usuario').text
-                clave = cliente_elem.find('clave').text
-                direccion = cliente_elem.find('direccion').text
-                correo = cliente_elem.find('correoElectronico').text
-                
-                print(f"  - Cliente {nit}: {nombre}")
-                
-                nuevo_cliente = Cliente(nit, nombre, usuario, clave, direccion, correo)
-                if nuevo_cliente.guardar():
-                    resultados['clientes_creados'] += 1
-                    
-                    lista_instancias = cliente_elem.find('listaInstancias')
-                    if lista_instancias is not None:
-                        for instancia_elem in lista_instancias:
-                            id_inst = int(instancia_elem.get('id'))
-                            id_config = int(instancia_elem.find('idConfiguracion').text)
-                            nombre_inst = instancia_elem.find('nombre').text
-                            fecha_inicio = extraer_fecha(instancia_elem.find('fechaInicio').text)
-                            estado = instancia_elem.find('estado').text
-                            fecha_final = None
-                            if estado == 'Cancelada':
-                                fecha_final_elem = instancia_elem.find('fechaFinal')
-                                if fecha_final_elem is not None and fecha_final_elem.text:
-                                    fecha_final = extraer_fecha(fecha_final_elem.text)
-                            
-                            print(f"    - Instancia {id_inst}: {nombre_inst} para cliente {nit}")
-                            
-                            nueva_instancia = Instancia(id_inst, nit, id_config, nombre_inst, fecha_inicio, estado, fecha_final)
-                            if nueva_instancia.guardar():
-                                resultados['instancias_creadas'] += 1
+        # Con ?asincrono=1 el mensaje se guarda en la cola y se responde de inmediato (GET /jobs/<id>)
+        if request.args.get('asincrono') == '1':
+            funcion = al_terminar(procesar_configuracion, _como_respuesta)
+            id_trabajo = trabajos.encolar_archivo('configuracion', flujo, funcion, cola='ingesta',
+                                                  datos={'fragmento': fragmento_actual()})
+            print(f"📨 Mensaje de configuración encolado como trabajo {id_trabajo}")
+            return jsonify({
+                'success': True,
+                'message': 'Mensaje de configuración recibido, en proceso',
+                'trabajo': id_trabajo
+            }), 202
         
-        print("=== PROCESAMIENTO COMPLETADO ===")
-        print(f"Resultados: {resultados}")
+        # Se copia el mensaje completo antes de procesarlo: la transacción bloquea a los demás
+        # endpoints y no debe quedar esperando a que el cuerpo termine de llegar por la red
+        with tempfile.SpooledTemporaryFile(max_size=TAMANO_COPIA_EN_MEMORIA) as copia:
+            shutil.copyfileobj(flujo, copia, 1024 * 1024)
+            copia.seek(0)
+            resultados = procesar_configuracion(copia)
         
         return jsonify({
             'success': True,
             'message': 'Mensaje de configuración procesado exitosamente',
             'resultados': resultados
         })
-        
+    
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
@@ -144,4 +67,157 @@ def configurar():
         return jsonify({
             'success': False,
             'message': f'Error: {str(e)}'
-        }), 400
\ No newline at end of file
+        }), 400
+
+def _como_respuesta(resultados):
+    return {'resultados': resultados}
+
+def _reanudar(datos):
+    """Función de un trabajo de configuración que quedó en la cola al detenerse el servidor"""
+    return al_terminar(procesar_configuracion, _como_respuesta, fragmento=datos.get('fragmento'))
+
+trabajos.registrar_reanudador('configuracion', _reanudar)
+
+def procesar_configuracion(flujo, avance=None):
+    """
+    Aplica un mensaje de configuración leído por partes desde flujo y devuelve los resultados.
+    Un recurso, categoría o cliente con datos inválidos se rechaza y se sigue con el resto.
+    """
+    avance = avance or (lambda **valores: None)
+    flujo = FlujoXML(flujo)
+    
+    resultados = {
+        'clientes_creados': 0,
+        'instancias_creadas': 0,
+        'recursos_creados': 0,
+        'categorias_creadas': 0,
+        'configuraciones_creadas': 0,
+        'rechazados': 0,
+        'errores': []
+    }
+    
+    lectores = {
+        'listaRecursos': _leer_recurso,
+        'listaCategorias': _leer_categoria,
+        'listaClientes': _leer_cliente
+    }
+    
+    # Una sola escritura a disco para todo el mensaje
+    with ModeloBase.transaccion():
+        pila = []
+        for evento, elem in ET.iterparse(flujo, events=('start', 'end')):
+            if evento == 'start':
+                if not pila:
+                    print(f"Elemento raíz encontrado: {elem.tag}")
+                pila.append(elem)
+                continue
+            
+            pila.pop()
+            # Cada recurso, categoría o cliente se procesa al cerrarse y luego se descarta
+            if len(pila) == 2 and pila[1].tag in lectores:
+                # Primero se lee y convierte el elemento completo (con todo lo anidado): si algo
+                # es inválido se rechaza entero, sin haber guardado ni contado nada de él
+                try:
+                    objetos = lectores[pila[1].tag](elem)
+                except (AttributeError, TypeError, ValueError) as e:
+                    _rechazar(resultados, elem, e)
+                else:
+                    _guardar(objetos, resultados)
+                avance(**dict(resultados, errores=list(resultados['errores'])))
+                pila[1].remove(elem)
+                elem.clear()
+    
+    print("=== PROCESAMIENTO COMPLETADO ===")
+    print(f"Resultados: {resultados}")
+    return resultados
+
+def _rechazar(resultados, elem, error):
+    resultados['rechazados'] += 1
+    # Un campo obligatorio ausente aparece como elem.find(...) == None
+    motivo = 'faltan campos obligatorios' if isinstance(error, AttributeError) else str(error)
+    identificador = elem.get('id') or elem.get('nit')
+    if len(resultados['errores']) < MAXIMO_ERRORES_REPORTADOS:
+        print(f"❌ {elem.tag} {identificador} rechazado: {motivo}")
+        resultados['errores'].append({'elemento': elem.tag, 'id': identificador, 'error': motivo})
+
+def _guardar(objetos, resultados):
+    """Guarda los objetos leídos de un elemento [(objeto, contador o None)] en orden"""
+    for objeto, contador in objetos:
+        if objeto.guardar() and contador:
+            resultados[contador] += 1
+
+def _leer_recurso(recurso_elem):
+    id_recurso = int(recurso_elem.get('id'))
+    nombre = recurso_elem.find('nombre').text
+    abreviatura = recurso_elem.find('abreviatura').text
+    metrica = recurso_elem.find('metrica').text
+    tipo = recurso_elem.find('tipo').text
+    valor_hora = float(recurso_elem.find('valorXhora').text)
+    
+    print(f"  - Recurso {id_recurso}: {nombre}")
+    
+    return [(Recurso(id_recurso, nombre, abreviatura, metrica, tipo, valor_hora), 'recursos_creados')]
+
+def _leer_categoria(categoria_elem):
+    id_categoria = int(categoria_elem.get('id'))
+    nombre = categoria_elem.find('nombre').text
+    descripcion_elem = categoria_elem.find('descripcion')
+    descripcion = descripcion_elem.text if descripcion_elem is not None else ""
+    carga_trabajo = categoria_elem.find('cargaTrabajo').text
+    
+    print(f"  - Categoría {id_categoria}: {nombre}")
+    
+    objetos = [(Categoria(id_categoria, nombre, descripcion, carga_trabajo), 'categorias_creadas')]
+    
+    lista_configuraciones = categoria_elem.find('listaConfiguraciones')
+    if lista_configuraciones is not None:
+        for config_elem in lista_configuraciones:
+            id_config = int(config_elem.get('id'))
+            nombre_conf = config_elem.find('nombre').text
+            desc_conf_elem = config_elem.find('descripcion')
+            desc_conf = desc_conf_elem.text if desc_conf_elem is not None else ""
+            
+            print(f"    - Configuración {id_config}: {nombre_conf}")
+            
+            objetos.append((Configuracion(id_config, nombre_conf, desc_conf, id_categoria), 'configuraciones_creadas'))
+            
+            recursos_config = config_elem.find('recursosConfiguracion')
+            if recursos_config is not None:
+                for recurso_conf in recursos_config:
+                    id_recurso_conf = int(recurso_conf.get('id'))
+                    cantidad = float(recurso_conf.text)
+                    print(f"      - Recurso config {id_recurso_conf}: {cantidad}")
+                    
+                    objetos.append((RecursoConfiguracion(id_config, id_recurso_conf, cantidad), None))
+    return objetos
+
+def _leer_cliente(cliente_elem):
+    nit = cliente_elem.get('nit')
+    nombre = cliente_elem.find('nombre').text
+    usuario = cliente_elem.find('usuario').text
+    clave = cliente_elem.find('clave').text
+    direccion = cliente_elem.find('direccion').text
+    correo = cliente_elem.find('correoElectronico').text
+    
+    print(f"  - Cliente {nit}: {nombre}")
+    
+    objetos = [(Cliente(nit, nombre, usuario, clave, direccion, correo), 'clientes_creados')]
+    
+    lista_instancias = cliente_elem.find('listaInstancias')
+    if lista_instancias is not None:
+        for instancia_elem in lista_instancias:
+            id_inst = int(instancia_elem.get('id'))
+            id_config = int(instancia_elem.find('idConfiguracion').text)
+            nombre_inst = instancia_elem.find('nombre').text
+            fecha_inicio = extraer_fecha(instancia_elem.find('fechaInicio').text)
+            estado = instancia_elem.find('estado').text
+            fecha_final = None
+            if estado == 'Cancelada':
+                fecha_final_elem = instancia_elem.find('fechaFinal')
+                if fecha_final_elem is not None and fecha_final_elem.text:
+                    fecha_final = extraer_fecha(fecha_final_elem.text)
+            
+            print(f"    - Instancia {id_inst}: {nombre_inst} para cliente {nit}")
+            
+            objetos.append((Instancia(id_inst, nit, id_config, nombre_inst, fecha_inicio, estado, fecha_final), 'instancias_creadas'))
+    return objetos
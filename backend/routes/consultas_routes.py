@@ -1,23 +1,16 @@
-from flask import jsonify
-from models import Recurso, Categoria, Configuracion, Cliente, Instancia, Consumo, Factura, RecursoConfiguracion
-import xml.etree.ElementTree as ET
-import os
+from flask import request, jsonify
+from models import ModeloBase, Recurso, Categoria, Configuracion, Cliente, Instancia, Consumo, Factura, RecursoConfiguracion
+from utils import extraer_fecha, parsear_fecha
+from analisis import analizar_ventas
 from datetime import datetime
 
+# Tamaño máximo de una página de /facturas
+MAXIMO_LIMITE_FACTURAS = 1000
+
 def reset_datos():
     try:
-        root = ET.Element('database')
-        ET.SubElement(root, 'recursos')
-        ET.SubElement(root, 'categorias')
-        ET.SubElement(root, 'configuraciones')
-        ET.SubElement(root, 'clientes')
-        ET.SubElement(root, 'instancias')
-        ET.SubElement(root, 'consumos')
-        ET.SubElement(root, 'facturas')
-        
-        tree = ET.ElementTree(root)
-        os.makedirs('data', exist_ok=True)
-        tree.write('data/database.xml', encoding='utf-8', xml_declaration=True)
+        # Reiniciar a través del modelo para que la caché y la bitácora queden al día
+        ModeloBase.reiniciar()
         
         return jsonify({
             'success': True,
@@ -45,31 +38,105 @@ def consultar_datos():
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
 def obtener_facturas():
+    """
+    Facturas de la más reciente a la más antigua. Parámetros opcionales: limit y cursor
+    (paginación), nit, desde, hasta (fechaEmision), montoMin, montoMax y vista=resumen
+    (sin detalles). Sin limit se devuelven todas.
+    """
     try:
-        facturas = [f.to_dict() for f in Factura.obtener_todas()]
-        return jsonify({'success': True, 'facturas': facturas})
+        try:
+            limite = _entero_parametro('limit')
+            if limite is not None and not 1 <= limite <= MAXIMO_LIMITE_FACTURAS:
+                raise ValueError(f'limit debe estar entre 1 y {MAXIMO_LIMITE_FACTURAS}')
+            filtros = {
+                'nit_cliente': request.args.get('nit') or None,
+                'desde': _fecha_parametro('desde'),
+                'hasta': _fecha_parametro('hasta'),
+                'monto_minimo': _decimal_parametro('montoMin'),
+                'monto_maximo': _decimal_parametro('montoMax')
+            }
+            cursor = _entero_parametro('cursor')
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        facturas, siguiente = Factura.listar(limite, cursor, detalles=request.args.get('vista') != 'resumen',
+                                             **filtros)
+        return jsonify({
+            'success': True,
+            'facturas': [f.to_dict() for f in facturas],
+            'siguiente': siguiente
+        })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+def analisis_ventas():
+    """Ingresos por categoría, configuración y recurso de las facturas emitidas entre desde y hasta"""
+    try:
+        try:
+            fecha_inicio = _fecha_parametro('desde')
+            fecha_fin = _fecha_parametro('hasta')
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        if fecha_inicio is None or fecha_fin is None:
+            return jsonify({'success': False, 'message': 'Se requieren los parámetros desde y hasta'}), 400
+        
+        analisis = analizar_ventas(fecha_inicio, fecha_fin)
+        if analisis['total_facturas'] == 0:
+            # Para orientar al usuario: fechas en las que sí hay facturas
+            facturas, _ = Factura.listar(detalles=False)
+            fechas = sorted({f.fecha_emision for f in facturas})
+            analisis['fechas_disponibles'] = [fecha.strftime('%d/%m/%Y') for fecha in fechas]
+        return jsonify({'success': True, 'analisis': analisis})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+def _entero_parametro(nombre):
+    valor = request.args.get(nombre)
+    if not valor:
+        return None
+    try:
+        return int(valor)
+    except ValueError:
+        raise ValueError(f'{nombre} debe ser un número entero: {valor}')
+
+def _decimal_parametro(nombre):
+    valor = request.args.get(nombre)
+    if not valor:
+        return None
+    try:
+        return float(valor)
+    except ValueError:
+        raise ValueError(f'{nombre} debe ser un número: {valor}')
+
+def _fecha_parametro(nombre):
+    """Acepta dd/mm/yyyy (como el resto de la API) o yyyy-mm-dd (como los formularios HTML)"""
+    valor = request.args.get(nombre)
+    if not valor:
+        return None
+    fecha = extraer_fecha(valor)
+    if fecha is None:
+        try:
+            fecha = parsear_fecha(valor, '%Y-%m-%d')
+        except ValueError:
+            raise ValueError(f'{nombre} no es una fecha válida: {valor}')
+    return fecha
+
 def obtener_factura(id_factura):
     try:
         print(f"🔍 Buscando factura ID: {id_factura}")
         
-        # Método simple y confiable: usar obtener_todas
-        facturas_todas = Factura.obtener_todas()
-        print(f"📄 Total de facturas disponibles: {len(facturas_todas)}")
-        
-        for factura in facturas_todas:
-            if factura.id == id_factura:
-                print(f"✅ Factura encontrada: {factura.id}")
-                return jsonify({
-                    'success': True, 
-                    'factura': factura.to_dict()
-                })
+        # Búsqueda por id: no se leen las demás facturas
+        factura = Factura.obtener_por_id(id_factura)
+        if factura is not None:
+            print(f"✅ Factura encontrada: {factura.id}")
+            return jsonify({
+                'success': True, 
+                'factura': factura.to_dict()
+            })
         
         print(f"❌ Factura {id_factura} no encontrada")
         return jsonify({'success': False, 'message': 'Factura no encontrada'}), 404
-        
+    
     except Exception as e:
         import traceback
         print(f"❌ ERROR en obtener_factura: {str(e)}")
@@ -1,65 +1,241 @@
 from flask import request, jsonify
+import csv
+import json
 import xml.etree.ElementTree as ET
+from functools import partial
 from models import Consumo
-from utils import extraer_fecha_hora, limpiar_xml
+from utils import convertir_fecha_hora, FlujoXML, descomprimir_flujo, leer_lineas
+import trabajos
+from idempotencia import idempotente, al_terminar, fragmento_actual
+
+# Consumos que se acumulan antes de escribirlos a disco de una sola vez
+TAMANO_LOTE = 10000
+# Cuántos rechazos se detallan en la respuesta (el resto solo se cuenta)
+MAXIMO_ERRORES_REPORTADOS = 100
+
+# Además de XML se aceptan formatos de una línea por consumo, según el Content-Type
+FORMATOS_POR_TIPO = {
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv'
+}
+# Orden de las columnas de un CSV que no trae fila de encabezados
+COLUMNAS_CSV = ['idInstancia', 'nitCliente', 'tiempo', 'fechaHora']
+
+@idempotente
 def consumo():
+    resultados = {'aceptados': 0, 'rechazados': 0, 'duplicados': 0, 'errores': []}
     try:
         print("=== INICIANDO PROCESAMIENTO CONSUMO ===")
         
-        xml_data = request.get_data()
-        xml_str = limpiar_xml(xml_data)
+        # Se lee el cuerpo por partes (descomprimiéndolo si viene con Content-Encoding):
+        # nunca se guarda el mensaje completo en memoria
+        try:
+            flujo = descomprimir_flujo(request.stream, request.headers.get('Content-Encoding'))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 415
+        flujo = FlujoXML(flujo)
         
-        if not xml_str:
+        if flujo.vacio:
             return jsonify({
                 'success': False,
                 'message': 'El archivo XML está vacío'
             }), 400
         
-        root = ET.fromstring(xml_str)
-        print(f"Elemento raíz encontrado: {root.tag}")
+        formato = FORMATOS_POR_TIPO.get(request.mimetype, 'xml')
         
-        consumos_procesados = 0
+        # Con ?asincrono=1 el mensaje se guarda en la cola y se responde de inmediato (GET /jobs/<id>)
+        if request.args.get('asincrono') == '1':
+            funcion = al_terminar(partial(procesar_consumos, formato=formato))
+            id_trabajo = trabajos.encolar_archivo('consumo', flujo, funcion, cola='ingesta',
+                                                  datos={'formato': formato, 'fragmento': fragmento_actual()})
+            print(f"📨 Mensaje de consumo encolado como trabajo {id_trabajo}")
+            return jsonify({
+                'success': True,
+                'message': 'Mensaje de consumo recibido, en proceso',
+                'trabajo': id_trabajo
+            }), 202
         
-        for consumo_elem in root.findall('consumo'):
-            nit_cliente = consumo_elem.get('nitCliente')
-            id_instancia = int(consumo_elem.get('idInstancia'))
-            tiempo = float(consumo_elem.find('tiempo').text)
-            
-            # ✅ BUSCAR TODAS LAS POSIBLES VARIANTES
-            fecha_hora_elem = None
-            for tag_name in ['fechahora', 'fechaHora', 'fecha_hora']:
-                fecha_hora_elem = consumo_elem.find(tag_name)
-                if fecha_hora_elem is not None:
-                    break
-            
-            if fecha_hora_elem is not None and fecha_hora_elem.text:
-                fecha_hora_str = fecha_hora_elem.text
-                fecha_hora = extraer_fecha_hora(fecha_hora_str)
-                
-                if fecha_hora:
-                    print(f"✅ Procesando consumo: Instancia {id_instancia}, Tiempo {tiempo}h, Fecha {fecha_hora}")
-                    
-                    nuevo_consumo = Consumo(id_instancia, nit_cliente, tiempo, fecha_hora)
-                    if nuevo_consumo.guardar():
-                        consumos_procesados += 1
-                else:
-                    print(f"❌ Fecha inválida o no extraíble: {fecha_hora_str}")
-            else:
-                print("❌ No se encontró elemento de fecha/hora")
+        procesar_consumos(flujo, resultados, formato=formato)
         
-        print(f"📊 Consumos procesados: {consumos_procesados}")
+        print(f"📊 Consumos procesados: {resultados['aceptados']} (rechazados: {resultados['rechazados']})")
         
         return jsonify({
             'success': True,
             'message': 'Mensaje de consumo procesado exitosamente',
-            'consumos_procesados': consumos_procesados
+            'consumos_procesados': resultados['aceptados'],
+            'aceptados': resultados['aceptados'],
+            'rechazados': resultados['rechazados'],
+            'duplicados': resultados['duplicados'],
+            'errores': resultados['errores']
         })
-        
+    
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
         print(f"ERROR DETALLADO: {error_details}")
+        # Los lotes anteriores al error ya quedaron guardados
         return jsonify({
             'success': False,
-            'message': f'Error: {str(e)}'
-        }), 400
\ No newline at end of file
+            'message': f'Error: {str(e)}',
+            'consumos_procesados': resultados['aceptados'],
+            'aceptados': resultados['aceptados'],
+            'rechazados': resultados['rechazados'],
+            'duplicados': resultados['duplicados'],
+            'errores': resultados['errores']
+        }), 400
+
+def _reanudar(datos):
+    """Función de un trabajo de consumo que quedó en la cola al detenerse el servidor"""
+    return al_terminar(partial(procesar_consumos, formato=datos['formato']), fragmento=datos.get('fragmento'))
+
+trabajos.registrar_reanudador('consumo', _reanudar)
+
+def procesar_consumos(flujo, resultados=None, avance=None, formato='xml'):
+    """
+    Lee los consumos del flujo (XML, NDJSON o CSV) a medida que llegan y los guarda por
+    lotes de TAMANO_LOTE
+    """
+    if resultados is None:
+        resultados = {'aceptados': 0, 'rechazados': 0, 'duplicados': 0, 'errores': []}
+    avance = avance or (lambda **valores: None)
+    lector = {'xml': _leer_xml, 'ndjson': _leer_ndjson, 'csv': _leer_csv}[formato]
+    lote = []
+    for numero, (consumo, motivo) in enumerate(lector(FlujoXML(flujo)), 1):
+        if consumo is None:
+            _rechazar(resultados, numero, motivo)
+            continue
+        lote.append(consumo)
+        if len(lote) >= TAMANO_LOTE:
+            _guardar_lote(lote, resultados, avance)
+            lote = []
+    
+    if lote:
+        _guardar_lote(lote, resultados, avance)
+    avance(aceptados=resultados['aceptados'], rechazados=resultados['rechazados'],
+           duplicados=resultados['duplicados'], errores=list(resultados['errores']))
+    
+    resultados['consumos_procesados'] = resultados['aceptados']
+    return resultados
+
+def _leer_xml(flujo):
+    """Genera (consumo, motivo de rechazo) por cada <consumo> hijo de la raíz"""
+    pila = []
+    for evento, elem in ET.iterparse(flujo, events=('start', 'end')):
+        if evento == 'start':
+            if not pila:
+                print(f"Elemento raíz encontrado: {elem.tag}")
+            pila.append(elem)
+            continue
+        
+        pila.pop()
+        if len(pila) != 1:
+            continue
+        
+        # Cada <consumo> se valida al cerrarse y luego se descarta
+        if elem.tag == 'consumo':
+            yield _validar(_convertir_consumo, elem)
+        pila[0].remove(elem)
+        elem.clear()
+
+def _leer_ndjson(flujo):
+    """Genera (consumo, motivo de rechazo) por cada línea JSON no vacía"""
+    for linea in leer_lineas(flujo):
+        if linea.strip():
+            yield _validar(_convertir_linea_json, linea)
+
+def _leer_csv(flujo):
+    """
+    Genera (consumo, motivo de rechazo) por cada fila del CSV. Si la primera fila nombra
+    las columnas se usa como encabezado; si no, se asume el orden de COLUMNAS_CSV.
+    """
+    filas = csv.reader(linea.decode('utf-8', errors='replace') for linea in leer_lineas(flujo))
+    columnas = None
+    for fila in filas:
+        if not any(valor.strip() for valor in fila):
+            continue
+        if columnas is None:
+            nombres = [valor.strip() for valor in fila]
+            if 'nitCliente' in nombres and 'idInstancia' in nombres:
+                columnas = nombres
+                continue
+            columnas = COLUMNAS_CSV
+        yield _validar(_convertir_campos, dict(zip(columnas, fila)))
+
+def _validar(conversion, dato):
+    try:
+        return conversion(dato), None
+    except ValueError as e:
+        return None, str(e)
+
+def _convertir_consumo(consumo_elem):
+    """Valida un <consumo> y lo convierte en Consumo; lanza ValueError si no es válido"""
+    tiempo_elem = consumo_elem.find('tiempo')
+    campos = {
+        'nitCliente': consumo_elem.get('nitCliente'),
+        'idInstancia': consumo_elem.get('idInstancia'),
+        'tiempo': tiempo_elem.text if tiempo_elem is not None else None
+    }
+    # ✅ BUSCAR TODAS LAS POSIBLES VARIANTES
+    for tag_name in ['fechahora', 'fechaHora', 'fecha_hora']:
+        fecha_hora_elem = consumo_elem.find(tag_name)
+        if fecha_hora_elem is not None:
+            campos[tag_name] = fecha_hora_elem.text
+            break
+    return _convertir_campos(campos)
+
+def _convertir_linea_json(linea):
+    campos = json.loads(linea)
+    if not isinstance(campos, dict):
+        raise ValueError('La línea no es un objeto JSON')
+    return _convertir_campos(campos)
+
+def _convertir_campos(campos):
+    """Valida los campos de un consumo (de cualquier formato) y los convierte en Consumo"""
+    nit_cliente = campos.get('nitCliente')
+    if nit_cliente is None or not str(nit_cliente).strip():
+        raise ValueError('Falta el atributo nitCliente')
+    try:
+        id_instancia = int(campos.get('idInstancia'))
+    except (TypeError, ValueError):
+        raise ValueError(f"idInstancia inválido: {campos.get('idInstancia')}")
+    
+    try:
+        tiempo = float(campos.get('tiempo'))
+    except (TypeError, ValueError):
+        raise ValueError('Tiempo inválido o ausente')
+    
+    fecha_hora_texto = None
+    for campo in ['fechahora', 'fechaHora', 'fecha_hora']:
+        if campos.get(campo) is not None:
+            fecha_hora_texto = str(campos[campo])
+            break
+    
+    if not fecha_hora_texto:
+        raise ValueError('No se encontró elemento de fecha/hora')
+    
+    fecha_hora = convertir_fecha_hora(fecha_hora_texto)
+    if not fecha_hora:
+        raise ValueError(f'Fecha inválida o no extraíble: {fecha_hora_texto}')
+    
+    return Consumo(id_instancia, str(nit_cliente).strip(), tiempo, fecha_hora)
+
+def _rechazar(resultados, numero, motivo):
+    resultados['rechazados'] += 1
+    if len(resultados['errores']) < MAXIMO_ERRORES_REPORTADOS:
+        print(f"❌ Consumo {numero} rechazado: {motivo}")
+        resultados['errores'].append({'consumo': numero, 'error': motivo})
+
+def _guardar_lote(lote, resultados, avance):
+    # Una sola escritura durable por lote; los consumos ya registrados se descartan
+    nuevos = Consumo.guardar_lote(lote)
+    duplicados = len(lote) - nuevos
+    resultados['aceptados'] += nuevos
+    resultados['rechazados'] += duplicados
+    resultados['duplicados'] += duplicados
+    print(f"📦 Lote de {nuevos} consumos guardado ({duplicados} duplicados descartados)")
+    avance(aceptados=resultados['aceptados'], rechazados=resultados['rechazados'],
+           duplicados=resultados['duplicados'], errores=list(resultados['errores']))
@@ -0,0 +1,25 @@
+from flask import request, jsonify
+from models import Ingesta
+from idempotencia import vigentes_desde
+
+def obtener_ingesta(idempotencia):
+    """
+    Fragmentos ya aplicados de un envío, para retomarlo después de un fallo.
+    ?endpoint=consumo (por defecto) o configurar indica a qué endpoint se hizo el envío.
+    """
+    endpoint = '/' + request.args.get('endpoint', 'consumo').strip('/')
+    secuencias = [ingesta.secuencia
+                  for ingesta in Ingesta.obtener_por_idempotencia(endpoint, idempotencia, vigente_desde=vigentes_desde())]
+    # Primer fragmento que falta: desde ahí debe continuar el cliente
+    siguiente = 0
+    for secuencia in secuencias:
+        if secuencia != siguiente:
+            break
+        siguiente += 1
+    return jsonify({
+        'success': True,
+        'idempotencia': idempotencia,
+        'endpoint': endpoint,
+        'secuencias': secuencias,
+        'siguiente': siguiente
+    })
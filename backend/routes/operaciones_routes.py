@@ -1,5 +1,5 @@
 from flask import request, jsonify
-from models import Recurso, Categoria, Configuracion, Cliente, Instancia, RecursoConfiguracion
+from models import Recurso, Categoria, Configuracion, Cliente, Instancia, RecursoConfiguracion, Consumo
 from utils import extraer_fecha  #
 
 def crear_recurso():
@@ -262,25 +262,11 @@ def agregar_recurso_configuracion():
 
 def limpiar_consumos_duplicados():
     try:
-        root = Recurso._obtener_root()
-        consumos = root.find('consumos')
-        
-        consumos_unicos = {}
-        for consumo in consumos.findall('consumo'):
-            key = f"{consumo.get('idInstancia')}_{consumo.get('nitCliente')}_{consumo.find('fechaHora').text}"
-            if key not in consumos_unicos:
-                consumos_unicos[key] = consumo
-        
-        consumos.clear()
-        
-        for consumo in consumos_unicos.values():
-            consumos.append(consumo)
-        
-        Recurso._guardar_xml(root)
+        total_unicos = Consumo.eliminar_duplicados()
         
         return jsonify({
             'success': True,
-            'message': f'Consumos duplicados eliminados. Quedaron {len(consumos_unicos)} consumos únicos.'
+            'message': f'Consumos duplicados eliminados. Quedaron {total_unicos} consumos únicos.'
         })
         
     except Exception as e:
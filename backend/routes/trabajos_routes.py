@@ -0,0 +1,8 @@
+from flask import jsonify
+import trabajos
+
+def obtener_trabajo(id_trabajo):
+    trabajo = trabajos.obtener(id_trabajo)
+    if trabajo is None:
+        return jsonify({'success': False, 'message': 'Trabajo no encontrado'}), 404
+    return jsonify({'success': True, 'trabajo': trabajo})
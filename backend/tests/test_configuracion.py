@@ -0,0 +1,93 @@
+"""
+Un mensaje de configuración se aplica elemento por elemento: un recurso, categoría o cliente
+con algún dato inválido (también en lo que trae anidado) se rechaza entero, sin guardar ni
+contar nada de él, y el resto del mensaje se aplica.
+"""
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from almacenamiento import MotorXML, MotorSQLite
+from models import ModeloBase, Cliente, Instancia, Categoria, Configuracion
+from routes.configuracion_routes import procesar_configuracion
+
+MENSAJE = b'''<archivoConfiguraciones>
+<listaCategorias>
+  <categoria id="1">
+    <nombre>Web</nombre><descripcion>d</descripcion><cargaTrabajo>baja</cargaTrabajo>
+    <listaConfiguraciones>
+      <configuracion id="10"><nombre>ok</nombre><descripcion>d</descripcion>
+        <recursosConfiguracion><recurso id="1">2</recurso></recursosConfiguracion></configuracion>
+      <configuracion id="11"><nombre>mala</nombre><descripcion>d</descripcion>
+        <recursosConfiguracion><recurso id="1">dos</recurso></recursosConfiguracion></configuracion>
+    </listaConfiguraciones>
+  </categoria>
+  <categoria id="2">
+    <nombre>Datos</nombre><descripcion>d</descripcion><cargaTrabajo>alta</cargaTrabajo>
+  </categoria>
+</listaCategorias>
+<listaClientes>
+  <cliente nit="111-1">
+    <nombre>Ana</nombre><usuario>ana</usuario><clave>x</clave><direccion>z1</direccion>
+    <correoElectronico>ana@correo.com</correoElectronico>
+    <listaInstancias>
+      <instancia id="7"><idConfiguracion>10</idConfiguracion><nombre>web</nombre>
+        <fechaInicio>01/01/2025</fechaInicio><estado>Vigente</estado></instancia>
+      <instancia id="8"><idConfiguracion>abc</idConfiguracion><nombre>mala</nombre>
+        <fechaInicio>01/01/2025</fechaInicio><estado>Vigente</estado></instancia>
+    </listaInstancias>
+  </cliente>
+  <cliente nit="222-2">
+    <nombre>Luis</nombre><usuario>luis</usuario><clave>y</clave><direccion>z2</direccion>
+    <correoElectronico>luis@correo.com</correoElectronico>
+    <listaInstancias>
+      <instancia id="9"><idConfiguracion>10</idConfiguracion><nombre>api</nombre>
+        <fechaInicio>01/02/2025</fechaInicio><estado>Vigente</estado></instancia>
+    </listaInstancias>
+  </cliente>
+</listaClientes>
+</archivoConfiguraciones>'''
+
+
+class PruebaConfiguracion(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.motor_original = ModeloBase.motor
+
+    def tearDown(self):
+        ModeloBase.motor = self.motor_original
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def verificar(self, motor):
+        ModeloBase.motor = motor
+        resultados = procesar_configuracion(io.BytesIO(MENSAJE))
+
+        self.assertEqual(resultados['rechazados'], 2)
+        self.assertEqual(sorted((e['elemento'], e['id']) for e in resultados['errores']),
+                         [('categoria', '1'), ('cliente', '111-1')])
+        self.assertEqual(resultados['categorias_creadas'], 1)
+        self.assertEqual(resultados['configuraciones_creadas'], 0)
+        self.assertEqual(resultados['clientes_creados'], 1)
+        self.assertEqual(resultados['instancias_creadas'], 1)
+
+        # Nada de los elementos rechazados quedó guardado
+        self.assertEqual([c.id for c in Categoria.obtener_todas()], [2])
+        self.assertEqual(Configuracion.obtener_todas(), [])
+        self.assertEqual([c.nit for c in Cliente.obtener_todos()], ['222-2'])
+        self.assertEqual([i.id for i in Instancia.obtener_todas()], [9])
+
+    def test_rechazo_completo_xml(self):
+        self.verificar(MotorXML(self.directorio, por_mes=False))
+
+    def test_rechazo_completo_sqlite(self):
+        self.verificar(MotorSQLite(os.path.join(self.directorio, 'database.sqlite3')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""
+Los dos motores de almacenamiento deben comportarse igual: cada prueba hace las mismas
+operaciones sobre MotorXML y MotorSQLite (en directorios temporales) y compara los resultados.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import almacenamiento
+from almacenamiento import MotorXML, MotorSQLite
+
+
+def _consumo(id_instancia, nit, tiempo, fecha_hora):
+    return {'idInstancia': id_instancia, 'nitCliente': nit, 'tiempo': tiempo, 'fechaHora': fecha_hora}
+
+
+def _factura(id_factura, nit, fecha, monto, id_instancia=1):
+    return {
+        'id': id_factura, 'nitCliente': nit, 'fechaEmision': fecha, 'montoTotal': monto,
+        'detalles': [{
+            'id_instancia': id_instancia, 'nombre_instancia': 'web', 'id_recurso': 1,
+            'nombre_recurso': 'CPU', 'cantidad': 2.0, 'tiempo_consumido': 1.5,
+            'costo_unitario': 10.0, 'costo_total': monto
+        }]
+    }
+
+
+def _ordenados(registros):
+    return sorted(registros, key=repr)
+
+
+class PruebaMotores(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directorio, 'xml'))
+        self.motores = {
+            'xml': MotorXML(os.path.join(self.directorio, 'xml'), por_mes=False),
+            'sqlite': MotorSQLite(os.path.join(self.directorio, 'sqlite', 'database.sqlite3')),
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def resultados(self, operacion):
+        """Aplica operacion(motor) a ambos motores y verifica que devuelvan lo mismo"""
+        xml, sqlite = (operacion(self.motores[nombre]) for nombre in ('xml', 'sqlite'))
+        self.assertEqual(xml, sqlite)
+        return xml
+
+    def test_guardar_y_obtener(self):
+        recurso = {'id': 1, 'nombre': 'CPU', 'abreviatura': 'cpu', 'metrica': 'nucleos',
+                   'tipo': 'Hardware', 'valorXhora': 10.5}
+        cliente = {'nit': '1234-5', 'nombre': 'Ana', 'usuario': 'ana', 'clave': 'x',
+                   'direccion': 'zona 1', 'correoElectronico': 'ana@correo.com'}
+        for motor in self.motores.values():
+            motor.guardar('recursos', recurso)
+            motor.guardar('clientes', cliente)
+            motor.guardar('configuraciones', {'id': 3, 'nombre': 'web', 'descripcion': 'd', 'idCategoria': 1})
+            motor.guardar_recurso_configuracion(3, 1, 2.0)
+            motor.guardar('recursos', dict(recurso, valorXhora=12.0))
+
+        self.assertEqual(self.resultados(lambda m: m.obtener('recursos', 1))['valorXhora'], 12.0)
+        self.resultados(lambda m: m.obtener('clientes', '1234-5'))
+        self.assertIsNone(self.resultados(lambda m: m.obtener('recursos', 99)))
+        self.assertEqual(len(self.resultados(lambda m: m.obtener_todos('recursos'))), 1)
+        self.assertEqual(self.resultados(lambda m: m.obtener_recursos_configuracion(3)), [(1, 2.0)])
+
+    def test_consumos_por_rango(self):
+        consumos = [
+            _consumo(1, 'A', 1.0, datetime(2025, 1, 5, 10, 0)),
+            _consumo(1, 'A', 2.0, datetime(2025, 1, 5, 10, 0)),
+            _consumo(2, 'B', 0.5, datetime(2025, 2, 1, 8, 30)),
+            _consumo(1, 'A', 3.0, datetime(2025, 3, 1, 0, 0)),
+        ]
+        # Un consumo repetido (misma instancia, cliente, tiempo y fecha) se descarta
+        self.assertEqual(self.resultados(lambda m: m.agregar_consumos(consumos + consumos[:1])), 4)
+        self.assertEqual(self.resultados(lambda m: m.agregar_consumos(consumos[:2])), 0)
+
+        inicio, fin = datetime(2025, 1, 1), datetime(2025, 2, 1, 8, 30)
+        self.assertEqual(len(self.resultados(lambda m: _ordenados(m.obtener_consumos_por_rango(inicio, fin)))), 3)
+        self.assertEqual(len(self.resultados(lambda m: _ordenados(m.obtener_consumos_por_rango(inicio, fin, 1)))), 2)
+        self.resultados(lambda m: _ordenados(m.obtener_consumos(2)))
+
+        for motor in self.motores.values():
+            with motor.transaccion():
+                motor.agregar_facturas([_factura(7, 'A', datetime(2025, 1, 31), 10.0)])
+                motor.marcar_consumos_facturados([(consumos[0], 7)])
+        pendientes = self.resultados(lambda m: _ordenados(m.obtener_consumos_por_rango(inicio, fin, pendientes=True)))
+        self.assertEqual(len(pendientes), 2)
+
+        # En XML los consumos pasan de la bitácora a su archivo; en SQLite no cambia nada
+        for motor in self.motores.values():
+            motor.compactar_consumos()
+        self.assertEqual(len(self.resultados(lambda m: _ordenados(m.obtener_consumos()))), 4)
+        self.assertEqual(self.resultados(lambda m: m.eliminar_consumos_duplicados()), 4)
+
+    def test_facturas(self):
+        facturas = [
+            _factura(10, 'A', datetime(2025, 1, 31), 30.0),
+            _factura(11, 'B', datetime(2025, 2, 28), 5.0),
+            _factura(12, 'A', datetime(2025, 3, 31), 45.0),
+        ]
+        for motor in self.motores.values():
+            motor.agregar_facturas(facturas[:2])
+            motor.agregar_factura(facturas[2])
+
+        self.assertEqual(self.resultados(lambda m: m.contar_facturas()), 3)
+        self.assertEqual(self.resultados(lambda m: m.obtener_factura(12))['detalles'][0]['costo_total'], 45.0)
+        self.resultados(lambda m: _ordenados(m.obtener_facturas()))
+        ids = lambda registros: [registro['id'] for registro in registros]
+        self.assertEqual(self.resultados(lambda m: ids(m.listar_facturas(limite=2))), [12, 11])
+        self.assertEqual(self.resultados(lambda m: ids(m.listar_facturas(antes_de=12, nit_cliente='A'))), [10])
+        self.assertEqual(self.resultados(lambda m: ids(m.listar_facturas(desde=datetime(2025, 2, 1), monto_maximo=40))), [11])
+        self.resultados(lambda m: m.listar_facturas(detalles=False))
+
+    def test_rollback(self):
+        for motor in self.motores.values():
+            motor.guardar('categorias', {'id': 1, 'nombre': 'base', 'descripcion': 'd', 'cargaTrabajo': 'baja'})
+            with self.assertRaises(RuntimeError):
+                with motor.transaccion():
+                    motor.guardar('categorias', {'id': 2, 'nombre': 'otra', 'descripcion': 'd', 'cargaTrabajo': 'baja'})
+                    motor.agregar_consumos([_consumo(1, 'A', 1.0, datetime(2025, 1, 1))])
+                    motor.agregar_facturas([_factura(20, 'A', datetime(2025, 1, 31), 10.0)])
+                    raise RuntimeError('falla a mitad de la transacción')
+
+        self.assertEqual([c['id'] for c in self.resultados(lambda m: m.obtener_todos('categorias'))], [1])
+        self.assertEqual(self.resultados(lambda m: m.obtener_consumos()), [])
+        self.assertEqual(self.resultados(lambda m: m.contar_facturas()), 0)
+
+    def test_importacion_inicial(self):
+        xml = self.motores['xml']
+        xml.guardar('recursos', {'id': 1, 'nombre': 'CPU', 'abreviatura': 'cpu', 'metrica': 'nucleos',
+                                 'tipo': 'Hardware', 'valorXhora': 10.5})
+        xml.guardar('configuraciones', {'id': 3, 'nombre': 'web', 'descripcion': 'd', 'idCategoria': 1})
+        xml.guardar_recurso_configuracion(3, 1, 2.0)
+        consumos = [_consumo(1, 'A', 1.0, datetime(2025, 1, 5, 10, 0)), _consumo(1, 'A', 2.0, datetime(2025, 1, 6))]
+        with xml.transaccion():
+            xml.agregar_consumos(consumos)
+            xml.agregar_facturas([_factura(7, 'A', datetime(2025, 1, 31), 10.0)])
+            xml.marcar_consumos_facturados([(consumos[0], 7)])
+
+        # Una base nueva en el mismo directorio se llena con los datos XML una sola vez
+        ruta = os.path.join(self.directorio, 'xml', 'database.sqlite3')
+        self.motores['sqlite'] = MotorSQLite(ruta)
+        self.assertEqual(len(self.resultados(lambda m: m.obtener_todos('recursos'))), 1)
+        self.resultados(lambda m: m.obtener_recursos_configuracion(3))
+        self.resultados(lambda m: _ordenados(m.obtener_consumos()))
+        self.resultados(lambda m: m.obtener_facturas())
+
+        xml.agregar_consumos([_consumo(2, 'B', 1.0, datetime(2025, 2, 1))])
+        self.assertEqual(len(MotorSQLite(ruta).obtener_consumos()), 2)
+
+    def test_compactacion_por_contadores(self):
+        # La bitácora XML se compacta al alcanzar max(LIMITE_COMPACTACION, consumos ya compactados)
+        xml = self.motores['xml']
+        limite = almacenamiento.LIMITE_COMPACTACION
+        almacenamiento.LIMITE_COMPACTACION = 3
+        try:
+            tamanos = []
+            for minuto in range(12):
+                xml.agregar_consumos([_consumo(1, 'A', 1.0, datetime(2025, 1, 1, 0, minuto))])
+                tamanos.append(len(xml._consumos_journal()))
+        finally:
+            almacenamiento.LIMITE_COMPACTACION = limite
+        # 3 al llegar al límite, luego 3 más (igual a los 3 compactados) y luego 6
+        self.assertEqual(tamanos, [1, 2, 0, 1, 2, 0, 1, 2, 3, 4, 5, 0])
+        self.assertEqual(xml._contar_compactados(), 12)
+        self.assertEqual(len(xml.obtener_consumos()), 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
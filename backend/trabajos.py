@@ -0,0 +1,170 @@
+import json
+import os
+import shutil
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from almacenamiento import DATA_DIR
+
+# Cuántos trabajos terminados se conservan para consultar su resultado
+MAXIMO_TRABAJOS_TERMINADOS = 100
+
+# Carpeta donde esperan los mensajes recibidos hasta que un trabajo los procesa
+DIRECTORIO_COLA = os.path.join(DATA_DIR, 'cola')
+
+# Registro en memoria de los trabajos en segundo plano: id -> estado, avance y resultado
+_trabajos = {}
+_lock = threading.Lock()
+# Un hilo por cola: los trabajos de una misma cola se ejecutan de a uno y en el orden en que llegaron
+_colas = {}
+# tipo -> función que, con los datos guardados junto al archivo, vuelve a armar la función del trabajo
+_reanudadores = {}
+
+def enviar(tipo, funcion, *args, cola=None, id_trabajo=None):
+    """
+    Encola funcion(*args, avance=...) y devuelve el id del trabajo.
+    La función recibe un callback avance(**valores) para publicar su progreso.
+    Sin cola explícita cada tipo de trabajo usa su propia cola.
+    """
+    id_trabajo = id_trabajo or uuid.uuid4().hex
+    trabajo = {
+        'id': id_trabajo,
+        'tipo': tipo,
+        'estado': 'pendiente',
+        'progreso': {},
+        'resultado': None,
+        'error': None,
+        'creado': datetime.now().strftime('%d/%m/%Y %H:%M:%S'),
+        'finalizado': None
+    }
+    with _lock:
+        _trabajos[id_trabajo] = trabajo
+        cola = cola or tipo
+        if cola not in _colas:
+            _colas[cola] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'trabajos-{cola}')
+        executor = _colas[cola]
+    executor.submit(_ejecutar, trabajo, funcion, args)
+    return id_trabajo
+
+def registrar_reanudador(tipo, reanudador):
+    """
+    reanudador(datos) devuelve la función para un archivo de ese tipo que quedó en la cola al
+    detenerse el servidor; datos es lo que se pasó a encolar_archivo
+    """
+    _reanudadores[tipo] = reanudador
+
+def encolar_archivo(tipo, flujo, funcion, cola=None, datos=None):
+    """
+    Vuelca el flujo a un archivo en DIRECTORIO_COLA y encola funcion(archivo, avance=...).
+    Responde en cuanto el archivo está en disco; el archivo se borra al terminar el trabajo.
+    Junto al archivo se guarda <id>.json con el tipo, la cola y datos (serializables a JSON)
+    para reanudar el trabajo si el servidor se detiene antes de terminarlo.
+    """
+    os.makedirs(DIRECTORIO_COLA, exist_ok=True)
+    id_trabajo = uuid.uuid4().hex
+    ruta = os.path.join(DIRECTORIO_COLA, f'{id_trabajo}.xml')
+    try:
+        with open(ruta, 'wb') as destino:
+            shutil.copyfileobj(flujo, destino, 1024 * 1024)
+            destino.flush()
+            os.fsync(destino.fileno())
+    except BaseException:
+        # Cuerpo incompleto (conexión cortada, compresión inválida, ...): no queda nada en la cola
+        if os.path.exists(ruta):
+            os.remove(ruta)
+        raise
+    # La descripción se escribe al final: un .xml sin .json es un volcado que no terminó
+    _escribir_descripcion(id_trabajo, {'tipo': tipo, 'cola': cola, 'datos': datos or {}})
+    return enviar(tipo, _procesar_archivo, ruta, funcion, cola=cola, id_trabajo=id_trabajo)
+
+def _escribir_descripcion(id_trabajo, descripcion):
+    ruta = os.path.join(DIRECTORIO_COLA, f'{id_trabajo}.json')
+    with open(ruta + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(descripcion, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(ruta + '.tmp', ruta)
+
+def reanudar_pendientes():
+    """
+    Vuelve a encolar, con su mismo id, los archivos que quedaron en DIRECTORIO_COLA al detenerse
+    el servidor, en el orden en que llegaron, y borra los volcados incompletos. Devuelve
+    cuántos trabajos se reanudaron.
+    """
+    if not os.path.isdir(DIRECTORIO_COLA):
+        return 0
+    rutas = [os.path.join(DIRECTORIO_COLA, nombre) for nombre in os.listdir(DIRECTORIO_COLA)]
+    reanudados = 0
+    for ruta in sorted(rutas, key=os.path.getmtime):
+        id_trabajo, extension = os.path.splitext(os.path.basename(ruta))
+        if extension != '.xml':
+            continue
+        ruta_descripcion = os.path.join(DIRECTORIO_COLA, f'{id_trabajo}.json')
+        if not os.path.exists(ruta_descripcion):
+            print(f"🗑️ Descartando volcado incompleto {ruta}")
+            os.remove(ruta)
+            continue
+        with open(ruta_descripcion, encoding='utf-8') as f:
+            descripcion = json.load(f)
+        reanudador = _reanudadores.get(descripcion['tipo'])
+        if reanudador is None:
+            print(f"⚠️ No se puede reanudar {ruta}: tipo de trabajo desconocido {descripcion['tipo']}")
+            continue
+        funcion = reanudador(descripcion['datos'])
+        enviar(descripcion['tipo'], _procesar_archivo, ruta, funcion, cola=descripcion['cola'], id_trabajo=id_trabajo)
+        print(f"🔁 Trabajo {id_trabajo} ({descripcion['tipo']}) reanudado desde la cola")
+        reanudados += 1
+    # Descripciones a medio escribir o sin su archivo (el trabajo terminó justo antes de borrarlas)
+    for ruta in rutas:
+        if ruta.endswith('.tmp') or (ruta.endswith('.json') and not os.path.exists(ruta[:-5] + '.xml')):
+            os.remove(ruta)
+    return reanudados
+
+def _procesar_archivo(ruta, funcion, avance):
+    try:
+        with open(ruta, 'rb') as archivo:
+            return funcion(archivo, avance=avance)
+    finally:
+        os.remove(ruta)
+        ruta_descripcion = os.path.splitext(ruta)[0] + '.json'
+        if os.path.exists(ruta_descripcion):
+            os.remove(ruta_descripcion)
+
+def obtener(id_trabajo):
+    """Copia del estado actual de un trabajo, o None si no existe"""
+    with _lock:
+        trabajo = _trabajos.get(id_trabajo)
+        if trabajo is None:
+            return None
+        return dict(trabajo, progreso=dict(trabajo['progreso']))
+
+def _ejecutar(trabajo, funcion, args):
+    def avance(**valores):
+        with _lock:
+            trabajo['progreso'].update(valores)
+    
+    with _lock:
+        trabajo['estado'] = 'en_proceso'
+    try:
+        resultado = funcion(*args, avance=avance)
+        with _lock:
+            trabajo['resultado'] = resultado
+            trabajo['estado'] = 'completado'
+    except Exception as e:
+        print(f"ERROR en trabajo {trabajo['id']} ({trabajo['tipo']}): {str(e)}")
+        print(traceback.format_exc())
+        with _lock:
+            trabajo['error'] = str(e)
+            trabajo['estado'] = 'error'
+    finally:
+        with _lock:
+            trabajo['finalizado'] = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+            _descartar_antiguos()
+
+def _descartar_antiguos():
+    terminados = [t['id'] for t in _trabajos.values() if t['estado'] in ('completado', 'error')]
+    # Los diccionarios conservan el orden de inserción: los primeros son los más antiguos
+    for id_trabajo in terminados[:-MAXIMO_TRABAJOS_TERMINADOS]:
+        del _trabajos[id_trabajo]
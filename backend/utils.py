@@ -1,5 +1,42 @@
+import gzip
 import re
 from datetime import datetime
+from functools import lru_cache
+
+try:
+    import zstandard
+except ImportError:  # zstandard es opcional: sin él solo se acepta gzip
+    zstandard = None
+
+# Patrones compilados una sola vez para todo el proceso
+PATRON_FECHA = re.compile(r'(\d{1,2}/\d{1,2}/\d{4})')
+PATRON_FECHA_HORA = re.compile(r'(\d{1,2}/\d{1,2}/\d{4}\s+\d{1,2}:\d{2})')
+
+# Cuántos textos de fecha distintos se recuerdan ya convertidos (los consumos repiten mucho las mismas fechas)
+TAMANO_CACHE_FECHAS = 65536
+
+@lru_cache(maxsize=TAMANO_CACHE_FECHAS)
+def parsear_fecha(texto, formato):
+    """
+    Equivale a datetime.strptime(texto, formato), pero los formatos fijos dd/mm/yyyy[ hh:mm]
+    y yyyy-mm-dd[ hh:mm] se arman cortando la cadena. Cualquier otro caso usa strptime.
+    """
+    try:
+        if formato == '%d/%m/%Y %H:%M':
+            if len(texto) == 16 and texto[2] == '/' and texto[5] == '/' and texto[10] == ' ' and texto[13] == ':':
+                return datetime(int(texto[6:10]), int(texto[3:5]), int(texto[0:2]), int(texto[11:13]), int(texto[14:16]))
+        elif formato == '%d/%m/%Y':
+            if len(texto) == 10 and texto[2] == '/' and texto[5] == '/':
+                return datetime(int(texto[6:10]), int(texto[3:5]), int(texto[0:2]))
+        elif formato == '%Y-%m-%d %H:%M':
+            if len(texto) == 16 and texto[4] == '-' and texto[7] == '-' and texto[10] == ' ' and texto[13] == ':':
+                return datetime(int(texto[0:4]), int(texto[5:7]), int(texto[8:10]), int(texto[11:13]), int(texto[14:16]))
+        elif formato == '%Y-%m-%d':
+            if len(texto) == 10 and texto[4] == '-' and texto[7] == '-':
+                return datetime(int(texto[0:4]), int(texto[5:7]), int(texto[8:10]))
+    except ValueError:
+        pass
+    return datetime.strptime(texto, formato)
 
 def extraer_fecha(texto):
     """
@@ -8,12 +45,9 @@ def extraer_fecha(texto):
     if not texto:
         return None
     
-    patron = r'(\d{1,2}/\d{1,2}/\d{4})'
-    coincidencias = re.findall(patron, texto)
-    
-    for fecha_str in coincidencias:
+    for fecha_str in PATRON_FECHA.findall(texto):
         try:
-            return datetime.strptime(fecha_str, '%d/%m/%Y')
+            return parsear_fecha(fecha_str, '%d/%m/%Y')
         except ValueError:
             continue
     
@@ -26,17 +60,27 @@ def extraer_fecha_hora(texto):
     if not texto:
         return None
     
-    patron = r'(\d{1,2}/\d{1,2}/\d{4}\s+\d{1,2}:\d{2})'
-    coincidencias = re.findall(patron, texto)
-    
-    for fecha_hora_str in coincidencias:
+    for fecha_hora_str in PATRON_FECHA_HORA.findall(texto):
         try:
-            return datetime.strptime(fecha_hora_str, '%d/%m/%Y %H:%M')
+            return parsear_fecha(fecha_hora_str, '%d/%m/%Y %H:%M')
         except ValueError:
             continue
     
     return None
 
+def convertir_fecha_hora(texto):
+    """
+    Versión rápida de extraer_fecha_hora para la ingesta masiva: si el texto es exactamente
+    dd/mm/yyyy hh:mm se convierte con parsear_fecha, sin regex.
+    Cualquier otro formato se delega a extraer_fecha_hora.
+    """
+    if texto and len(texto) == 16 and texto[2] == '/' and texto[5] == '/' and texto[10] == ' ' and texto[13] == ':':
+        try:
+            return parsear_fecha(texto, '%d/%m/%Y %H:%M')
+        except ValueError:
+            pass
+    return extraer_fecha_hora(texto)
+
 def validar_nit(nit):
     """
     Valida que un NIT tenga el formato correcto según el enunciado.
@@ -64,4 +108,72 @@ def limpiar_xml(xml_data):
     
     xml_str = xml_str.lstrip()
     
-    return xml_str
\ No newline at end of file
+    return xml_str
+
+def descomprimir_flujo(flujo, content_encoding):
+    """
+    Envuelve el flujo según el encabezado Content-Encoding (gzip, y zstd si está instalado)
+    para descomprimirlo por partes a medida que se lee. Lanza ValueError si no se soporta.
+    """
+    codificaciones = [c.strip().lower() for c in (content_encoding or '').split(',') if c.strip()]
+    # Las codificaciones se listan en el orden en que se aplicaron: se deshacen al revés
+    for codificacion in reversed(codificaciones):
+        if codificacion in ('gzip', 'x-gzip'):
+            flujo = gzip.GzipFile(fileobj=flujo, mode='rb')
+        elif codificacion == 'zstd' and zstandard is not None:
+            flujo = zstandard.ZstdDecompressor().stream_reader(flujo)
+        elif codificacion != 'identity':
+            raise ValueError(f'Content-Encoding no soportado: {codificacion}')
+    return flujo
+
+def leer_lineas(flujo, tamano_bloque=64 * 1024):
+    """Genera las líneas (bytes, con su salto de línea) de un flujo binario leyéndolo por bloques"""
+    resto = b''
+    while True:
+        bloque = flujo.read(tamano_bloque)
+        if not bloque:
+            break
+        lineas = (resto + bloque).split(b'\n')
+        resto = lineas.pop()
+        for linea in lineas:
+            yield linea + b'\n'
+    if resto:
+        yield resto
+
+class FlujoXML:
+    """
+    Envuelve un flujo binario (request.stream) saltando el BOM y los espacios iniciales,
+    igual que limpiar_xml, pero sin cargar el contenido completo en memoria.
+    """
+    def __init__(self, flujo, tamano_bloque=64 * 1024):
+        self.flujo = flujo
+        self.tamano_bloque = tamano_bloque
+        self._pendiente = self._saltar_inicio()
+    
+    def _saltar_inicio(self):
+        bloque = self.flujo.read(self.tamano_bloque)
+        if bloque.startswith(b'\xef\xbb\xbf'):
+            bloque = bloque[3:]
+        bloque = bloque.lstrip()
+        # Si el primer bloque era solo espacios seguir leyendo hasta encontrar contenido
+        while not bloque:
+            siguiente = self.flujo.read(self.tamano_bloque)
+            if not siguiente:
+                break
+            bloque = siguiente.lstrip()
+        return bloque
+    
+    @property
+    def vacio(self):
+        return not self._pendiente
+    
+    def read(self, n=-1):
+        if self._pendiente:
+            if n is None or n < 0:
+                datos = self._pendiente + self.flujo.read()
+                self._pendiente = b''
+                return datos
+            datos = self._pendiente[:n]
+            self._pendiente = self._pendiente[n:]
+            return datos
+        return self.flujo.read(n)
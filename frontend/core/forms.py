@@ -3,10 +3,10 @@ import xml.etree.ElementTree as ET
 from datetime import datetime
 
 class ConfiguracionForm(forms.Form):
-    xml_file = forms.FileField(label='Archivo XML de configuración', help_text='Seleccione un archivo XML con la configuración del sistema')
+    xml_file = forms.FileField(label='Archivo XML de configuración', help_text='Seleccione un archivo XML con la configuración del sistema (puede estar comprimido con gzip o zstd)')
 
 class ConsumoForm(forms.Form):
-    xml_file = forms.FileField(label='Archivo XML de consumo', help_text='Seleccione un archivo XML con los consumos de recursos')
+    xml_file = forms.FileField(label='Archivo XML de consumo', help_text='Seleccione un archivo XML con los consumos de recursos (puede estar comprimido con gzip o zstd)')
 
 class FechaRangoForm(forms.Form):
     fecha_inicio = forms.DateField(label='Fecha de inicio', widget=forms.DateInput(attrs={'type': 'date'}))
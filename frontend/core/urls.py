@@ -8,6 +8,7 @@ urlpatterns = [
     path('consumo/', views.enviar_mensaje_consumo, name='consumo'),
     path('operaciones/', views.operaciones_sistema, name='operaciones'),
     path('facturacion/', views.proceso_facturacion, name='facturacion'),
+    path('trabajos/<str:id_trabajo>/', views.estado_trabajo, name='estado_trabajo'),
     path('reportes/', views.reportes_pdf, name='reportes'),
     path('detalle-factura/', views.detalle_factura, name='detalle_factura'),
     path('analisis-ventas/', views.analisis_ventas, name='analisis_ventas'),
@@ -1,7 +1,6 @@
 from django.shortcuts import render, redirect
 from django.http import JsonResponse, HttpResponse
 import requests
-from datetime import datetime
 from .forms import (
     ConfiguracionForm, ConsumoForm, FechaRangoForm,
     CrearRecursoForm, CrearCategoriaForm, CrearConfiguracionForm,
@@ -12,26 +11,60 @@ import json
 # URL del backend Flask
 BACKEND_URL = 'http://localhost:5000'
 
+# Cuántas facturas se ofrecen por página en la lista de detalle de factura
+LIMITE_FACTURAS_LISTA = 100
+
 def index(request):
     return render(request, 'core/inicio.html')
 
+def archivo_vacio(archivo):
+    """True si el archivo subido solo tiene espacios; lo lee por partes y lo deja al inicio"""
+    vacio = True
+    for bloque in archivo.chunks():
+        if bloque.strip():
+            vacio = False
+            break
+    archivo.seek(0)
+    return vacio
+
+# Firmas de los formatos comprimidos que el backend acepta en /configurar y /consumo
+FIRMAS_COMPRESION = {b'\x1f\x8b': 'gzip', b'\x28\xb5\x2f\xfd': 'zstd'}
+
+def encabezados_xml(archivo):
+    """Encabezados para reenviar el archivo tal cual: si viene comprimido se indica con Content-Encoding"""
+    inicio = archivo.read(4)
+    archivo.seek(0)
+    encabezados = {'Content-Type': 'application/xml'}
+    for firma, codificacion in FIRMAS_COMPRESION.items():
+        if inicio.startswith(firma):
+            encabezados['Content-Encoding'] = codificacion
+    return encabezados
+
 def enviar_mensaje_configuracion(request):
     if request.method == 'POST':
         form = ConfiguracionForm(request.POST, request.FILES)
         if form.is_valid():
             xml_file = request.FILES['xml_file']
             try:
-                xml_content = xml_file.read()
-                if not xml_content.strip():
+                if archivo_vacio(xml_file):
                     context = {'form': form, 'error': 'El archivo XML está vacío.'}
                 else:
+                    # El archivo se envía por partes (comprimido si así se subió) y el backend lo procesa en segundo plano
                     response = requests.post(
                         'http://localhost:5000/configurar',
-                        data=xml_content,
-                        headers={'Content-Type': 'application/xml'}
+                        params={'asincrono': '1'},
+                        data=xml_file,
+                        headers=encabezados_xml(xml_file),
+                        timeout=60
                     )
                     result = response.json()
-                    if result.get('success'):
+                    if result.get('success') and result.get('trabajo'):
+                        context = {
+                            'form': form,
+                            'trabajo': result['trabajo'],
+                            'message': result.get('message', 'Mensaje recibido, en proceso')
+                        }
+                    elif result.get('success'):
                         context = {
                             'form': form,
                             'success': True,
@@ -57,17 +90,25 @@ def enviar_mensaje_consumo(request):
         if form.is_valid():
             xml_file = request.FILES['xml_file']
             try:
-                xml_content = xml_file.read()
-                if not xml_content.strip():
+                if archivo_vacio(xml_file):
                     context = {'form': form, 'error': 'El archivo XML está vacío.'}
                 else:
+                    # El archivo se envía por partes (comprimido si así se subió) y el backend lo procesa en segundo plano
                     response = requests.post(
                         'http://localhost:5000/consumo',
-                        data=xml_content,
-                        headers={'Content-Type': 'application/xml'}
+                        params={'asincrono': '1'},
+                        data=xml_file,
+                        headers=encabezados_xml(xml_file),
+                        timeout=60
                     )
                     result = response.json()
-                    if result.get('success'):
+                    if result.get('success') and result.get('trabajo'):
+                        context = {
+                            'form': form,
+                            'trabajo': result['trabajo'],
+                            'message': result.get('message', 'Mensaje recibido, en proceso')
+                        }
+                    elif result.get('success'):
                         context = {
                             'form': form,
                             'success': True,
@@ -330,14 +371,22 @@ def proceso_facturacion(request):
         if form.is_valid():
             data = {
                 'fechaInicio': form.cleaned_data['fechaInicio'],
-                'fechaFin': form.cleaned_data['fechaFin']
+                'fechaFin': form.cleaned_data['fechaFin'],
+                # El backend responde de inmediato con un trabajo; la página consulta su avance
+                'asincrono': True
             }
             
             try:
-                response = requests.post(f'{BACKEND_URL}/generarFactura', json=data)
+                response = requests.post(f'{BACKEND_URL}/generarFactura', json=data, timeout=30)
                 result = response.json()
                 
-                if result.get('success'):
+                if result.get('success') and result.get('trabajo'):
+                    context = {
+                        'form': form,
+                        'trabajo': result['trabajo'],
+                        'message': result.get('message', 'Facturación en proceso')
+                    }
+                elif result.get('success'):
                     context = {
                         'form': form,
                         'success': True,
@@ -362,19 +411,36 @@ def proceso_facturacion(request):
     
     return render(request, 'core/facturacion.html', context)
 
+def estado_trabajo(request, id_trabajo):
+    """Consulta al backend el avance de un trabajo en segundo plano (lo usa la página con polling)"""
+    try:
+        response = requests.get(f'{BACKEND_URL}/jobs/{id_trabajo}', timeout=10)
+        return JsonResponse(response.json(), status=response.status_code)
+    except Exception as e:
+        return JsonResponse({'success': False, 'message': f'Error al conectar con el backend: {str(e)}'}, status=502)
+
 def reportes_pdf(request):
     return render(request, 'core/reportes.html')
 
 def detalle_factura(request):
     print("🔍 Vista detalle_factura llamada")  # Debug
     
-    # Siempre obtener la lista de facturas
+    # Siempre obtener la lista de facturas (solo el resumen, sin detalles), una página a la vez:
+    # ?cursor=<id> lista las anteriores a esa factura
+    cursor = request.GET.get('cursor', '')
+    siguiente = None
+    params = {'vista': 'resumen', 'limit': LIMITE_FACTURAS_LISTA}
+    if cursor.isdigit():
+        params['cursor'] = cursor
+    else:
+        cursor = ''
     try:
-        response = requests.get(f'{BACKEND_URL}/facturas')
+        response = requests.get(f'{BACKEND_URL}/facturas', params=params)
         result = response.json()
         
         if result.get('success'):
             facturas = result['facturas']
+            siguiente = result.get('siguiente')
             print(f"📊 Facturas obtenidas del backend: {len(facturas)}")  # Debug
             for factura in facturas:
                 print(f"   - Factura {factura['id']}: {factura['nitCliente']} - Q{factura['montoTotal']}")
@@ -388,6 +454,8 @@ def detalle_factura(request):
     # Inicializar contexto
     context = {
         'facturas': facturas,
+        'cursor': cursor,
+        'siguiente': siguiente,
         'factura': None,
         'total_instancias': 0,
         'total_recursos': 0
@@ -424,12 +492,12 @@ def detalle_factura(request):
                     })
                     
                     print(f"📊 Métricas calculadas: {len(instancias_unicas)} instancias, {len(recursos_unicos)} recursos")
-                    
+                
                 else:
                     error_msg = result.get('message', 'Error al obtener factura')
                     print(f"❌ Error: {error_msg}")  # Debug
                     context['error'] = error_msg
-                    
+            
             except Exception as e:
                 error_msg = f'Error al conectar con el backend: {str(e)}'
                 print(f"❌ Error: {error_msg}")  # Debug
@@ -449,119 +517,23 @@ def analisis_ventas(request):
             print(f"📊 Análisis de ventas solicitado: {fecha_inicio} a {fecha_fin}")  # Debug
             
             try:
-                # Obtener todas las facturas
-                response = requests.get(f'{BACKEND_URL}/facturas')
-                result = response.json()
+                # El backend filtra las facturas por fecha y agrega los ingresos en una sola consulta
+                result = obtener_analisis_ventas(fecha_inicio, fecha_fin)
                 
                 if result.get('success'):
-                    facturas = result['facturas']
-                    facturas_rango = []
-                    
-                    print(f"📋 Total de facturas disponibles: {len(facturas)}")  # Debug
+                    analisis = result['analisis']
+                    print(f"📊 Facturas en rango: {analisis['total_facturas']}")  # Debug
                     
-                    for factura in facturas:
-                        fecha_emision_str = factura['fechaEmision']
-                        print(f"   - Factura {factura['id']}: Fecha emisión string = '{fecha_emision_str}'")  # Debug
-                        
-                        try:
-                            # Intentar parsear la fecha
-                            fecha_emision = datetime.strptime(fecha_emision_str, '%d/%m/%Y').date()
-                            print(f"     Fecha parseada: {fecha_emision}")  # Debug
-                            
-                            if fecha_inicio <= fecha_emision <= fecha_fin:
-                                facturas_rango.append(factura)
-                                print(f"     ✅ EN RANGO")  # Debug
-                            else:
-                                print(f"     ❌ FUERA DE RANGO (buscando {fecha_inicio} a {fecha_fin})")  # Debug
-                                
-                        except ValueError as e:
-                            print(f"     ❌ ERROR parseando fecha: {e}")  # Debug
-                            continue
-                    
-                    print(f"📊 Facturas en rango: {len(facturas_rango)}")  # Debug
-                    
-                    if facturas_rango:
-                        # Análisis por categorías y configuraciones
-                        categorias_ingresos = {}
-                        configuraciones_ingresos = {}
-                        recursos_ingresos = {}
-                        
-                        for factura in facturas_rango:
-                            print(f"📋 Procesando factura {factura['id']} con {len(factura['detalles'])} detalles")  # Debug
-                            
-                            for detalle in factura['detalles']:
-                                # Obtener configuración
-                                instancia = get_instancia_by_id(detalle['id_instancia'])
-                                if instancia:
-                                    configuracion = get_configuracion_by_id(instancia['idConfiguracion'])
-                                    if configuracion:
-                                        categoria = get_categoria_by_id(configuracion['idCategoria'])
-                                        
-                                        # Categorías
-                                        if categoria:
-                                            cat_nombre = categoria['nombre']
-                                            if cat_nombre not in categorias_ingresos:
-                                                categorias_ingresos[cat_nombre] = 0
-                                            categorias_ingresos[cat_nombre] += detalle['costo_total']
-                                        
-                                        # Configuraciones
-                                        conf_nombre = configuracion['nombre']
-                                        if conf_nombre not in configuraciones_ingresos:
-                                            configuraciones_ingresos[conf_nombre] = 0
-                                        configuraciones_ingresos[conf_nombre] += detalle['costo_total']
-                                
-                                # Recursos
-                                recurso_nombre = detalle['nombre_recurso']
-                                if recurso_nombre not in recursos_ingresos:
-                                    recursos_ingresos[recurso_nombre] = 0
-                                recursos_ingresos[recurso_nombre] += detalle['costo_total']
-                        
-                        total_ingresos_valor = sum([f['montoTotal'] for f in facturas_rango])
-                        
-                        print(f"💰 Total ingresos: {total_ingresos_valor}")  # Debug
-                        print(f"📊 Categorías: {len(categorias_ingresos)}")  # Debug
-                        print(f"📊 Configuraciones: {len(configuraciones_ingresos)}")  # Debug
-                        print(f"📊 Recursos: {len(recursos_ingresos)}")  # Debug
-                        
-                        # Ordenar por ingresos y calcular porcentajes
-                        categorias_con_porcentaje = []
-                        for categoria, ingreso in sorted(categorias_ingresos.items(), key=lambda x: x[1], reverse=True):
-                            porcentaje = (ingreso / total_ingresos_valor * 100) if total_ingresos_valor > 0 else 0
-                            categorias_con_porcentaje.append((categoria, ingreso, round(porcentaje, 1)))
-                        
-                        configuraciones_con_porcentaje = []
-                        for configuracion, ingreso in sorted(configuraciones_ingresos.items(), key=lambda x: x[1], reverse=True):
-                            porcentaje = (ingreso / total_ingresos_valor * 100) if total_ingresos_valor > 0 else 0
-                            configuraciones_con_porcentaje.append((configuracion, ingreso, round(porcentaje, 1)))
-                        
-                        recursos_con_porcentaje = []
-                        for recurso, ingreso in sorted(recursos_ingresos.items(), key=lambda x: x[1], reverse=True):
-                            porcentaje = (ingreso / total_ingresos_valor * 100) if total_ingresos_valor > 0 else 0
-                            recursos_con_porcentaje.append((recurso, ingreso, round(porcentaje, 1)))
-                        
-                        context = {
-                            'form': form,
-                            'fecha_inicio': fecha_inicio.strftime('%d/%m/%Y'),
-                            'fecha_fin': fecha_fin.strftime('%d/%m/%Y'),
-                            'categorias_ingresos': categorias_con_porcentaje,
-                            'configuraciones_ingresos': configuraciones_con_porcentaje,
-                            'recursos_ingresos': recursos_con_porcentaje,
-                            'total_ingresos': total_ingresos_valor,
-                            'total_facturas': len(facturas_rango),
-                            'hay_datos': True
-                        }
+                    if analisis['total_facturas']:
+                        context = dict(analisis, form=form, hay_datos=True)
                     else:
                         # ✅ MOSTRAR FACTURAS DISPONIBLES PARA AYUDAR
-                        fechas_disponibles = []
-                        for factura in facturas:
-                            fechas_disponibles.append(factura['fechaEmision'])
-                        
                         context = {
                             'form': form,
-                            'fecha_inicio': fecha_inicio.strftime('%d/%m/%Y'),
-                            'fecha_fin': fecha_fin.strftime('%d/%m/%Y'),
+                            'fecha_inicio': analisis['fecha_inicio'],
+                            'fecha_fin': analisis['fecha_fin'],
                             'hay_datos': False,
-                            'message': f'No hay facturas emitidas en el rango seleccionado. Fechas disponibles: {", ".join(set(fechas_disponibles))}'
+                            'message': f'No hay facturas emitidas en el rango seleccionado. Fechas disponibles: {", ".join(analisis.get("fechas_disponibles", []))}'
                         }
                 else:
                     context = {'form': form, 'error': result.get('message', 'Error al obtener datos')}
@@ -647,7 +619,7 @@ def descargar_pdf_factura(request, id_factura):
             
             print(f"❌ Error del backend: {error_msg}")  # Debug
             return HttpResponse(f"Error: {error_msg}", status=400)
-            
+    
     except Exception as e:
         error_msg = f'Error al generar PDF: {str(e)}'
         print(f"❌ Error general: {error_msg}")  # Debug
@@ -665,76 +637,13 @@ def descargar_pdf_analisis(request):
                 fecha_inicio = form.cleaned_data['fecha_inicio']
                 fecha_fin = form.cleaned_data['fecha_fin']
                 
-                response = requests.get(f'{BACKEND_URL}/facturas')
-                result = response.json()
+                result = obtener_analisis_ventas(fecha_inicio, fecha_fin)
                 
                 if result.get('success'):
-                    facturas = result['facturas']
-                    facturas_rango = []
+                    datos_analisis = result['analisis']
+                    datos_analisis.pop('fechas_disponibles', None)
                     
-                    for factura in facturas:
-                        fecha_emision_str = factura['fechaEmision']
-                        fecha_emision = datetime.strptime(fecha_emision_str, '%d/%m/%Y').date()
-                        
-                        if fecha_inicio <= fecha_emision <= fecha_fin:
-                            facturas_rango.append(factura)
-                    
-                    if facturas_rango:
-                        categorias_ingresos = {}
-                        configuraciones_ingresos = {}
-                        recursos_ingresos = {}
-                        
-                        for factura in facturas_rango:
-                            for detalle in factura['detalles']:
-                                instancia = get_instancia_by_id(detalle['id_instancia'])
-                                if instancia:
-                                    configuracion = get_configuracion_by_id(instancia['idConfiguracion'])
-                                    if configuracion:
-                                        categoria = get_categoria_by_id(configuracion['idCategoria'])
-                                        
-                                        if categoria:
-                                            cat_nombre = categoria['nombre']
-                                            if cat_nombre not in categorias_ingresos:
-                                                categorias_ingresos[cat_nombre] = 0
-                                            categorias_ingresos[cat_nombre] += detalle['costo_total']
-                                        
-                                        conf_nombre = configuracion['nombre']
-                                        if conf_nombre not in configuraciones_ingresos:
-                                            configuraciones_ingresos[conf_nombre] = 0
-                                        configuraciones_ingresos[conf_nombre] += detalle['costo_total']
-                                
-                                recurso_nombre = detalle['nombre_recurso']
-                                if recurso_nombre not in recursos_ingresos:
-                                    recursos_ingresos[recurso_nombre] = 0
-                                recursos_ingresos[recurso_nombre] += detalle['costo_total']
-                        
-                        total_ingresos_valor = sum([f['montoTotal'] for f in facturas_rango])
-                        
-                        categorias_con_porcentaje = []
-                        for categoria, ingreso in sorted(categorias_ingresos.items(), key=lambda x: x[1], reverse=True):
-                            porcentaje = (ingreso / total_ingresos_valor * 100) if total_ingresos_valor > 0 else 0
-                            categorias_con_porcentaje.append((categoria, ingreso, round(porcentaje, 1)))
-                        
-                        configuraciones_con_porcentaje = []
-                        for configuracion, ingreso in sorted(configuraciones_ingresos.items(), key=lambda x: x[1], reverse=True):
-                            porcentaje = (ingreso / total_ingresos_valor * 100) if total_ingresos_valor > 0 else 0
-                            configuraciones_con_porcentaje.append((configuracion, ingreso, round(porcentaje, 1)))
-                        
-                        recursos_con_porcentaje = []
-                        for recurso, ingreso in sorted(recursos_ingresos.items(), key=lambda x: x[1], reverse=True):
-                            porcentaje = (ingreso / total_ingresos_valor * 100) if total_ingresos_valor > 0 else 0
-                            recursos_con_porcentaje.append((recurso, ingreso, round(porcentaje, 1)))
-                        
-                        datos_analisis = {
-                            'fecha_inicio': fecha_inicio.strftime('%d/%m/%Y'),
-                            'fecha_fin': fecha_fin.strftime('%d/%m/%Y'),
-                            'categorias_ingresos': categorias_con_porcentaje,
-                            'configuraciones_ingresos': configuraciones_con_porcentaje,
-                            'recursos_ingresos': recursos_con_porcentaje,
-                            'total_ingresos': total_ingresos_valor,
-                            'total_facturas': len(facturas_rango)
-                        }
-                        
+                    if datos_analisis['total_facturas']:
                         pdf_response = requests.post(
                             f'{BACKEND_URL}/generar-pdf-analisis-ventas',
                             json=datos_analisis
@@ -756,36 +665,17 @@ def descargar_pdf_analisis(request):
                     return HttpResponse("Error al obtener datos del backend", status=500)
             else:
                 return HttpResponse("Formulario inválido", status=400)
-                
+        
         except Exception as e:
             return HttpResponse(f"Error: {str(e)}", status=500)
     
     return HttpResponse("Método no permitido", status=405)
 
 # Funciones auxiliares
-def get_instancia_by_id(id_instancia):
-    try:
-        response = requests.get(f'{BACKEND_URL}/instancia/{id_instancia}')
-        result = response.json()
-        if result.get('success'):
-            return result['instancia']
-    except Exception:
-        return None
-
-def get_configuracion_by_id(id_configuracion):
-    try:
-        response = requests.get(f'{BACKEND_URL}/configuracion/{id_configuracion}')
-        result = response.json()
-        if result.get('success'):
-            return result['configuracion']
-    except Exception:
-        return None
-
-def get_categoria_by_id(id_categoria):
-    try:
-        response = requests.get(f'{BACKEND_URL}/categoria/{id_categoria}')
-        result = response.json()
-        if result.get('success'):
-            return result['categoria']
-    except Exception:
-        return None
\ No newline at end of file
+def obtener_analisis_ventas(fecha_inicio, fecha_fin):
+    """Ingresos por categoría, configuración y recurso calculados por el backend para el rango de fechas"""
+    response = requests.get(f'{BACKEND_URL}/analisisVentas', params={
+        'desde': fecha_inicio.strftime('%d/%m/%Y'),
+        'hasta': fecha_fin.strftime('%d/%m/%Y')
+    })
+    return response.json()